@@ -0,0 +1,440 @@
+"""
+Hot/cold partitioning of work items.
+
+Most work items in a long running project are done and stay done, yet
+every run fetches them again, walks their changelogs and rebuilds their
+histories and cycle times.  With an archive each sync freezes the work
+items which are done into a compact, immutable archive of flat arrays:
+
+    - what we need to know about each work item
+    - its state transitions and changelog field changes
+    - the runs of days it spent in each state, its intervals
+
+The next sync only fetches the hot set - work which isn't done, or was
+updated since the last sync - from JIRA, and rebuilds the cold work items
+from the archive.  Their cycle times come from the stored runs and their
+daily histories are only built if a report asks for them.  A cold work
+item which is fetched again, e.g. because it was reopened, replaces its
+archived self.
+
+The archive keeps every done work item it has seen, even those resolved
+before the window a sync reports on, and remembers how far back it has
+fetched them.  A sync which goes back further fetches its window again.
+
+Only done work items which come back from JIRA are replaced, so one
+which is deleted, or no longer matches its category's JQL, stays in the
+archive.  Delete the archive's directory to be rid of them.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from dateutil.tz import tzutc, tzoffset
+
+from history import time_in_states_from_status_changes, history_from_time_in_states, cycle_times
+from jql import split_order_by
+from transitions import day_number, day_date
+from work import WorkItem
+
+_EPOCH = datetime(1970, 1, 1)
+
+# The offset we keep for a timestamp without a timezone
+
+_NAIVE = -1 << 31
+
+_timezones = {0: tzutc()}
+
+
+def _instant(timestamp):
+    """
+    Microseconds since 1970 of a timestamp's wall time in its own
+    timezone, so that it falls on the same day it did in JIRA, and its
+    UTC offset in seconds
+    """
+
+    wall = timestamp.replace(tzinfo=None) - _EPOCH
+    offset = timestamp.utcoffset()
+
+    return ((wall.days * 86400 + wall.seconds) * 1000000 + wall.microseconds,
+            _NAIVE if offset is None else offset.days * 86400 + offset.seconds)
+
+
+def _timestamp(micros, offset):
+
+    timestamp = _EPOCH + timedelta(microseconds=micros)
+
+    if offset == _NAIVE:
+        return timestamp
+
+    if offset not in _timezones:
+        _timezones[offset] = tzoffset(None, offset)
+
+    return timestamp.replace(tzinfo=_timezones[offset])
+
+
+class _Names(object):
+    """
+    Codes for a list of names, e.g. states, as they are first seen
+    """
+
+    def __init__(self, names=None):
+
+        self.names = list(names or [])
+        self.codes = dict((name, code) for code, name in enumerate(self.names))
+
+    def code(self, name):
+
+        try:
+            return self.codes[name]
+        except KeyError:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+            return self.codes[name]
+
+
+class ColdWorkItem(WorkItem):
+    """
+    A work item from the archive.  Its daily history is built from its
+    runs the first time it is asked for.
+    """
+
+    def __init__(self, runs, from_date, **kwargs):
+
+        self.runs = runs
+        self._from_date = from_date
+        self._history = None
+
+        WorkItem.__init__(self, history=None, **kwargs)
+
+    @property
+    def history(self):
+
+        if self._history is None and self.runs is not None:
+            self._history = history_from_time_in_states(self.runs, self.date_created, self._from_date)
+
+        return self._history
+
+    @history.setter
+    def history(self, history):
+
+        self._history = history
+
+    def to_JSON(self):
+
+        return WorkItem(id=self.id,
+                        title=self.title,
+                        state=self.state,
+                        type=self.type,
+                        history=self.history,
+                        date_created=self.date_created,
+                        state_transitions=self.state_transitions,
+                        category=self.category,
+                        cycles=self.cycles,
+                        field_transitions=self.field_transitions).to_JSON()
+
+
+def hot_jql(jql, done_states, since):
+    """
+    Restrict jql to issues which aren't done or were updated on or after
+    since, keeping any ORDER BY clause at the end
+    """
+
+    # Without done states nothing is ever archived, so every issue is hot
+
+    if len(done_states) == 0:
+        return jql
+
+    jql, order_by = split_order_by(jql)
+
+    states = ', '.join(['"{0}"'.format(state) for state in done_states])
+
+    return '({0}) AND (status NOT IN ({1}) OR updated >= "{2}"){3}'.format(jql,
+                                                                          states,
+                                                                          since.strftime('%Y-%m-%d'),
+                                                                          order_by)
+
+
+class ColdArchive(object):
+    """
+    The done work items of a set of categories, with the history of
+    changelog_fields, as of the last sync, kept in a directory of their
+    own under directory
+    """
+
+    def __init__(self, directory, categories, done_states, cycles, changelog_fields=()):
+
+        key = json.dumps({'categories': categories, 'changelog_fields': sorted(changelog_fields)}, sort_keys=True)
+        self.directory = os.path.join(directory, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+        self.done_states = done_states
+        self.cycles = cycles
+
+    def _filename(self, extension):
+
+        return os.path.join(self.directory, 'cold.' + extension)
+
+    def _synced(self):
+        """
+        The day of the last sync and the first day it fetched done issues
+        from, or None if it fetched them all, or None if there has never
+        been one
+        """
+
+        try:
+            with open(self._filename('json')) as infile:
+                names = json.load(infile)
+        except IOError:
+            return None
+
+        return names['synced'], names.get('covered')
+
+    def since(self, from_date=None):
+        """
+        The day before the last sync, as JIRA compares updated in its own
+        timezone, or None if there has never been one or it didn't go as
+        far back as from_date
+        """
+
+        synced = self._synced()
+
+        if synced is None:
+            return None
+
+        synced, covered = synced
+
+        if covered is not None and (from_date is None or day_number(from_date) < covered):
+            return None
+
+        return day_date(synced) - timedelta(days=1)
+
+    def covered(self):
+        """
+        The first day the archive has done issues from, or None if it has
+        them all
+        """
+
+        synced = self._synced()
+
+        if synced is None or synced[1] is None:
+            return None
+
+        return day_date(synced[1])
+
+    def load(self, until_date=None, from_date=None, left_out=None):
+        """
+        The archived work items, leaving out any resolved before from_date
+        as a windowed search would.  Those left out are added to left_out,
+        if given, so that saving the archive again can keep them.
+        """
+
+        try:
+            with open(self._filename('json')) as infile:
+                names = json.load(infile)
+            with open(self._filename('npz'), 'rb') as infile:
+                stored = np.load(infile)
+                arrays = dict((name, stored[name].tolist()) for name in stored.files)
+        except IOError:
+            return []
+
+        until = None if until_date is None else day_number(until_date)
+        window = None if from_date is None else day_number(from_date)
+
+        states = names['states']
+
+        def by_item(item, count):
+            """
+            Positions of each item's rows, as start and end of a slice
+            """
+            ends = np.cumsum(np.bincount(np.asarray(item, dtype=np.int64), minlength=count))
+            return np.concatenate([[0], ends[:-1]]), ends
+
+        count = len(names['ids'])
+
+        transition_start, transition_end = by_item(arrays['transition_item'], count)
+        run_start, run_end = by_item(arrays['run_item'], count)
+
+        fields = {}
+        for field in names['fields']:
+            prefix = 'field_{0}_'.format(names['fields'].index(field))
+            starts, ends = by_item(arrays[prefix + 'item'], count)
+            fields[field] = (prefix, starts, ends, names['field_values'][field])
+
+        work_items = []
+
+        for index in range(count):
+
+            outside = window is not None and arrays['last_change'][index] < window
+
+            if outside and left_out is None:
+                continue
+
+            # Newest first, as JIRA work items keep them
+
+            rows = slice(transition_start[index], transition_end[index])
+
+            transitions = [{'from': states[from_state],
+                            'to': states[to_state],
+                            'timestamp': _timestamp(micros, offset)}
+                           for from_state, to_state, micros, offset in
+                           zip(arrays['transition_from'][rows],
+                               arrays['transition_to'][rows],
+                               arrays['transition_time'][rows],
+                               arrays['transition_offset'][rows])][::-1]
+
+            rows = slice(run_start[index], run_end[index])
+
+            runs = [{'state': states[state], 'days': days}
+                    for state, days in zip(arrays['run_state'][rows], arrays['run_days'][rows])]
+
+            # The runs were counted up to the last sync, so bring the
+            # state the work item is still in up to date
+
+            if until is None:
+                runs[-1]['days'] = 1
+            else:
+                runs[-1]['days'] = until - arrays['last_change'][index]
+
+            field_transitions = None
+            if len(fields) > 0:
+                field_transitions = {}
+                for field, (prefix, starts, ends, values) in fields.items():
+                    rows = slice(starts[index], ends[index])
+                    field_transitions[field] = [{'from': values[from_value],
+                                                 'to': values[to_value],
+                                                 'timestamp': _timestamp(micros, offset)}
+                                                for from_value, to_value, micros, offset in
+                                                zip(arrays[prefix + 'from'][rows],
+                                                    arrays[prefix + 'to'][rows],
+                                                    arrays[prefix + 'time'][rows],
+                                                    arrays[prefix + 'offset'][rows])][::-1]
+
+            work_item = ColdWorkItem(runs=runs,
+                                     from_date=from_date,
+                                     id=names['ids'][index],
+                                     title=names['titles'][index],
+                                     state=states[arrays['state'][index]],
+                                     type=names['types'][arrays['type'][index]],
+                                     date_created=datetime.combine(day_date(arrays['created'][index]), datetime.min.time()),
+                                     state_transitions=transitions,
+                                     category=names['categories'][arrays['category'][index]],
+                                     cycles=cycle_times(self.cycles, runs),
+                                     field_transitions=field_transitions)
+
+            if outside:
+                left_out.append(work_item)
+            else:
+                work_items.append(work_item)
+
+        return work_items
+
+    def save(self, work_items, synced, covered=None):
+        """
+        Freeze the done work items as of synced, the day the sync started,
+        replacing the archive.  covered is the first day they were fetched
+        from, or None if they were all fetched.
+        """
+
+        states = _Names()
+        types = _Names()
+        categories = _Names()
+
+        ids = []
+        titles = []
+        columns = dict((name, []) for name in ['state', 'type', 'category', 'created', 'last_change',
+                                                 'transition_item', 'transition_from', 'transition_to',
+                                                 'transition_time', 'transition_offset',
+                                                 'run_item', 'run_state', 'run_days'])
+
+        field_names = sorted(set([field for work_item in work_items
+                                  for field in (work_item.field_transitions or {})]))
+        field_values = dict((field, _Names()) for field in field_names)
+        field_columns = dict((field, {'item': [], 'from': [], 'to': [], 'time': [], 'offset': []}) for field in field_names)
+
+        for work_item in work_items:
+
+            if work_item.state not in self.done_states or work_item.state_transitions is None:
+                continue
+
+            transitions = sorted([transition for transition in work_item.state_transitions if transition is not None],
+                                 key=lambda transition: transition['timestamp'])
+
+            if len(transitions) == 0:
+                continue
+
+            index = len(ids)
+
+            runs = getattr(work_item, 'runs', None)
+            if runs is None:
+                changes = [(transition['timestamp'].isoformat(), [(transition['from'], transition['to'])])
+                           for transition in reversed(transitions)]
+                runs = time_in_states_from_status_changes(changes, from_date=work_item.date_created)
+
+            ids.append(work_item.id)
+            titles.append(work_item.title)
+
+            columns['state'].append(states.code(work_item.state))
+            columns['type'].append(types.code(work_item.type))
+            columns['category'].append(categories.code(work_item.category))
+            columns['created'].append(day_number(work_item.date_created))
+            columns['last_change'].append(day_number(transitions[-1]['timestamp']))
+
+            for transition in transitions:
+                columns['transition_item'].append(index)
+                columns['transition_from'].append(states.code(transition['from']))
+                columns['transition_to'].append(states.code(transition['to']))
+                micros, offset = _instant(transition['timestamp'])
+                columns['transition_time'].append(micros)
+                columns['transition_offset'].append(offset)
+
+            for run in runs:
+                columns['run_item'].append(index)
+                columns['run_state'].append(states.code(run['state']))
+                columns['run_days'].append(run['days'])
+
+            for field in field_names:
+                values = field_values[field]
+                changes = sorted((work_item.field_transitions or {}).get(field, []),
+                                 key=lambda transition: transition['timestamp'])
+                for transition in changes:
+                    field_columns[field]['item'].append(index)
+                    field_columns[field]['from'].append(values.code(transition['from']))
+                    field_columns[field]['to'].append(values.code(transition['to']))
+                    micros, offset = _instant(transition['timestamp'])
+                    field_columns[field]['time'].append(micros)
+                    field_columns[field]['offset'].append(offset)
+
+        arrays = dict((name, np.array(values, dtype=np.int64)) for name, values in columns.items())
+
+        for position, field in enumerate(field_names):
+            for name, values in field_columns[field].items():
+                arrays['field_{0}_{1}'.format(position, name)] = np.array(values, dtype=np.int64)
+
+        names = {'synced': day_number(synced),
+                 'covered': None if covered is None else day_number(covered),
+                 'ids': ids,
+                 'titles': titles,
+                 'states': states.names,
+                 'types': types.names,
+                 'categories': categories.names,
+                 'fields': field_names,
+                 'field_values': dict((field, field_values[field].names) for field in field_names)}
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Write then rename so an interrupted write doesn't replace the
+        # last archive with half of a new one
+
+        with open(self._filename('npz.tmp'), 'wb') as outfile:
+            np.savez_compressed(outfile, **arrays)
+
+        with open(self._filename('json.tmp'), 'w') as outfile:
+            json.dump(names, outfile)
+
+        os.rename(self._filename('npz.tmp'), self._filename('npz'))
+        os.rename(self._filename('json.tmp'), self._filename('json'))
+
+        return len(ids)
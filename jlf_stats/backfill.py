@@ -0,0 +1,244 @@
+"""
+Backfilling reports for a run of past dates.
+
+Rather than fetching and building everything again for each date, the
+work items are loaded once and we step through the dates in order,
+making a view of the work items as they were on each date.
+
+Transitions only ever get added, so stepping on to the next date only
+has to rebuild the work items which changed in between.  The rest are
+carried over, with their cycle times brought up to date if they are
+sitting in a state which makes them grow, e.g. the end state of a cycle.
+The transitions as of a date are a prefix of all of them sorted by day,
+so each view gets its transitions without walking the work items again.
+"""
+
+import copy
+from datetime import timedelta
+
+import numpy as np
+
+from history import time_in_states_from_status_changes, cycle_times
+from transitions import Transitions, day_number, work_item_transitions, work_item_field_transitions
+
+
+def as_of_dates(first, last, every=7):
+    """
+    Every 'every' days from first up to and including last
+    """
+
+    dates = []
+    day = first
+
+    while day <= last:
+        dates.append(day)
+        day += timedelta(days=every)
+
+    return dates
+
+
+def _growing_states(cycles, states):
+    """
+    The states which make a cycle time grow the longer a work item stays
+    in them - everything a cycle's time is counted up to or includes
+    """
+
+    growing = set()
+
+    for cycle in (cycles or {}).values():
+
+        for key in ['end', 'exit', 'after']:
+            if key in cycle:
+                growing.add(cycle[key])
+
+        growing.update(cycle.get('include', []))
+
+        if 'exclude' in cycle:
+            growing.update([state for state in states if state not in cycle['exclude']])
+
+    return growing
+
+
+class Backfill(object):
+    """
+    Views of the work items in metrics as they were on each of a run of
+    dates, built incrementally from one load
+    """
+
+    def __init__(self, metrics):
+
+        self.metrics = metrics
+
+        transitions = metrics.transitions()
+
+        self.work_items = metrics.work_items
+        self.cycles = metrics.config.get('cycles')
+        self.fields = metrics.config.get('changelog_fields', [])
+
+        self.created = np.array([day_number(work_item.date_created) for work_item in self.work_items], dtype=np.int64)
+
+        # Sorted by day, the transitions as of any date are a prefix
+
+        order = np.argsort(transitions.day, kind='mergesort')
+
+        self.transitions = transitions
+        self.order = order
+        self.days = transitions.day[order]
+
+        self.field_days = {}
+        for field in self.fields:
+            field_transitions = metrics.transitions(field)
+            self.field_days[field] = (field_transitions.item, field_transitions.day)
+
+        self.growing = _growing_states(self.cycles, transitions.states)
+
+        self._reset()
+
+    def _reset(self):
+
+        self.day = None
+        self.views = [None] * len(self.work_items)
+        self.runs = [None] * len(self.work_items)
+        self.counts = np.empty(len(self.work_items), dtype=np.int64)
+        self.counts.fill(-1)
+
+    def each(self, dates):
+        """
+        (date, Metrics) as of each of dates, in date order
+        """
+
+        for day in sorted(dates):
+            yield day, self.as_of(day)
+
+    def as_of(self, day):
+        """
+        A Metrics of the work items as they were on day.  Cheapest when
+        called with days in order, each after the last.
+        """
+
+        if self.day is not None and day < self.day:
+            self._reset()
+
+        number = day_number(day)
+        elapsed = 0 if self.day is None else number - day_number(self.day)
+
+        created = self.created <= number
+
+        # How many transitions each work item had made by day, so we can
+        # tell which ones changed since the last date
+
+        prefix = self.order[:np.searchsorted(self.days, number, side='right')]
+
+        counts = np.bincount(self.transitions.item[prefix], minlength=len(self.work_items))
+
+        for field in self.fields:
+            item, field_day = self.field_days[field]
+            counts += np.bincount(item[field_day <= number], minlength=len(self.work_items))
+
+        changed = created & (counts != self.counts)
+
+        for index in np.flatnonzero(changed):
+            self.views[index] = self._work_item(index, day)
+
+        for index in np.flatnonzero(created & ~changed):
+            runs = self.runs[index]
+            if runs is not None and runs[-1]['state'] in self.growing:
+                self.views[index] = self._grown(index, elapsed)
+
+        self.counts = np.where(created, counts, -1)
+        self.day = day
+
+        return self._metrics(created, prefix)
+
+    def _work_item(self, index, day):
+        """
+        The work item as it was on day, made again from its transitions
+        """
+
+        work_item = self.work_items[index]
+        view = copy.copy(work_item)
+
+        number = day_number(day)
+
+        all_transitions = [transition for transition in work_item_transitions(work_item) if transition is not None]
+        kept = [transition for transition in all_transitions if day_number(transition['timestamp']) <= number]
+
+        if isinstance(work_item.history, list):
+            view.history = kept
+        else:
+            view.state_transitions = kept
+
+        latest_first = sorted(kept, key=lambda transition: transition['timestamp'], reverse=True)
+
+        if len(latest_first) > 0:
+            view.state = latest_first[0]['to']
+        elif len(all_transitions) > 0:
+            view.state = min(all_transitions, key=lambda transition: transition['timestamp'])['from']
+
+        if work_item.field_transitions is not None:
+            view.field_transitions = dict([(field, [transition
+                                                    for transition in work_item_field_transitions(work_item, field)
+                                                    if day_number(transition['timestamp']) <= number])
+                                           for field in work_item.field_transitions])
+
+        if work_item.cycles is not None:
+
+            changes = [(transition['timestamp'].isoformat(), [(transition['from'], transition['to'])])
+                       for transition in latest_first]
+
+            self.runs[index] = time_in_states_from_status_changes(changes,
+                                                                  from_date=work_item.date_created,
+                                                                  until_date=day)
+            view.cycles = cycle_times(self.cycles, self.runs[index])
+
+        return view
+
+    def _grown(self, index, elapsed):
+        """
+        The last view of a work item whose state hasn't changed since,
+        with the days since added to its current state
+        """
+
+        view = copy.copy(self.views[index])
+
+        runs = self.runs[index]
+        runs[-1] = {'state': runs[-1]['state'], 'days': runs[-1]['days'] + elapsed}
+
+        view.cycles = cycle_times(self.cycles, runs)
+
+        return view
+
+    def _metrics(self, created, prefix):
+        """
+        A copy of metrics loaded with the views of the work items created
+        so far and the transitions made so far
+        """
+
+        metrics = copy.copy(self.metrics)
+
+        # Each view's cube is brought up to date from the last one's, and
+        # only the work items as they are now are worth saving
+
+        metrics.config = dict(metrics.config)
+        metrics.config.pop('cube', None)
+
+        metrics.load([self.views[index] for index in np.flatnonzero(created)])
+
+        # Work items keep their order, so renumber the transitions to
+        # their positions among the work items created so far
+
+        positions = np.cumsum(created) - 1
+
+        item = self.transitions.item[prefix]
+        kept = created[item]
+        prefix = prefix[kept]
+
+        metrics._transitions = Transitions(item=positions[self.transitions.item[prefix]],
+                                           day=self.transitions.day[prefix],
+                                           from_state=self.transitions.from_state[prefix],
+                                           to_state=self.transitions.to_state[prefix],
+                                           states=self.transitions.states,
+                                           ids=[view.id for view in metrics.work_items],
+                                           seconds=self.transitions.seconds[prefix])
+
+        return metrics
@@ -0,0 +1,6 @@
+"""
+Synthetic workloads and a benchmark suite for measuring how jlf performs
+as the number of work items grows.
+
+    python -m jlf_stats.benchmark.suite --sizes 1000,10000 --output bench.json
+"""
@@ -0,0 +1,394 @@
+"""
+Benchmark suite.
+
+Times the public Metrics methods, publisher.publish and the history
+module functions against synthetic workloads of increasing size.  Each
+case runs in its own process so its peak memory can be measured, and
+results are written as one JSON object per line:
+
+    {"case": "cfd", "issues": 10000, "status": "ok", "wall_seconds": 1.2,
+     "cpu_seconds": 1.1, "peak_rss_kb": 512000, "rss_growth_kb": 24000}
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def _metrics(workload, load=True):
+
+    from jlf_stats.metrics import Metrics
+
+    metrics = Metrics(config=workload.config())
+    metrics.source.jira = SyntheticJira(workload)
+
+    # No progress dots in among the results on stdout
+
+    metrics.source.progress = False
+
+    if load:
+        metrics.work_items = metrics.source.work_items()
+
+    return metrics
+
+
+def _window(workload):
+
+    from datetime import timedelta
+
+    to_date = workload.until_date.date()
+    return to_date - timedelta(weeks=26), to_date
+
+
+def _changelogs(workload):
+
+    return [(issue.changelog, issue.fields.created) for issue in workload.issues]
+
+
+def _state_transitions(workload):
+    """
+    The workload as FogBugz style state transitions
+    """
+
+    from datetime import datetime
+
+    transitions = []
+    for issue in workload.issues:
+        item_transitions = []
+        for history in reversed(issue.changelog.histories):
+            for item in history.items:
+                item_transitions.append({'from': item.fromString,
+                                         'to': item.toString,
+                                         'timestamp': datetime.strptime(history.created[:19], '%Y-%m-%dT%H:%M:%S')})
+        created = datetime.strptime(issue.fields.created[:10], '%Y-%m-%d').date()
+        transitions.append((created, item_transitions))
+    return transitions
+
+
+###############################################################################
+# Cases - each takes a workload, does its setup and returns a function to time
+###############################################################################
+
+
+def case_work_items(workload):
+    metrics = _metrics(workload, load=False)
+    return lambda: metrics.source.work_items()
+
+
+def case_work_items_resources(workload):
+    metrics = _metrics(workload, load=False)
+    metrics.source.jira = SyntheticJira(workload, resources=True)
+    metrics.source.ingest = 'resources'
+    return lambda: metrics.source.work_items()
+
+
+def case_work_item(workload):
+    metrics = _metrics(workload)
+    key = workload.issues[-1].key
+    return lambda: metrics.work_item(key)
+
+
+def case_details(workload):
+    metrics = _metrics(workload)
+    return lambda: metrics.details()
+
+
+def case_history(workload):
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    return lambda: metrics.history(from_date, to_date)
+
+
+def case_throughput(workload):
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    return lambda: metrics.throughput(from_date, to_date, cumulative=False, types=list(workload.types))
+
+
+def case_cfd(workload):
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    return lambda: metrics.cfd(from_date, to_date)
+
+
+def case_cycle_time_histogram(workload):
+    metrics = _metrics(workload)
+    return lambda: metrics.cycle_time_histogram(['develop', 'deliver'], types=list(workload.types), buckets=[0, 5, 10, 20, 'max'])
+
+
+def case_demand(workload):
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    return lambda: metrics.demand(from_date, to_date, types=list(workload.types))
+
+
+def case_arrival_rate(workload):
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    return lambda: metrics.arrival_rate(from_date, to_date)
+
+
+def case_transitions(workload):
+    metrics = _metrics(workload)
+
+    def run():
+        metrics._transitions = None
+        return metrics.transitions()
+
+    return run
+
+
+def case_save_work_items(workload):
+    metrics = _metrics(workload)
+    filename = os.path.join(tempfile.mkdtemp(), 'bench.json')
+    return lambda: metrics.save_work_items(filename)
+
+
+def case_publish(workload):
+    from jlf_stats import publisher
+    metrics = _metrics(workload)
+    from_date, to_date = _window(workload)
+    config = workload.config()
+    config['location'] = tempfile.mkdtemp()
+    return lambda: publisher.publish(config, metrics, from_date=from_date, to_date=to_date)
+
+
+def case_time_in_states(workload):
+    from jlf_stats.history import time_in_states, extract_date
+    changelogs = [(changelog.histories, extract_date(created)) for changelog, created in _changelogs(workload)]
+    until_date = workload.until_date.date()
+    return lambda: [time_in_states(histories, created, until_date) for histories, created in changelogs]
+
+
+def case_history_from_jira_changelog(workload):
+    from jlf_stats.history import history_from_jira_changelog, extract_date
+    changelogs = [(changelog, extract_date(created)) for changelog, created in _changelogs(workload)]
+    until_date = workload.until_date.date()
+    return lambda: [history_from_jira_changelog(changelog, created, until_date) for changelog, created in changelogs]
+
+
+def case_history_from_state_transitions(workload):
+    from jlf_stats.history import history_from_state_transitions
+    transitions = _state_transitions(workload)
+    until_date = workload.until_date.date()
+    return lambda: [history_from_state_transitions(created, item_transitions, until_date)
+                    for created, item_transitions in transitions]
+
+
+def case_cycle_time(workload):
+    from jlf_stats.history import cycle_time
+    metrics = _metrics(workload)
+    histories = [work_item.history for work_item in metrics.work_items]
+    return lambda: [cycle_time(history, start_state='In Progress', end_state='Closed') for history in histories]
+
+
+def case_arrivals(workload):
+    from jlf_stats.history import arrivals
+
+    def run():
+        counts = {}
+        for issue in workload.issues:
+            counts = arrivals(issue.changelog.histories, counts)
+        return counts
+
+    return run
+
+
+CASES = [('work_items',                    case_work_items),
+         ('work_items_resources',          case_work_items_resources),
+         ('work_item',                     case_work_item),
+         ('details',                       case_details),
+         ('history',                       case_history),
+         ('throughput',                    case_throughput),
+         ('cfd',                           case_cfd),
+         ('cycle_time_histogram',          case_cycle_time_histogram),
+         ('demand',                        case_demand),
+         ('arrival_rate',                  case_arrival_rate),
+         ('transitions',                   case_transitions),
+         ('save_work_items',               case_save_work_items),
+         ('publish',                       case_publish),
+         ('time_in_states',                case_time_in_states),
+         ('history_from_jira_changelog',   case_history_from_jira_changelog),
+         ('history_from_state_transitions', case_history_from_state_transitions),
+         ('cycle_time',                    case_cycle_time),
+         ('arrivals',                      case_arrivals)]
+
+
+###############################################################################
+# Running
+###############################################################################
+
+
+def _peak_rss_kb():
+    """
+    Peak resident set size of this process.  Linux reports kilobytes,
+    OS X reports bytes.
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak
+
+
+def _cpu_seconds():
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(case, num_issues, seed=0):
+    """
+    Generate a workload, set up the case and time it in this process
+    """
+
+    result = {'case': case, 'issues': num_issues}
+
+    workload = generate(num_issues, seed=seed)
+    run = dict(CASES)[case](workload)
+
+    workspace = tempfile.mkdtemp()
+    saved_path = os.getcwd()
+    os.chdir(workspace)
+
+    try:
+        rss_before = _peak_rss_kb()
+        cpu_before = _cpu_seconds()
+        wall_before = time.time()
+
+        run()
+
+        result['wall_seconds'] = time.time() - wall_before
+        result['cpu_seconds'] = _cpu_seconds() - cpu_before
+        result['peak_rss_kb'] = _peak_rss_kb()
+        result['rss_growth_kb'] = result['peak_rss_kb'] - rss_before
+        result['status'] = 'ok'
+
+    finally:
+        os.chdir(saved_path)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    return result
+
+
+def _measure_in_child(queue, case, num_issues, seed):
+
+    try:
+        queue.put(measure(case, num_issues, seed))
+    except Exception:
+        queue.put({'case': case,
+                   'issues': num_issues,
+                   'status': 'error',
+                   'error': traceback.format_exc()})
+
+
+def run_case(case, num_issues, seed=0, timeout=None):
+    """
+    Measure a case in a fresh process so that memory used by one case
+    does not count against the next
+    """
+
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_measure_in_child, args=(queue, case, num_issues, seed))
+    child.start()
+    child.join(timeout)
+
+    if child.is_alive():
+        child.terminate()
+        child.join()
+        return {'case': case, 'issues': num_issues, 'status': 'timeout', 'timeout_seconds': timeout}
+
+    if queue.empty():
+        return {'case': case, 'issues': num_issues, 'status': 'error', 'exitcode': child.exitcode}
+
+    return queue.get()
+
+
+def run(sizes=None, cases=None, seed=0, timeout=None, output=None):
+
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+
+    if cases is None:
+        cases = [name for name, case in CASES]
+
+    results = []
+
+    for num_issues in sizes:
+        for case in cases:
+            result = run_case(case, num_issues, seed, timeout)
+            results.append(result)
+
+            if output is not None:
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+                output.flush()
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark jlf against synthetic workloads')
+
+    parser.add_argument('--sizes',
+                        action="store",
+                        dest="sizes",
+                        default=','.join([str(size) for size in DEFAULT_SIZES]),
+                        help="Comma separated numbers of issues")
+
+    parser.add_argument('--cases',
+                        action="store",
+                        dest="cases",
+                        default=None,
+                        help="Comma separated cases to run, from: " + ', '.join([name for name, case in CASES]))
+
+    parser.add_argument('--seed',
+                        action="store",
+                        dest="seed",
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--timeout',
+                        action="store",
+                        dest="timeout",
+                        type=float,
+                        default=None,
+                        help="Give up on a case after this many seconds")
+
+    parser.add_argument('--output',
+                        action="store",
+                        dest="output",
+                        default=None,
+                        help="File to write JSON lines to, default stdout")
+
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    cases = None
+    if args.cases is not None:
+        cases = args.cases.split(',')
+        unknown = [case for case in cases if case not in dict(CASES)]
+        if unknown:
+            sys.exit("Unknown cases:{0}".format(', '.join(unknown)))
+
+    if args.output is None:
+        run(sizes, cases, args.seed, args.timeout, sys.stdout)
+    else:
+        with open(args.output, 'w') as output:
+            run(sizes, cases, args.seed, args.timeout, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Synthetic JIRA workloads.
+
+Generates issues which walk a workflow state graph over a span of time.
+Issues are available both as objects shaped like the JIRA client's
+Resources (and the test mocks) and as the raw JSON returned by the
+JIRA REST search endpoint, so they can be fed through the same code
+paths as real data.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from jlf_stats.jql import predicate, UnsupportedJql
+
+DEFAULT_WORKFLOW = {
+    'Open':        ['In Progress'],
+    'In Progress': ['PR Review'],
+    'PR Review':   ['In Progress', 'QA', 'QA', 'QA'],
+    'QA':          ['In Progress', 'Closed', 'Closed', 'Closed'],
+    'Closed':      ['Reopened'],
+    'Reopened':    ['In Progress']
+}
+
+DEFAULT_STATES = ['Open', 'In Progress', 'PR Review', 'QA', 'Closed', 'Reopened']
+
+DEFAULT_TYPES = {
+    'failure': ['Bug'],
+    'value': ['Story', 'Improvement'],
+    'overhead': ['Task']
+}
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.000+0000'
+
+_ORDER_BY = re.compile(r'^(.*) ORDER BY (\w+) (ASC|DESC)$')
+_AFTER_KEY = re.compile(r'^\((.*)\) AND key > "([^"]+)"$')
+_CREATED_BETWEEN = re.compile(r'^\((.*)\) AND created >= "([\d-]+)" AND created < "([\d-]+)"$')
+_WINDOW = re.compile(r'^\((.*)\) AND \(resolutiondate is EMPTY OR resolutiondate >= "([\d-]+)"\)$')
+_HOT = re.compile(r'^\((.*)\) AND \(status NOT IN \(([^)]*)\) OR updated >= "([\d-]+)"\)$')
+
+
+def _key_order(key):
+    """
+    Issue keys sort by project then number, as JIRA sorts them
+    """
+
+    project, number = key.rsplit('-', 1)
+    return (project, int(number))
+
+
+def _updated(issue):
+    """
+    When an issue last changed, which is all JIRA's updated means here
+    """
+
+    if len(issue.changelog.histories) > 0:
+        return issue.changelog.histories[0].created
+
+    return issue.fields.created
+
+
+class Named(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Fields(object):
+
+    def __init__(self, created, summary, status, issuetype, resolutiondate, project):
+        self.created = created
+        self.summary = summary
+        self.status = Named(status)
+        self.issuetype = Named(issuetype)
+        self.resolutiondate = resolutiondate
+        self.project = Named(project)
+        self.components = []
+        self.labels = []
+
+
+class Item(object):
+
+    def __init__(self, field, fromString, toString):
+        self.field = field
+        self.fromString = fromString
+        self.toString = toString
+
+
+class History(object):
+
+    def __init__(self, created, items):
+        self.created = created
+        self.items = items
+
+
+class Changelog(object):
+    """
+    Histories are held most recent first, as the mocks and
+    history.time_in_states expect
+    """
+
+    def __init__(self, histories):
+        self.histories = histories
+
+
+class Issue(object):
+
+    def __init__(self, key, fields, changelog):
+        self.key = key
+        self.fields = fields
+        self.changelog = changelog
+
+
+class Workload(object):
+    """
+    A set of synthetic issues along with the config needed to report on them
+    """
+
+    def __init__(self, issues, categories, types, states, done_states, until_date):
+        self.issues = issues
+        self.categories = categories
+        self.types = types
+        self.states = states
+        self.done_states = done_states
+        self.until_date = until_date
+
+    def by_category(self):
+
+        issues = {}
+        for category in self.categories:
+            issues[category] = []
+
+        for issue in self.issues:
+            issues[issue.category].append(issue)
+
+        return issues
+
+    def config(self, reports=None):
+        """
+        A jlf config which reports on this workload
+        """
+
+        categories = {}
+        for category in self.categories:
+            categories[category] = "project = '{0}'".format(category)
+
+        if reports is None:
+            reports = [{'metric': 'throughput', 'categories': 'foreach', 'types': 'foreach'},
+                       {'metric': 'demand', 'categories': 'foreach', 'types': list(self.types)},
+                       {'metric': 'cycle-time', 'types': list(self.types), 'cycles': ['develop', 'deliver']},
+                       {'metric': 'arrival-rate'}]
+
+        return {'source': {'type': 'jira',
+                           'server': 'https://synthetic.example.com',
+                           'authentication': {'username': 'bench', 'password': 'bench'}},
+                'categories': categories,
+                'types': self.types,
+                'states': list(self.states),
+                'counts_towards_throughput': list(self.done_states),
+                'cycles': {'develop': {'start': 'In Progress', 'end': 'QA', 'ignore': 'Reopened'},
+                           'deliver': {'start': 'In Progress', 'end': 'Closed', 'ignore': 'Reopened'}},
+                'until_date': self.until_date.strftime('%Y-%m-%d'),
+                'name': 'bench',
+                'format': 'xlsx',
+                'location': '.',
+                'reports': reports}
+
+
+class SyntheticJira(object):
+    """
+    Stands in for jira.client.JIRA, serving a workload by category JQL.
+
+    With resources=True issues are served as the client's own Resources,
+    built from the JSON as the client would, rather than lightweight
+    stand-ins.
+    """
+
+    def __init__(self, workload, resources=False):
+
+        self.resources = resources
+        self.searches = 0
+        self.all_issues = workload.issues
+        self.issues = {}
+        by_category = workload.by_category()
+        for category, jql in workload.config()['categories'].iteritems():
+            self.issues[jql] = by_category[category]
+
+    def search_issues(self, jql, startAt=0, maxResults=50, validate_query=True, fields=None, expand=None, json_result=None):
+
+        self.searches += 1
+
+        issues = self._query(jql)
+        page = issues[startAt:startAt + maxResults]
+
+        if json_result:
+            return {'startAt': startAt,
+                    'maxResults': maxResults,
+                    'total': len(issues),
+                    'issues': [raw_issue(issue) for issue in page]}
+
+        if self.resources:
+            from jira.resources import Issue as Resource
+            return [Resource({'server': 'https://synthetic.example.com'}, None, raw=raw_issue(issue)) for issue in page]
+
+        return page
+
+    def _query(self, jql):
+        """
+        The issues matching a category's JQL, along with the clauses
+        JiraWrapper adds to page through it by key or created date
+        """
+
+        issues = self.issues.get(jql)
+        if issues is not None:
+            return issues
+
+        match = _ORDER_BY.match(jql)
+        if match is not None:
+            base, field, direction = match.groups()
+            if field == 'key':
+                order = lambda issue: _key_order(issue.key)
+            else:
+                order = lambda issue: getattr(issue.fields, field)
+            return sorted(self._query(base), key=order, reverse=direction == 'DESC')
+
+        match = _AFTER_KEY.match(jql)
+        if match is not None:
+            base, after_key = match.groups()
+            after_project, after_number = _key_order(after_key)
+
+            # As in JIRA, only issues in after_key's own project come after it
+
+            return [issue for issue in self._query(base)
+                    if _key_order(issue.key)[0] == after_project and _key_order(issue.key)[1] > after_number]
+
+        match = _CREATED_BETWEEN.match(jql)
+        if match is not None:
+            base, start, end = match.groups()
+            return [issue for issue in self._query(base) if start <= issue.fields.created[:10] < end]
+
+        match = _WINDOW.match(jql)
+        if match is not None:
+            base, from_date = match.groups()
+            return [issue for issue in self._query(base)
+                    if issue.fields.resolutiondate is None or issue.fields.resolutiondate[:10] >= from_date]
+
+        match = _HOT.match(jql)
+        if match is not None:
+            base, done_states, since = match.groups()
+            done_states = re.findall(r'"([^"]*)"', done_states)
+            return [issue for issue in self._query(base)
+                    if issue.fields.status.name not in done_states or _updated(issue)[:10] >= since]
+
+        return self._matching(jql)
+
+    def _matching(self, jql):
+        """
+        The issues matching any other JQL we can evaluate, e.g. several
+        categories ORed together
+        """
+
+        try:
+            matches = predicate(jql)
+        except UnsupportedJql:
+            return []
+
+        return [issue for issue in self.all_issues
+                if matches({'project': [issue.fields.project.name],
+                            'component': [],
+                            'labels': [],
+                            'issuetype': [issue.fields.issuetype.name]})]
+
+
+def generate(num_issues,
+             categories=None,
+             types=None,
+             workflow=None,
+             states=None,
+             done_states=None,
+             start_date=datetime(2013, 1, 1),
+             span_days=730,
+             mean_changes=6,
+             mean_days_in_state=4.0,
+             seed=0):
+    """
+    Generate num_issues issues created uniformly over span_days from
+    start_date, each taking a random walk through the workflow state graph
+    of on average mean_changes transitions.
+    """
+
+    if categories is None:
+        categories = ['alpha', 'beta', 'gamma']
+
+    if types is None:
+        types = DEFAULT_TYPES
+
+    if workflow is None:
+        workflow = DEFAULT_WORKFLOW
+
+    if states is None:
+        states = DEFAULT_STATES
+
+    if done_states is None:
+        done_states = ['Closed']
+
+    random = np.random.RandomState(seed)
+    until_date = start_date + timedelta(days=span_days)
+
+    issue_types = sorted([issue_type for grouping in types.values() for issue_type in grouping])
+
+    issue_category = random.randint(len(categories), size=num_issues)
+    issue_type = random.randint(len(issue_types), size=num_issues)
+    created_offset = random.uniform(0, span_days, size=num_issues)
+    num_changes = random.poisson(mean_changes, size=num_issues)
+
+    issues = []
+
+    for n in range(num_issues):
+
+        created = start_date + timedelta(days=created_offset[n])
+        state = states[0]
+        when = created
+        resolved = None
+        histories = []
+
+        waits = random.exponential(mean_days_in_state, size=num_changes[n])
+        for wait in waits:
+
+            when = when + timedelta(days=wait)
+            if when >= until_date:
+                break
+
+            to_state = workflow[state][random.randint(len(workflow[state]))]
+            histories.append(History(when.strftime(_TIMESTAMP_FORMAT),
+                                     [Item('status', state, to_state)]))
+
+            if to_state in done_states and resolved is None:
+                resolved = when.strftime(_TIMESTAMP_FORMAT)
+
+            state = to_state
+
+        category = categories[issue_category[n]]
+        fields = Fields(created=created.strftime(_TIMESTAMP_FORMAT),
+                        summary='Synthetic issue {0}'.format(n),
+                        status=state,
+                        issuetype=issue_types[issue_type[n]],
+                        resolutiondate=resolved,
+                        project=category)
+
+        issue = Issue('{0}-{1}'.format(category.upper(), n), fields, Changelog(histories[::-1]))
+        issue.category = category
+        issues.append(issue)
+
+    return Workload(issues=issues,
+                    categories=categories,
+                    types=types,
+                    states=states,
+                    done_states=done_states,
+                    until_date=until_date)
+
+
+def raw_issue(issue):
+    """
+    The JSON the JIRA REST search endpoint returns for an issue with
+    expand=changelog
+    """
+
+    f = issue.fields
+
+    histories = [{'created': history.created,
+                  'items': [{'field': item.field,
+                             'fieldtype': 'jira',
+                             'fromString': item.fromString,
+                             'toString': item.toString} for item in history.items]}
+                 for history in issue.changelog.histories]
+
+    return {'key': issue.key,
+            'fields': {'created': f.created,
+                       'summary': f.summary,
+                       'status': {'name': f.status.name},
+                       'issuetype': {'name': f.issuetype.name},
+                       'resolutiondate': f.resolutiondate,
+                       'project': {'name': f.project.name},
+                       'components': [],
+                       'labels': []},
+            'changelog': {'startAt': 0,
+                          'maxResults': len(histories),
+                          'total': len(histories),
+                          'histories': histories}}
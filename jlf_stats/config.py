@@ -0,0 +1,363 @@
+"""
+Config checking.
+
+Finds mistakes in a config without connecting to JIRA or FogBugz or
+importing any of the heavy libraries, so that a typo in a report can be
+caught in milliseconds rather than at the end of a long run.
+"""
+
+import os
+from datetime import datetime
+
+METRICS = ['throughput',
+           'cumulative-throughput',
+           'cfd',
+           'demand',
+           'detail',
+           'done',
+           'cycle-time',
+           'cycle-time-percentiles',
+           'aging',
+           'flow-efficiency',
+           'time-in-state',
+           'snapshot',
+           'arrival-rate',
+           'history',
+           'forecast']
+
+# Metrics which need to know the order of the states
+
+STATE_METRICS = ['cfd', 'history']
+
+# Metrics which can report on another changelog field instead of status
+
+FIELD_METRICS = ['time-in-state', 'snapshot', 'arrival-rate']
+
+
+def check(config):
+    """
+    Return a list of everything wrong with config.  An empty list means
+    the config is good to go.
+    """
+
+    problems = []
+
+    problems.extend(_check_source(config))
+
+    required_items = ['types', 'counts_towards_throughput', 'cycles', 'reports', 'format', 'name']
+
+    # Federated sources may each have their own categories instead
+
+    sources = config.get('source')
+    if not (isinstance(sources, list) and all(['categories' in source for source in sources])):
+        required_items.insert(0, 'categories')
+
+    for required in required_items:
+        if required not in config:
+            problems.append("Missing config item:{0}".format(required))
+
+    types = config.get('types') or {}
+    cycles = config.get('cycles') or {}
+    states = config.get('states')
+
+    if not isinstance(types, dict):
+        problems.append("types should map each type grouping to a list of issue types")
+        types = {}
+
+    if not isinstance(cycles, dict):
+        problems.append("cycles should map each cycle name to its states")
+        cycles = {}
+
+    for name in ['from_date', 'until_date']:
+        if name in config:
+            try:
+                datetime.strptime(config[name], '%Y-%m-%d')
+            except (ValueError, TypeError):
+                problems.append("{0} should be YYYY-MM-DD:{1}".format(name, config[name]))
+
+    if states is not None:
+
+        for state in config.get('counts_towards_throughput') or []:
+            if state not in states:
+                problems.append("counts_towards_throughput state not in states:{0}".format(state))
+
+    fields = config.get('changelog_fields', [])
+
+    if not (isinstance(fields, list) and all([isinstance(field, basestring) for field in fields])):
+        problems.append("changelog_fields should be a list of field names")
+        fields = []
+
+    for name, cycle in cycles.items():
+        problems.extend(_check_cycle(name, cycle, states))
+
+    for index, report in enumerate(config.get('reports') or []):
+        problems.extend(_check_report(index, report, types, cycles, states, fields))
+
+    if config.get('format', 'xlsx') != 'xlsx':
+        problems.append("Unknown format:{0}".format(config['format']))
+
+    location = config.get('location', '.')
+    if not os.path.isdir(location):
+        problems.append("location is not a directory:{0}".format(location))
+
+    if 'cube' in config and not isinstance(config['cube'], basestring):
+        problems.append("cube should be a directory:{0}".format(config['cube']))
+
+    if 'matrix' in config and not isinstance(config['matrix'], basestring):
+        problems.append("matrix should be a directory:{0}".format(config['matrix']))
+
+    budget = config.get('memory_budget', 1)
+    if not (isinstance(budget, (int, long, float)) and budget > 0):
+        problems.append("memory_budget should be a number of megabytes:{0}".format(budget))
+
+    workers = config.get('workers', 1)
+    if not (isinstance(workers, (int, long)) and workers >= 1):
+        problems.append("workers should be a whole number of at least 1:{0}".format(workers))
+
+    return problems
+
+
+def _check_source(config):
+
+    problems = []
+
+    if 'source' not in config:
+        return ["Missing config item:source"]
+
+    source = config['source']
+
+    if isinstance(source, list):
+        return _check_sources(source)
+
+    if source.get('type') == 'jira':
+
+        if 'server' not in source:
+            problems.append("Missing config item:source.server")
+
+        authentication = source.get('authentication', {})
+
+        if 'username' in authentication and 'password' in authentication:
+            pass
+        elif all([key in authentication for key in ['access_token', 'access_token_secret', 'consumer_key', 'key_cert']]):
+            if not os.path.isfile(authentication['key_cert']):
+                problems.append("key_cert not found:{0}".format(authentication['key_cert']))
+        else:
+            problems.append("Authentication misconfigured")
+
+        if source.get('ingest', 'json') not in ['json', 'resources']:
+            problems.append("source.ingest should be json or resources:{0}".format(source['ingest']))
+
+        if source.get('search', 'separate') not in ['separate', 'combined']:
+            problems.append("source.search should be separate or combined:{0}".format(source['search']))
+
+        if source.get('paging', 'offset') not in ['offset', 'keyset']:
+            problems.append("source.paging should be offset or keyset:{0}".format(source['paging']))
+
+        for name in ['partition_days', 'partition_threads']:
+            if name in source and not (isinstance(source[name], int) and source[name] > 0):
+                problems.append("source.{0} should be a whole number of at least 1:{1}".format(name, source[name]))
+
+        if 'resume' in source and 'partition_days' not in source:
+            problems.append("source.resume needs source.partition_days")
+
+        if 'archive' in source and not isinstance(source['archive'], basestring):
+            problems.append("source.archive should be a directory:{0}".format(source['archive']))
+
+    elif source.get('type') == 'fogbugz':
+
+        for required in ['url', 'token']:
+            if required not in source:
+                problems.append("Missing config item:source.{0}".format(required))
+
+    else:
+        problems.append("Unknown source type:{0}".format(source.get('type')))
+
+    return problems
+
+
+def _check_sources(sources):
+
+    problems = []
+    names = set()
+
+    if len(sources) == 0:
+        problems.append("source should list at least one source")
+
+    for index, source in enumerate(sources):
+
+        name = source.get('name')
+
+        if name is None:
+            problems.append("source {0}: needs a name".format(index))
+        elif name in names:
+            problems.append("source {0}: name used more than once:{1}".format(index, name))
+
+        names.add(name)
+
+        where = "source {0}".format(name or index)
+        problems.extend(["{0}: {1}".format(where, problem) for problem in _check_source({'source': source})])
+
+    return problems
+
+
+def _check_cycle(name, cycle, states):
+
+    problems = []
+
+    if not isinstance(cycle, dict):
+        return ["Cycle {0} should be a dict of states".format(name)]
+
+    if 'include' not in cycle and 'exclude' not in cycle:
+
+        if 'start' not in cycle and 'after' not in cycle:
+            problems.append("Cycle {0} needs a start or after state".format(name))
+
+        if 'end' not in cycle and 'exit' not in cycle:
+            problems.append("Cycle {0} needs an end or exit state".format(name))
+
+    if states is not None:
+
+        for key in ['start', 'after', 'end', 'exit']:
+            if key in cycle and cycle[key] not in states:
+                problems.append("Cycle {0} {1} state not in states:{2}".format(name, key, cycle[key]))
+
+        for key in ['include', 'exclude']:
+            for state in cycle.get(key, []):
+                if state not in states:
+                    problems.append("Cycle {0} {1} state not in states:{2}".format(name, key, state))
+
+    return problems
+
+
+def _check_report(index, report, types, cycles, states, fields):
+
+    problems = []
+
+    if 'metric' not in report:
+        return ["Report {0} has no metric".format(index)]
+
+    metric = report['metric']
+    where = "Report {0} ({1})".format(index, metric)
+
+    if metric not in METRICS:
+        return ["{0}: unknown metric".format(where)]
+
+    report_types = report.get('types', 'foreach')
+
+    if report_types != 'foreach':
+        if not isinstance(report_types, list):
+            problems.append("{0}: types should be 'foreach' or a list".format(where))
+        else:
+            for type_grouping in report_types:
+                if type_grouping not in types:
+                    problems.append("{0}: unknown type grouping:{1}".format(where, type_grouping))
+
+    if metric in ['cycle-time', 'cycle-time-percentiles', 'aging']:
+
+        if not report.get('cycles'):
+            problems.append("{0}: needs a list of cycles".format(where))
+
+        for cycle in report.get('cycles') or []:
+            if cycle not in cycles:
+                problems.append("{0}: unknown cycle:{1}".format(where, cycle))
+
+        if 'buckets' in report:
+            problems.extend(_check_buckets(where, report['buckets']))
+
+    if metric == 'done':
+        if report.get('sort', 'week-done') != 'week-done' and report['sort'] not in cycles:
+            problems.append("{0}: sort should be week-done or a cycle:{1}".format(where, report['sort']))
+
+    if metric == 'forecast':
+        problems.extend(_check_forecast(where, report))
+
+    if metric == 'snapshot':
+        for day in report.get('dates', []):
+            try:
+                datetime.strptime(day, '%Y-%m-%d')
+            except (ValueError, TypeError):
+                problems.append("{0}: dates should be YYYY-MM-DD:{1}".format(where, day))
+
+    if 'field' in report:
+        if metric not in FIELD_METRICS:
+            problems.append("{0}: can't report on a field".format(where))
+        elif report['field'] not in fields:
+            problems.append("{0}: field not in changelog_fields:{1}".format(where, report['field']))
+
+    if metric == 'flow-efficiency':
+        problems.extend(_check_flow_efficiency(where, report, states))
+
+    if metric in STATE_METRICS:
+
+        if states is None:
+            problems.append("{0}: needs states in the config".format(where))
+
+        elif 'format' in report:
+            for state in report['format']:
+                if state not in states:
+                    problems.append("{0}: format for state not in states:{1}".format(where, state))
+
+    return problems
+
+
+def _check_flow_efficiency(where, report, states):
+
+    problems = []
+
+    for name in ['active', 'wait']:
+
+        if not report.get(name):
+            problems.append("{0}: needs a list of {1} states".format(where, name))
+
+        elif states is not None:
+            for state in report[name]:
+                if state not in states:
+                    problems.append("{0}: {1} state not in states:{2}".format(where, name, state))
+
+    if report.get('by', 'week') not in ['week', 'item']:
+        problems.append("{0}: by should be week or item:{1}".format(where, report['by']))
+
+    return problems
+
+
+def _check_forecast(where, report):
+
+    problems = []
+
+    if ('items' in report) == ('until' in report):
+        problems.append("{0}: needs either items or until".format(where))
+
+    if 'items' in report and not (isinstance(report['items'], (int, long)) and report['items'] > 0):
+        problems.append("{0}: items should be a whole number of items".format(where))
+
+    if 'until' in report:
+        try:
+            datetime.strptime(report['until'], '%Y-%m-%d')
+        except (ValueError, TypeError):
+            problems.append("{0}: until should be YYYY-MM-DD:{1}".format(where, report['until']))
+
+    for confidence in report.get('confidence', []):
+        if not (isinstance(confidence, (int, long, float)) and 0 < confidence < 100):
+            problems.append("{0}: confidence should be a percentage:{1}".format(where, confidence))
+
+    return problems
+
+
+def _check_buckets(where, buckets):
+
+    edges = []
+
+    for bucket in buckets:
+        if bucket == 'max':
+            continue
+        if not isinstance(bucket, (int, long, float)):
+            return ["{0}: bucket edges should be numbers or 'max':{1}".format(where, bucket)]
+        edges.append(bucket)
+
+    if edges != sorted(edges):
+        return ["{0}: bucket edges should increase".format(where)]
+
+    if 'max' in buckets and buckets.index('max') != len(buckets) - 1:
+        return ["{0}: 'max' should be the last bucket edge".format(where)]
+
+    return []
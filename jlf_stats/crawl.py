@@ -0,0 +1,116 @@
+"""
+Crawling large searches in created date partitions.
+
+A search for every issue of a big project can be split into searches for
+the issues created in each of a run of date ranges.  The ranges are
+aligned to multiples of their length since 1970-01-01 so that the same
+search always gets the same partitions, whenever it is run.
+
+As each partition is fetched its issues can be written to a crawl
+directory, so that a crawl which fails part way through can pick up
+where it left off rather than starting again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import date, timedelta
+
+_EPOCH = date(1970, 1, 1)
+
+
+def partitions(earliest, latest, days):
+    """
+    The [start, end) date ranges of days days covering earliest to latest
+    """
+
+    first = earliest - timedelta(days=(earliest - _EPOCH).days % days)
+
+    ranges = []
+    start = first
+
+    while start <= latest:
+        end = start + timedelta(days=days)
+        ranges.append((start, end))
+        start = end
+
+    return ranges
+
+
+def _raw(issue):
+    """
+    An issue as JSON we can write out, if it is JSON or a Resource
+    """
+
+    if isinstance(issue, dict):
+        return issue
+
+    raw = getattr(issue, 'raw', None)
+
+    if isinstance(raw, dict):
+        return raw
+
+    return None
+
+
+class CrawlState(object):
+    """
+    The partitions of a search fetched so far, kept in a directory of
+    their own under directory
+    """
+
+    def __init__(self, directory, jql):
+
+        self.directory = os.path.join(directory, hashlib.md5(jql.encode('utf-8')).hexdigest())
+
+    def _filename(self, partition):
+
+        start, end = partition
+        return os.path.join(self.directory, '{0}_{1}.json'.format(start.strftime('%Y%m%d'), end.strftime('%Y%m%d')))
+
+    def load(self, partition):
+        """
+        The issues of partition if it has been fetched, otherwise None
+        """
+
+        try:
+            with open(self._filename(partition)) as infile:
+                return json.load(infile)
+        except IOError:
+            return None
+
+    def save(self, partition, issues):
+        """
+        Record partition as fetched, if we can write its issues out
+        """
+
+        raw = [_raw(issue) for issue in issues]
+
+        if any([issue is None for issue in raw]):
+            return False
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Another partition got there first
+                pass
+
+        filename = self._filename(partition)
+
+        # Write then rename so an interrupted write doesn't look finished
+
+        with open(filename + '.tmp', 'w') as outfile:
+            json.dump(raw, outfile)
+
+        os.rename(filename + '.tmp', filename)
+
+        return True
+
+    def clear(self):
+        """
+        Forget the crawl once it is finished
+        """
+
+        shutil.rmtree(self.directory, ignore_errors=True)
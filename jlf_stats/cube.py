@@ -0,0 +1,387 @@
+"""
+A precomputed cube of work item counts.
+
+Throughput, demand, the cumulative flow diagram and arrival rates all
+count work items over the same dimensions - day, category, issue type
+and state.  Rather than have each walk every work item's daily history
+again, the cube walks them once, turning each history into the runs of
+days it spent in each state, and adds them up into dense arrays indexed
+by day, cell - a category and issue type - and state:
+
+    - how many work items were in each state on each day
+    - how many work items were created each day
+    - how many work items moved into each state each day
+
+Type groupings are applied when reading, as sums over the cells whose
+issue type is in them, so one cube answers every report.
+
+The runs are kept along with the cube, so that it can be saved and
+brought up to date by walking only the work items which have changed.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from transitions import day_number
+
+# The end of a run which goes on for ever, as FogBugz histories do
+
+_OPEN = np.iinfo(np.int64).max // 2
+
+
+def _series_runs(history):
+    """
+    The runs of a daily history series, as (state, first day, day after
+    the last)
+    """
+
+    if history is None or len(history) == 0:
+        return []
+
+    values = history.values
+    first = day_number(history.index[0])
+
+    changes = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate([[0], changes])
+    ends = np.concatenate([changes, [len(values)]])
+
+    return [(values[start], first + start, first + end) for start, end in zip(starts, ends)]
+
+
+def _transition_runs(created, transitions):
+    """
+    The runs of a history kept as state transitions, as FogBugz work
+    items keep theirs, the last of which goes on for ever
+    """
+
+    runs = []
+
+    last = created
+    to_state = None
+
+    for transition in transitions:
+        day = day_number(transition['timestamp'])
+        if day > last:
+            runs.append((transition['from'], last, day))
+        last = day
+        to_state = transition['to']
+
+    runs.append((to_state, last, _OPEN))
+
+    return runs
+
+
+class Cube(object):
+    """
+    Counts of work items by day, cell and state, added up from the work
+    items and their transitions.  Given the previous cube, work items
+    which haven't changed since keep their runs rather than having their
+    histories walked again.
+    """
+
+    def __init__(self, work_items, transitions, previous=None):
+
+        self.states = list(transitions.states)
+        self.cells = []
+
+        state_codes = dict((state, code) for code, state in enumerate(self.states))
+        cell_codes = {}
+
+        def state_code(state):
+            try:
+                return state_codes[state]
+            except KeyError:
+                state_codes[state] = len(self.states)
+                self.states.append(state)
+                return state_codes[state]
+
+        def cell_code(cell):
+            try:
+                return cell_codes[cell]
+            except KeyError:
+                cell_codes[cell] = len(self.cells)
+                self.cells.append(cell)
+                return cell_codes[cell]
+
+        num_items = len(work_items)
+
+        # What we know of each work item's history without walking it -
+        # where it starts, how many transitions it has made and when it
+        # last made one - tells us whether it has changed
+
+        changes = np.bincount(transitions.item, minlength=num_items)
+        last_change = np.empty(num_items, dtype=np.int64)
+        last_change.fill(-1)
+        np.maximum.at(last_change, transitions.item, transitions.seconds)
+
+        self.ids = []
+        self.keys = []
+        self.cell = np.empty(num_items, dtype=np.int64)
+        self.created = np.empty(num_items, dtype=np.int64)
+        self.end = np.empty(num_items, dtype=np.int64)
+        self.end.fill(-1)
+
+        counted = set()
+        reuse = {}
+        if previous is not None:
+            reuse = dict((key, index) for index, key in enumerate(previous.keys) if key is not None)
+
+        kept = []
+        run_item = []
+        run_state = []
+        run_start = []
+        run_end = []
+
+        for index, work_item in enumerate(work_items):
+
+            self.ids.append(work_item.id)
+            self.cell[index] = cell_code((work_item.category, work_item.type))
+            self.created[index] = day_number(work_item.date_created)
+
+            # Each work item is only in one state at a time, however many
+            # categories it is in
+
+            if work_item.id in counted:
+                self.keys.append(None)
+                continue
+
+            counted.add(work_item.id)
+
+            history = work_item.history
+            first = self.created[index]
+
+            if isinstance(history, list):
+                self.end[index] = _OPEN
+            elif history is not None and len(history) > 0:
+                first = day_number(history.index[0])
+                self.end[index] = first + len(history)
+
+            key = json.dumps([work_item.id, work_item.category, work_item.type, work_item.state,
+                              int(first), int(changes[index]), int(last_change[index])])
+            self.keys.append(key)
+
+            if key in reuse:
+                kept.append((reuse[key], index))
+                continue
+
+            if isinstance(history, list):
+                runs = _transition_runs(self.created[index], [transition for transition in history
+                                                              if transition is not None])
+            else:
+                runs = _series_runs(history)
+
+            for state, start, end in runs:
+                run_item.append(index)
+                run_state.append(state_code(state))
+                run_start.append(start)
+                run_end.append(end)
+
+        self.run_item = np.array(run_item, dtype=np.int64)
+        self.run_state = np.array(run_state, dtype=np.int64)
+        self.run_start = np.array(run_start, dtype=np.int64)
+        self.run_end = np.array(run_end, dtype=np.int64)
+
+        if len(kept) > 0:
+            self._keep(previous, kept, state_code)
+
+        self._add_up(transitions, state_code)
+
+    def _keep(self, previous, kept, state_code):
+        """
+        Carry over the runs of the work items which haven't changed, as
+        (index in previous, index now), bringing the last run of those
+        whose history now ends on a different day up to date
+        """
+
+        old, new = [np.array(indexes, dtype=np.int64) for indexes in zip(*kept)]
+
+        position = np.empty(len(previous.keys), dtype=np.int64)
+        position.fill(-1)
+        position[old] = new
+
+        runs = np.flatnonzero(position[previous.run_item] >= 0)
+
+        item = position[previous.run_item[runs]]
+        states = np.array([state_code(state) for state in previous.states], dtype=np.int64)
+        state = states[previous.run_state[runs]]
+        start = previous.run_start[runs]
+        end = previous.run_end[runs].copy()
+
+        # A history which ends on a different day only differs in how
+        # long it has been in its current state
+
+        moved = end == previous.end[previous.run_item[runs]]
+        end[moved] = self.end[item[moved]]
+        end = np.minimum(end, self.end[item])
+
+        nonempty = end > start
+
+        self.run_item = np.concatenate([self.run_item, item[nonempty]])
+        self.run_state = np.concatenate([self.run_state, state[nonempty]])
+        self.run_start = np.concatenate([self.run_start, start[nonempty]])
+        self.run_end = np.concatenate([self.run_end, end[nonempty]])
+
+    def _add_up(self, transitions, state_code):
+        """
+        The counts of each cell's work items in each state, created and
+        moving into each state, for every day from the first we know of
+        up to the day after the last
+        """
+
+        num_cells = len(self.cells)
+
+        arrived_state = np.array([state_code(state) for state in transitions.states], dtype=np.int64)
+        arrived_state = arrived_state[transitions.to_state] if len(transitions) > 0 else transitions.to_state
+
+        num_states = len(self.states)
+
+        finite = self.run_end[self.run_end < _OPEN]
+
+        days = np.concatenate([self.created, self.run_start, finite - 1, transitions.day])
+
+        if len(days) == 0:
+            self.first_day = 0
+            num_days = 1
+        else:
+            self.first_day = days.min()
+            num_days = days.max() - self.first_day + 2
+
+        # Runs are added where they start and taken off the day after
+        # they end, so the last day is only in the runs going on for ever
+
+        changes = np.zeros((num_days, num_cells, num_states), dtype=np.int32)
+
+        cell = self.cell[self.run_item]
+        np.add.at(changes, (self.run_start - self.first_day, cell, self.run_state), 1)
+
+        ends = self.run_end < _OPEN
+        np.add.at(changes, (self.run_end[ends] - self.first_day, cell[ends], self.run_state[ends]), -1)
+
+        self.in_state = np.cumsum(changes, axis=0, dtype=np.int32)
+
+        self.arrived = np.zeros((num_days, num_cells, num_states), dtype=np.int32)
+        np.add.at(self.arrived, (transitions.day - self.first_day, self.cell[transitions.item], arrived_state), 1)
+
+        self.created_on = np.zeros((num_days, num_cells), dtype=np.int32)
+        np.add.at(self.created_on, (self.created - self.first_day, self.cell), 1)
+
+        # How many work items are counted in each cell, for the days a
+        # work item isn't in any state
+
+        counted = np.array([key is not None for key in self.keys], dtype=bool)
+        self.counted = np.bincount(self.cell[counted], minlength=num_cells)
+
+    def days(self, from_date=None, to_date=None):
+        """
+        The day numbers from from_date to to_date inclusive, or from the
+        first day we know of up to the last
+        """
+
+        first = self.first_day if from_date is None else day_number(from_date)
+        last = self.first_day + len(self.in_state) - 2 if to_date is None else day_number(to_date)
+
+        return np.arange(first, last + 1, dtype=np.int64)
+
+    def _rows(self, counts, days, lasting):
+        """
+        The rows of counts for days.  Lasting counts carry on after the
+        last day as they were on it, others are 0 either side.
+        """
+
+        rows = days - self.first_day
+        inside = (rows >= 0) & (rows < len(counts) - 1)
+
+        if lasting:
+            inside |= rows >= len(counts) - 1
+
+        found = counts[np.clip(rows, 0, len(counts) - 1)]
+        found[~inside] = 0
+
+        return found
+
+    def in_states(self, days):
+        """
+        How many work items in each cell were in each state on each of
+        days, as days x cells x states
+        """
+
+        return self._rows(self.in_state, days, True)
+
+    def arrivals(self, days):
+        """
+        How many work items in each cell moved into each state on each of
+        days, as days x cells x states
+        """
+
+        return self._rows(self.arrived, days, False)
+
+    def creations(self, days):
+        """
+        How many work items in each cell were created on each of days, as
+        days x cells
+        """
+
+        return self._rows(self.created_on, days, False)
+
+    def save(self, directory):
+        """
+        Keep the runs, and what we need to tell which work items have
+        changed since, in directory
+        """
+
+        names = {'ids': self.ids,
+                 'keys': self.keys,
+                 'states': self.states}
+
+        arrays = {'end': self.end,
+                  'run_item': self.run_item,
+                  'run_state': self.run_state,
+                  'run_start': self.run_start,
+                  'run_end': self.run_end}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filename = os.path.join(directory, 'cube.')
+
+        # Write then rename so an interrupted write doesn't replace the
+        # last cube with half of a new one
+
+        with open(filename + 'npz.tmp', 'wb') as outfile:
+            np.savez_compressed(outfile, **arrays)
+
+        with open(filename + 'json.tmp', 'w') as outfile:
+            json.dump(names, outfile)
+
+        os.rename(filename + 'npz.tmp', filename + 'npz')
+        os.rename(filename + 'json.tmp', filename + 'json')
+
+    @classmethod
+    def load(cls, directory):
+        """
+        The runs of a saved cube, to bring up to date, or None if there
+        isn't one
+        """
+
+        filename = os.path.join(directory, 'cube.')
+
+        try:
+            with open(filename + 'json') as infile:
+                names = json.load(infile)
+            with open(filename + 'npz', 'rb') as infile:
+                stored = np.load(infile)
+                arrays = dict((name, stored[name]) for name in stored.files)
+        except IOError:
+            return None
+
+        saved = cls.__new__(cls)
+        saved.ids = names['ids']
+        saved.keys = names['keys']
+        saved.states = names['states']
+
+        for name, values in arrays.items():
+            setattr(saved, name, values)
+
+        return saved
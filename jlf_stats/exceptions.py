@@ -1,6 +1,7 @@
 class MissingState(Exception):
 
     def __init__(self, expr, msg):
+        Exception.__init__(self, expr, msg)
         self.expr = expr
         self.msg = msg
 
@@ -12,6 +13,7 @@ class MissingState(Exception):
 class MissingConfigItem(Exception):
 
     def __init__(self, expr, msg):
+        Exception.__init__(self, expr, msg)
         self.expr = expr
         self.msg = msg
 
@@ -0,0 +1,115 @@
+"""
+Federated sources.
+
+When config['source'] is a list, each entry is a JIRA or FogBugz source
+of its own with a name and, optionally, its own categories:
+
+    "source": [{"name": "core", "type": "jira", "server": ..., "categories": {...}},
+               {"name": "support", "type": "fogbugz", "url": ..., "categories": {...}}]
+
+Every source is fetched at the same time on a thread of its own, so
+fetching them all takes as long as the slowest rather than all of them
+one after another.  Work item ids are prefixed with the name of their
+source, e.g. core:CORE-123, so that they stay unique across instances.
+"""
+
+import threading
+
+from exceptions import MissingConfigItem
+
+
+def source_configs(config):
+    """
+    The name of each source in config along with a config for it on its
+    own, falling back to the top level categories if it has none
+    """
+
+    configs = []
+
+    for source in config['source']:
+
+        if 'name' not in source:
+            raise MissingConfigItem('name', "Missing Config Item:source.name")
+
+        source_config = dict(config)
+        source_config['source'] = source
+
+        if 'categories' in source:
+            source_config['categories'] = source['categories']
+
+        configs.append((source['name'], source_config))
+
+    return configs
+
+
+class FederatedSource(object):
+    """
+    Work items from several named sources as one
+    """
+
+    def __init__(self, sources):
+
+        self.sources = sources
+        self.all_work_items = None
+
+    def work_items(self):
+
+        if self.all_work_items is None:
+            self.all_work_items = self._fetch(lambda source: source.work_items())
+
+        return self.all_work_items
+
+    def refresh(self):
+
+        self.all_work_items = self._fetch(lambda source: source.refresh())
+
+        return self.all_work_items
+
+    def _fetch(self, get):
+        """
+        Call get on every source at once, re-raising the first error if
+        any of them fail
+        """
+
+        results = [None] * len(self.sources)
+        errors = []
+
+        def fetch(index, source):
+            try:
+                results[index] = get(source)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fetch, args=(index, source), name=name)
+                   for index, (name, source) in enumerate(self.sources)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        work_items = []
+
+        for (name, source), source_work_items in zip(self.sources, results):
+            for work_item in source_work_items:
+                work_items.append(namespaced(name, work_item))
+
+        return work_items
+
+
+def namespaced(name, work_item):
+    """
+    work_item with its id prefixed by the name of its source
+    """
+
+    prefix = "{0}:".format(name)
+
+    if not unicode(work_item.id).startswith(prefix):
+        work_item.id = prefix + unicode(work_item.id)
+
+    return work_item
@@ -1,7 +1,7 @@
 from work import WorkItem
+import instrument
 import re
-import dateutil.parser
-import fogbugz
+from timestamps import parse_timestamp
 
 # Event codes from http://help.fogcreek.com/8202/xml-api#Event_Codes
 evtResolved = 14
@@ -16,42 +16,71 @@ class FogbugzWrapper(object):
 
     def __init__(self, config=None):
 
-        self.fb = None
+        self._fb = None
+        self._connection = None
         self.categories = None
 
         if config:
-            self.fb = fogbugz.FogBugz(config['source']['url'], config['source']['token'])
+            # Connect on first use, creating the client talks to the server
+            self._connection = (config['source']['url'], config['source']['token'])
             self.categories = config['categories']
 
+    @property
+    def fb(self):
+        """
+        The FogBugz client, connected on first use
+        """
+
+        if self._fb is None and self._connection is not None:
+            import fogbugz
+            self._fb = fogbugz.FogBugz(*self._connection)
+
+        return self._fb
+
+    @fb.setter
+    def fb(self, client):
+        self._fb = client
+
     def work_items(self):
 
         self.responses = []
         for cat in self.categories:
             query = self.categories[cat]
-            self.responses.append(self.fb.search(q=query, cols="ixBug,dtOpened,dtClosed,sTitle,sStatus,sCategory,minievents"))
+            with instrument.span('fetch') as fetch:
+                self.responses.append(self.fb.search(q=query, cols="ixBug,dtOpened,dtClosed,sTitle,sStatus,sCategory,minievents"))
+                fetch.count('searches')
 
-        self.work_items = []
+        work_items = []
 
         for response in self.responses:
             for case in response.cases.findAll('case'):
-                work_item = self.work_item_from_xml(case)
-                self.work_items.append(work_item)
+                with instrument.span('parse') as parse:
+                    work_item = self.work_item_from_xml(case)
+                    parse.count('cases')
+                work_items.append(work_item)
+
+        return work_items
+
+    def refresh(self):
+        """
+        Fetch all cases again
+        """
 
-        return self.work_items
+        return self.work_items()
 
     def work_item_from_xml(self, case):
 
         state_history = []
-        date_created = dateutil.parser.parse(case.dtopened.text)
+        date_created = parse_timestamp(case.dtopened.text)
 
         # # store the closed date!
         # closed_date = None
         # if case.dtclosed.text:
-        #     closed_date = dateutil.parser.parse(case.dtclosed.text)
+        #     closed_date = parse_timestamp(case.dtclosed.text)
 
         for event in case.minievents.childGenerator():
 
-            transition = self.state_transition(timestamp=dateutil.parser.parse(event.dt.text),
+            transition = self.state_transition(timestamp=parse_timestamp(event.dt.text),
                                                changes=event.schanges.text,
                                                event_code=int(event.evt.text))
 
@@ -0,0 +1,116 @@
+"""
+Monte Carlo forecasting.
+
+Answers "when will these N items be done?" and "how many items will be
+done by this date?" by replaying weeks drawn at random from the weekly
+throughput we have actually seen.  Every trial is run at once as rows of
+a numpy array rather than one at a time.
+"""
+
+import numpy as np
+
+DEFAULT_TRIALS = 100000
+DEFAULT_CONFIDENCE = [50, 85, 95]
+
+# Give up on trials which still haven't finished after this many weeks
+
+MAX_WEEKS = 520
+
+# Simulate at most this many weeks of every trial at a time to bound memory
+
+_WEEKS_AT_A_TIME = 52
+
+
+def _samples(weekly_throughput):
+
+    samples = np.asarray(weekly_throughput, dtype=np.float64)
+    samples = samples[~np.isnan(samples)].astype(np.int32)
+
+    if len(samples) == 0 or samples.max() <= 0:
+        raise ValueError("No throughput to forecast from")
+
+    return samples
+
+
+def weeks_to_complete(weekly_throughput, items, trials=DEFAULT_TRIALS, random_state=None, max_weeks=MAX_WEEKS):
+    """
+    For each trial, the number of weeks it takes to complete items when
+    each week's throughput is drawn at random from weekly_throughput.
+    Trials which haven't finished after max_weeks take forever (inf).
+    """
+
+    samples = _samples(weekly_throughput)
+    random = np.random.RandomState(random_state)
+
+    weeks = np.empty(trials, dtype=np.float64)
+    weeks.fill(np.inf)
+
+    if items <= 0:
+        weeks.fill(0)
+        return weeks
+
+    done = np.zeros(trials, dtype=np.int64)
+    running = np.arange(trials)
+    elapsed = 0
+
+    # Simulate enough weeks for most trials to finish in one go, then
+    # carry on with those that didn't
+
+    horizon = min(int(np.ceil(items / samples.mean() * 1.5)) + 1, _WEEKS_AT_A_TIME)
+
+    while len(running) > 0 and elapsed < max_weeks:
+
+        horizon = min(horizon, max_weeks - elapsed)
+
+        totals = np.cumsum(random.choice(samples, size=(len(running), horizon)), axis=1, dtype=np.int64)
+        totals += done[running][:, np.newaxis]
+
+        finished = totals >= items
+        finished_by = finished.any(axis=1)
+
+        weeks[running[finished_by]] = elapsed + finished[finished_by].argmax(axis=1) + 1
+
+        done[running] = totals[:, -1]
+        running = running[~finished_by]
+        elapsed += horizon
+
+    return weeks
+
+
+def items_completed(weekly_throughput, weeks, trials=DEFAULT_TRIALS, random_state=None):
+    """
+    For each trial, the number of items completed in weeks weeks when each
+    week's throughput is drawn at random from weekly_throughput
+    """
+
+    samples = _samples(weekly_throughput)
+    random = np.random.RandomState(random_state)
+
+    if weeks <= 0:
+        return np.zeros(trials, dtype=np.int64)
+
+    return random.choice(samples, size=(trials, weeks)).sum(axis=1, dtype=np.int64)
+
+
+def completion_percentiles(weeks, confidence=None):
+    """
+    The number of weeks within which we are each confidence percent sure
+    of finishing
+    """
+
+    if confidence is None:
+        confidence = DEFAULT_CONFIDENCE
+
+    return np.percentile(weeks, confidence, interpolation='higher')
+
+
+def items_percentiles(items, confidence=None):
+    """
+    The number of items we are each confidence percent sure of completing
+    at least
+    """
+
+    if confidence is None:
+        confidence = DEFAULT_CONFIDENCE
+
+    return np.percentile(items, [100 - c for c in confidence], interpolation='lower').astype(np.int64)
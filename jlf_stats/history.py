@@ -1,5 +1,6 @@
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 import pandas as pd
+from timestamps import parse_date, daily_index
 
 """States between which we consider an issue to be being worked on
    for the purposes of calculating cycletime"""
@@ -110,7 +111,26 @@ def cycle_time(history,
 
 
 def extract_date(created):
-    return datetime.strptime(created[:10], '%Y-%m-%d').date()
+    return parse_date(created)
+
+
+def status_changes(histories):
+    """
+    The status changes in each of a JIRA changelog's histories, as
+    (created, [(from, to), ...]) in the same order as the histories
+    """
+
+    return field_changes(histories, 'status')
+
+
+def field_changes(histories, field):
+    """
+    The changes to any changelog field, e.g. 'Flagged' or 'assignee', in
+    the same form as status_changes
+    """
+
+    return [(history.created, [(item.fromString, item.toString) for item in history.items if item.field == field])
+            for history in histories]
 
 
 def time_in_states(histories, from_date=None, until_date=None):
@@ -124,6 +144,14 @@ def time_in_states(histories, from_date=None, until_date=None):
     until the date specified in 'until' - typically today's date
     """
 
+    return time_in_states_from_status_changes(status_changes(histories), from_date, until_date)
+
+
+def time_in_states_from_status_changes(changes, from_date=None, until_date=None):
+    """
+    time_in_states for the status changes of a changelog, most recent first
+    """
+
     time_in_states = []
 
     current_state = u'Open'
@@ -136,21 +164,20 @@ def time_in_states(histories, from_date=None, until_date=None):
     else:
         prev_state_change_date = from_date
 
-    for history in reversed(histories):
-        for item in history.items:
-            if item.field == 'status':
-                state_change_date = extract_date(history.created)
+    for created, items in reversed(changes):
+        for from_state, to_state in items:
+            state_change_date = extract_date(created)
 
-                days_in_state = state_change_date - prev_state_change_date
+            days_in_state = state_change_date - prev_state_change_date
 
-                if current_state is None:
-                    current_state = item.fromString
+            if current_state is None:
+                current_state = from_state
 
-                time_in_states.append({'state': current_state,
-                                       'days': days_in_state.days})
+            time_in_states.append({'state': current_state,
+                                   'days': days_in_state.days})
 
-                current_state = item.toString
-                prev_state_change_date = state_change_date
+            current_state = to_state
+            prev_state_change_date = state_change_date
 
     if until_date is not None:
         final_state_days = until_date - prev_state_change_date
@@ -164,10 +191,27 @@ def time_in_states(histories, from_date=None, until_date=None):
     return time_in_states
 
 
-def history_from_jira_changelog(changelog, created_date, until_date=None):
+def history_from_jira_changelog(changelog, created_date, until_date=None, from_date=None):
 
     issue_history = time_in_states(changelog.histories, from_date=created_date, until_date=until_date)
 
+    return history_from_time_in_states(issue_history, created_date, from_date)
+
+
+def history_from_time_in_states(issue_history, created_date, from_date=None):
+    """
+    Daily history from the time an issue spent in each state.
+
+    If from_date is after created_date the history starts at from_date,
+    in the state the issue was in on that day.
+    """
+
+    skip = 0
+    if from_date is not None:
+        skip = max(0, (_as_date(from_date) - _as_date(created_date)).days)
+
+    start_date = created_date + timedelta(days=skip)
+
     issue_day_history = []
     history = None
     total_days = 0
@@ -177,12 +221,17 @@ def history_from_jira_changelog(changelog, created_date, until_date=None):
         state = state_days['state']
         days = state_days['days']
 
+        if skip > 0 and days > 0:
+            skipped = min(skip, days)
+            skip -= skipped
+            days -= skipped
+
         days_in_state = [state] * days
 
         issue_day_history += days_in_state
         total_days += days
 
-    dates = [created_date + timedelta(days=x) for x in range(0, total_days)]
+    dates = daily_index(start_date, total_days)
 
     try:
         history = pd.Series(issue_day_history, index=dates)
@@ -194,7 +243,142 @@ def history_from_jira_changelog(changelog, created_date, until_date=None):
     return history
 
 
-def arrivals(histories, add_to=None):
+def cycle_time_from_time_in_states(issue_history,
+                                   start_state=START_STATE,
+                                   after_state=None,
+                                   end_state=END_STATE,
+                                   exit_state=None,
+                                   reopened_state=REOPENED_STATE,
+                                   include_states=None,
+                                   exclude_states=None):
+    """
+    The same as cycle_time for the daily history built from issue_history,
+    without building it.  Lets us work out cycle times over the whole life
+    of an issue while only keeping the part of its history we report on.
+    """
+
+    runs = []
+    day = 0
+    for state_days in issue_history:
+        if state_days['days'] > 0:
+            runs.append((state_days['state'], day, state_days['days']))
+            day += state_days['days']
+
+    total_days = day
+
+    if include_states is not None:
+        return sum([days for state, first, days in runs if state in include_states])
+
+    if exclude_states is not None:
+        return sum([days for state, first, days in runs if state not in exclude_states])
+
+    start_day = None
+    end_day = None
+
+    for state, first, days in runs:
+
+        if after_state:
+            if state == after_state and start_day is None:
+                start_day = min(first + 1, total_days - 1)
+        elif state == start_state and start_day is None:
+            start_day = first
+
+        last = first + days - 1
+
+        if exit_state is not None:
+            if state == exit_state:
+                end_day = min(last + 1, total_days - 1)
+        elif state == end_state and state != reopened_state:
+            end_day = last
+
+    if start_day is None:
+        if end_day is not None:
+            return 1
+
+    if end_day is None:
+        return None
+
+    offset = 0
+    if exit_state is None:
+        offset = 1
+
+    return end_day - start_day + offset
+
+
+def cycle_times(cycles_config, issue_history):
+    """
+    Cycle times for each cycle in cycles_config, the config's cycles,
+    from the time an issue spent in each state
+    """
+
+    cycles = {}
+
+    try:
+
+        for cycle in cycles_config:
+            reopened_state = None
+            after_state = None
+            start_state = None
+            exit_state = None
+            end_state = None
+            include_states = None
+            exclude_states = None
+
+            if 'ignore' in cycles_config[cycle]:
+                reopened_state = cycles_config[cycle]['ignore']
+
+            if 'after' in cycles_config[cycle]:
+                after_state = cycles_config[cycle]['after']
+
+            if 'start' in cycles_config[cycle]:
+                start_state = cycles_config[cycle]['start']
+
+            if 'exit' in cycles_config[cycle]:
+                exit_state = cycles_config[cycle]['exit']
+
+            if 'include' in cycles_config[cycle]:
+                include_states = cycles_config[cycle]['include']
+
+            if 'exclude' in cycles_config[cycle]:
+                exclude_states = cycles_config[cycle]['exclude']
+
+            if 'end' in cycles_config[cycle]:
+                end_state = cycles_config[cycle]['end']
+
+                cycles[cycle] = cycle_time_from_time_in_states(issue_history,
+                                                               start_state=start_state,
+                                                               after_state=after_state,
+                                                               include_states=include_states,
+                                                               exclude_states=exclude_states,
+                                                               end_state=end_state,
+                                                               reopened_state=reopened_state)
+
+            else:
+
+                cycles[cycle] = cycle_time_from_time_in_states(issue_history,
+                                                               start_state=start_state,
+                                                               after_state=after_state,
+                                                               include_states=include_states,
+                                                               exclude_states=exclude_states,
+                                                               exit_state=exit_state,
+                                                               reopened_state=reopened_state)
+
+    except AttributeError:
+
+        pass
+
+    return cycles
+
+
+def _as_date(day):
+
+    if hasattr(day, 'date'):
+        return day.date()
+
+    return day
+
+
+def arrivals(histories, add_to=None, field='status'):
 
     if add_to is None:
         arrivals = {}
@@ -207,7 +391,7 @@ def arrivals(histories, add_to=None):
             arrivals[day] = {}
 
         for item in history.items:
-            if item.field == 'status':
+            if item.field == field:
 
                 if not item.toString in arrivals[day]:
                     arrivals[day][item.toString] = 1
@@ -217,11 +401,19 @@ def arrivals(histories, add_to=None):
     return arrivals
 
 
-def history_from_state_transitions(start_date, state_transitions, end_date):
+def history_from_state_transitions(start_date, state_transitions, end_date, from_date=None):
     """
     Get a daily history of states based on state transitions
+
+    If from_date is after start_date the history starts at from_date, in
+    the state held on that day.
     """
 
+    if from_date is not None and from_date > start_date:
+        first_date = from_date
+    else:
+        first_date = start_date
+
     history = []
 
     to_state = None
@@ -230,18 +422,18 @@ def history_from_state_transitions(start_date, state_transitions, end_date):
     for state in state_transitions:
         date = state['timestamp'].date()
 
-        num_days = (date - last_date).days
+        num_days = (date - max(last_date, first_date)).days
         for n in range(0, num_days):
             history.append(state['from'])
 
         last_date = date
         to_state = state['to']
 
-    num_days = (end_date - last_date).days
+    num_days = (end_date - max(last_date, first_date)).days
 
     for n in range(0, num_days + 1):
         history.append(to_state)
 
-    dates = [start_date + timedelta(days=x) for x in range(0, (end_date - start_date).days + 1)]
+    dates = [first_date + timedelta(days=x) for x in range(0, (end_date - first_date).days + 1)]
 
     return pd.Series(history, index=dates)
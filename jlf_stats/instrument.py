@@ -0,0 +1,248 @@
+"""
+Timing instrumentation.
+
+Code wraps the phases it wants measured in named spans:
+
+    with instrument.span('fetch') as fetch:
+        issues = search(...)
+        fetch.count('issues', len(issues))
+
+Spans nest, and entering a span with the same name under the same parent
+adds to it rather than starting a new one, so a span entered once per
+issue ends up as a single total with a count of calls.  Each span records
+wall and CPU time, item counts, bytes and the peak resident memory of the
+process.
+
+Tracing is off until enable() is called, when spans cost next to nothing.
+If a profile directory is given each span also gets its own cProfile,
+covering its time exclusive of any spans nested inside it.
+"""
+
+import cProfile
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_local = threading.local()
+
+_enabled = False
+_profile_dir = None
+
+
+def _peak_rss_kb():
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak
+
+
+def _cpu_seconds():
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Span(object):
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.counts = {}
+        self.bytes = 0
+        self.peak_rss_kb = 0
+        self.rss_growth_kb = 0
+        self.profiler = None
+
+    def child(self, name):
+
+        with _lock:
+            for child in self.children:
+                if child.name == name:
+                    return child
+
+            child = Span(name, self)
+            self.children.append(child)
+            return child
+
+    def count(self, name, n=1):
+
+        with _lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_bytes(self, n):
+
+        with _lock:
+            self.bytes += n
+
+    def path(self):
+
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+
+        return self.parent.path() + '.' + self.name
+
+    def to_dict(self):
+
+        return {'name': self.name,
+                'calls': self.calls,
+                'wall_seconds': self.wall_seconds,
+                'cpu_seconds': self.cpu_seconds,
+                'counts': self.counts,
+                'bytes': self.bytes,
+                'peak_rss_kb': self.peak_rss_kb,
+                'rss_growth_kb': self.rss_growth_kb,
+                'children': [child.to_dict() for child in self.children]}
+
+
+class _NullSpan(object):
+    """
+    What span() hands out when tracing is off
+    """
+
+    def count(self, name, n=1):
+        pass
+
+    def add_bytes(self, n):
+        pass
+
+
+_null_span = _NullSpan()
+_root = Span('jlf')
+
+
+def enable(profile_dir=None):
+    """
+    Start recording spans and, if profile_dir is given, profiling them
+    """
+
+    global _enabled, _profile_dir, _root, _local
+
+    _root = Span('jlf')
+    _local = threading.local()
+    _enabled = True
+    _profile_dir = profile_dir
+
+    if profile_dir is not None and not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+
+
+def disable():
+    """
+    Stop recording and forget any spans recorded so far
+    """
+
+    global _enabled, _profile_dir, _root, _local
+
+    _root = Span('jlf')
+    _local = threading.local()
+    _enabled = False
+    _profile_dir = None
+
+
+def enabled():
+    return _enabled
+
+
+def _current():
+
+    try:
+        return _local.current
+    except AttributeError:
+        _local.current = _root
+        return _root
+
+
+@contextmanager
+def span(name):
+    """
+    Measure the enclosed block as span 'name' within the current span
+    """
+
+    if not _enabled:
+        yield _null_span
+        return
+
+    parent = _current()
+    this = parent.child(name)
+    _local.current = this
+
+    if _profile_dir is not None:
+        if parent.profiler is not None:
+            parent.profiler.disable()
+        if this.profiler is None:
+            this.profiler = cProfile.Profile()
+        this.profiler.enable()
+
+    rss_before = _peak_rss_kb()
+    cpu_before = _cpu_seconds()
+    wall_before = time.time()
+
+    try:
+        yield this
+
+    finally:
+        wall = time.time() - wall_before
+        cpu = _cpu_seconds() - cpu_before
+        peak = _peak_rss_kb()
+
+        if this.profiler is not None:
+            this.profiler.disable()
+            if parent.profiler is not None:
+                parent.profiler.enable()
+
+        with _lock:
+            this.calls += 1
+            this.wall_seconds += wall
+            this.cpu_seconds += cpu
+            this.peak_rss_kb = max(this.peak_rss_kb, peak)
+            this.rss_growth_kb += peak - rss_before
+
+        _local.current = parent
+
+
+def spans():
+    """
+    All the spans recorded so far, as a list of nested dicts
+    """
+
+    return [child.to_dict() for child in _root.children]
+
+
+def _profile_filename(path):
+
+    return os.path.join(_profile_dir, re.sub(r'[^\w.-]+', '_', path) + '.prof')
+
+
+def write(trace_filename=None):
+    """
+    Write the spans to trace_filename as JSON and, if profiling, a
+    cProfile dump for each span to the profile directory
+    """
+
+    if not _enabled:
+        return
+
+    if trace_filename is not None:
+        with open(trace_filename, 'w') as trace_file:
+            json.dump({'spans': spans()}, trace_file, indent=4, sort_keys=True)
+
+    if _profile_dir is not None:
+
+        def dump_profiles(parent):
+            for child in parent.children:
+                if child.profiler is not None:
+                    child.profiler.dump_stats(_profile_filename(child.path()))
+                dump_profiles(child)
+
+        dump_profiles(_root)
@@ -13,16 +13,139 @@ Also abstracts away from batch searching and other implementation
 details we don't want to present to the user.
 """
 
-import jira.client
+import Queue
 import sys
+import threading
 
 from datetime import date, datetime
 
 from index import week_start_date
-from history import time_in_states, cycle_time, history_from_jira_changelog
+from history import status_changes, field_changes, time_in_states, time_in_states_from_status_changes, cycle_times, history_from_time_in_states
 from exceptions import MissingConfigItem
 from work import WorkItem
-import dateutil.parser
+import instrument
+from timestamps import parse_timestamp, parse_date
+from crawl import CrawlState, partitions
+from archive import ColdArchive, hot_jql
+from jql import predicate, project, split_order_by, without_order_by, UnsupportedJql
+
+
+# All we need of each issue from the search endpoint, along with its changelog
+
+RAW_FIELDS = 'summary,status,issuetype,created'
+
+# and what we need to sort issues into categories ourselves
+
+CATEGORY_FIELDS = 'project,components,labels'
+
+
+def window_jql(jql, from_date):
+    """
+    Restrict jql to issues which were unresolved on from_date, keeping
+    any ORDER BY clause at the end
+    """
+
+    jql, order_by = split_order_by(jql)
+
+    return '({0}) AND (resolutiondate is EMPTY OR resolutiondate >= "{1}"){2}'.format(jql,
+                                                                                    from_date.strftime('%Y-%m-%d'),
+                                                                                    order_by)
+
+
+def keyset_jql(jql, after_key=None):
+    """
+    jql in key order, starting after after_key
+    """
+
+    jql = without_order_by(jql)
+
+    if after_key is not None:
+        jql = '({0}) AND key > "{1}"'.format(jql, after_key)
+
+    return jql + ' ORDER BY key ASC'
+
+
+def partition_jql(jql, start, end):
+    """
+    Restrict jql to issues created on or after start and before end,
+    keeping any ORDER BY clause at the end
+    """
+
+    jql, order_by = split_order_by(jql)
+
+    return '({0}) AND created >= "{1}" AND created < "{2}"{3}'.format(jql,
+                                                                     start.strftime('%Y-%m-%d'),
+                                                                     end.strftime('%Y-%m-%d'),
+                                                                     order_by)
+
+
+def _key(issue):
+
+    if isinstance(issue, dict):
+        return issue['key']
+
+    return issue.key
+
+
+def _created(issue):
+
+    if isinstance(issue, dict):
+        return issue['fields']['created']
+
+    return issue.fields.created
+
+
+def _category_fields(issue, epic_link=None):
+    """
+    The values of the fields jql.Predicate understands for an issue,
+    whether it is the search endpoint's JSON or a Resource
+    """
+
+    if isinstance(issue, dict):
+        fields = issue['fields']
+        project = fields.get('project') or {}
+        return {'project': [project.get('key'), project.get('name')],
+                'component': [component.get('name') for component in fields.get('components') or []],
+                'labels': fields.get('labels') or [],
+                'epic link': [fields.get(epic_link)] if epic_link is not None else [],
+                'issuetype': [(fields.get('issuetype') or {}).get('name')]}
+
+    fields = issue.fields
+    project = getattr(fields, 'project', None)
+    return {'project': [getattr(project, 'key', None), getattr(project, 'name', None)],
+            'component': [component.name for component in getattr(fields, 'components', None) or []],
+            'labels': getattr(fields, 'labels', None) or [],
+            'epic link': [getattr(fields, epic_link, None)] if epic_link is not None else [],
+            'issuetype': [fields.issuetype.name]}
+
+
+def _state_transition(created, items):
+    """
+    The first status change of a history, if it has one
+    """
+
+    for from_state, to_state in items:
+        return {'from': from_state,
+                'to': to_state,
+                'timestamp': parse_timestamp(created)}
+
+    return None
+
+
+def _field_transitions(changes):
+    """
+    Every change to a field, most recent first like the changelog
+    """
+
+    transitions = []
+
+    for created, items in changes:
+        for from_value, to_value in items:
+            transitions.append({'from': from_value,
+                                'to': to_value,
+                                'timestamp': parse_timestamp(created)})
+
+    return transitions
 
 
 class JiraWrapper(object):
@@ -39,14 +162,21 @@ class JiraWrapper(object):
         except KeyError as e:
             raise MissingConfigItem(e, "Missing Config Item:{0}".format(e))
 
-        self.jira = None
-
         authentication = source['authentication']
 
+        # We don't connect until we actually need some issues, as creating
+        # the client makes requests to the server.  A client's session
+        # isn't safe to share, so each thread connects its own, and calls
+        # to a client we are given take turns.
+
+        self._jira = None
+        self._clients = threading.local()
+        self._given = threading.Lock()
+
         if 'username' in authentication and 'password' in authentication:
-            self.jira = jira.client.JIRA({'server': source['server']},
-                                         basic_auth=(authentication['username'],
-                                                     authentication['password']))
+            self._connection = ({'server': source['server']},
+                                {'basic_auth': (authentication['username'],
+                                                authentication['password'])})
         elif ('access_token' in authentication and
               'access_token_secret' in authentication and
               'consumer_key' in authentication and
@@ -58,11 +188,11 @@ class JiraWrapper(object):
             except IOError:
                 raise MissingConfigItem('key_cert', "key_cert not found:{0}". format(authentication['key_cert']))
 
-            self.jira = jira.client.JIRA({'server': source['server']},
-                                         oauth={'access_token': authentication['access_token'],
-                                                'access_token_secret': authentication['access_token_secret'],
-                                                'consumer_key': authentication['consumer_key'],
-                                                'key_cert': key_cert_data})
+            self._connection = ({'server': source['server']},
+                                {'oauth': {'access_token': authentication['access_token'],
+                                           'access_token_secret': authentication['access_token_secret'],
+                                           'consumer_key': authentication['consumer_key'],
+                                           'key_cert': key_cert_data}})
         else:
             raise MissingConfigItem('authentication', "Authentication misconfigured")
 
@@ -70,27 +200,102 @@ class JiraWrapper(object):
         self.cycles = None
         self.types = None
         self.until_date = None
+        self.from_date = None
 
         if 'until_date' in config:
             self.until_date = datetime.strptime(config['until_date'], '%Y-%m-%d').date()
 
+        # Only fetch and keep history for the window we are reporting on
+
+        if 'from_date' in config:
+            self.from_date = datetime.strptime(config['from_date'], '%Y-%m-%d').date()
+
         try:
             self.categories = config['categories']
             self.cycles = config['cycles']
         except KeyError as e:
             raise MissingConfigItem(e.message, "Missing Config Item:{0}".format(e.message))
 
+        # Build work items from the search endpoint's JSON unless told to
+        # use the client's Resources
+
+        self.ingest = source.get('ingest', 'json')
+
+        # Fetch every category in one search and sort the issues into
+        # categories ourselves, rather than one search per category
+
+        self.search = source.get('search', 'separate')
+
+        # How to page through big searches: by offset or by key, and
+        # optionally split into created date partitions fetched at once
+
+        self.paging = source.get('paging', 'offset')
+        self.partition_days = source.get('partition_days')
+        self.partition_threads = source.get('partition_threads', 4)
+        self.resume = source.get('resume')
+
+        # Write a dot to stdout for each page fetched
+
+        self.progress = True
+
+        # Other changelog fields to keep the history of, e.g. Flagged or
+        # assignee.  They come in the changelog we already expand.
+
+        self.changelog_fields = config.get('changelog_fields', [])
+
+        # Freeze done issues into an archive at each sync and only fetch
+        # the rest from JIRA the next time
+
+        self.archive = None
+        self.done_states = config.get('counts_towards_throughput', [])
+        self.hot_since = None
+
+        if 'archive' in source:
+            self.archive = ColdArchive(source['archive'], self.categories, self.done_states, self.cycles,
+                                       self.changelog_fields)
+
         self.all_issues = None
 
+    @property
+    def jira(self):
+        """
+        The JIRA client we were given, or this thread's, connected on
+        first use
+        """
+
+        if self._jira is not None:
+            return self._jira
+
+        client = getattr(self._clients, 'client', None)
+
+        if client is None:
+            import jira.client
+            options, authentication = self._connection
+            client = self._clients.client = jira.client.JIRA(options, **authentication)
+
+        return client
+
+    @jira.setter
+    def jira(self, client):
+        self._jira = client
+
     def work_items(self):
         """
         All issues
         """
         if self.all_issues is None:
-            self.all_issues = self._issues_from_jira()
+            self.all_issues = self._sync()
 
         return self.all_issues
 
+    def refresh(self):
+        """
+        Fetch all issues again
+        """
+
+        self.all_issues = self._sync()
+
+        return self.all_issues
 
     def totals(self):
         """
@@ -107,138 +312,433 @@ class JiraWrapper(object):
 # Internal methods
 ###############################################################################
 
+    def _sync(self):
+        """
+        All issues - with an archive, the hot ones from JIRA and the cold
+        ones from the archive, freezing any that are now done
+        """
+
+        if self.archive is None:
+            return self._issues_from_jira()
+
+        synced = date.today()
+
+        # Done issues resolved before the window aren't reported on, but
+        # they stay in the archive for a wider sync to find
+
+        resting = []
+
+        with instrument.span('thaw') as thaw:
+            cold = self.archive.load(self.until_date, self.from_date, resting)
+            thaw.count('work items', len(cold))
+
+        # A sync going back further than the archive does fetches every
+        # issue in its window again
+
+        self.hot_since = self.archive.since(self.from_date)
+
+        covered = self.from_date
+        if self.hot_since is not None:
+            covered = self.archive.covered()
+
+        try:
+            hot = self._issues_from_jira()
+        finally:
+            self.hot_since = None
+
+        fetched = set([work_item.id for work_item in hot])
+        work_items = hot + [work_item for work_item in cold if work_item.id not in fetched]
+
+        resting = [work_item for work_item in resting if work_item.id not in fetched]
+
+        with instrument.span('freeze') as freeze:
+            freeze.count('work items', self.archive.save(work_items + resting, synced, covered))
+
+        return work_items
+
     def _issues_from_jira(self, filter=None):
         """
         Get the actual issues from Jira itself via the Jira REST API
         """
 
-        batch_size = 100
         work_items = []
+        separate = list(self.categories)
+
+        if self.search == 'combined':
+            separate = self._categories_one_search(filter, work_items)
+
+        for category in separate:
+            for issue in self._issues(self.categories[category], filter):
+                work_items.extend(self._work_items(issue, [category]))
+
+        return work_items
+
+    def _categories_one_search(self, filter, work_items):
+        """
+        Fetch the issues for every category we can sort issues into
+        ourselves in one search, adding their work items to work_items.
+        Returns the categories which still need searching for on their own.
+        """
+
+        separate = []
+        predicates = []
 
         for category in self.categories:
+            try:
+                predicates.append((category, predicate(self.categories[category])))
+            except UnsupportedJql:
+                separate.append(category)
 
-            n = 0
-            while 1:
-
-                jql = self.categories[category]
-                if filter is not None:
-                    jql = jql + filter
-
-                issue_batch = self.jira.search_issues(jql,
-                                                      startAt=n,
-                                                      maxResults=batch_size,
-                                                      expand='changelog')
-
-                if issue_batch is None:
-                    #TODO: Fix mocking so we can get rid of this.
-                    # 'expand' seems to have some magic meaning in Mockito...
-                    issue_batch = self.jira.search_issues(jql,
-                                                          startAt=n,
-                                                          maxResults=batch_size)
-
-                for issue in issue_batch:
-
-                    issue.category = category
-                    issue_history = None
-                    cycles = {}
-
-                    date_created = datetime.strptime(issue.fields.created[:10], '%Y-%m-%d')
-
-                    if issue.changelog is not None:
-                        issue_history = history_from_jira_changelog(issue.changelog, date_created, self.until_date)
-
-                        try:
-
-                            for cycle in self.cycles:
-                                reopened_state = None
-                                after_state = None
-                                start_state = None
-                                exit_state = None
-                                end_state = None
-                                include_states = None
-                                exclude_states = None
-
-                                if 'ignore' in self.cycles[cycle]:
-                                    reopened_state = self.cycles[cycle]['ignore']
-
-                                if 'after' in self.cycles[cycle]:
-                                    after_state = self.cycles[cycle]['after']
-
-                                if 'start' in self.cycles[cycle]:
-                                    start_state = self.cycles[cycle]['start']
-
-                                if 'exit' in self.cycles[cycle]:
-                                    exit_state = self.cycles[cycle]['exit']
-
-                                if 'include' in self.cycles[cycle]:
-                                    include_states = self.cycles[cycle]['include']
-
-                                if 'exclude' in self.cycles[cycle]:
-                                    exclude_states = self.cycles[cycle]['exclude']
-
-                                if 'end' in self.cycles[cycle]:
-                                    end_state = self.cycles[cycle]['end']
-
-                                    cycles[cycle] = cycle_time(issue_history,
-                                                               start_state=start_state,
-                                                               after_state=after_state,
-                                                               include_states=include_states,
-                                                               exclude_states=exclude_states,
-                                                               end_state=end_state,
-                                                               reopened_state=reopened_state)
-
-                                else:
-
-                                    cycles[cycle] = cycle_time(issue_history,
-                                                               start_state=start_state,
-                                                               after_state=after_state,
-                                                               include_states=include_states,
-                                                               exclude_states=exclude_states,
-                                                               exit_state=exit_state,
-                                                               reopened_state=reopened_state)
-
-                        except AttributeError:
-
-                            pass
-
-                    state_transitions = []
-                    if issue.changelog is not None:
-                        for change in issue.changelog.histories:
-                            st = self.state_transition(change)
-                            state_transitions.append(st)
-
-                    work_items.append(WorkItem(id=issue.key,
-                                               title=issue.fields.summary,
-                                               state=issue.fields.status.name,
-                                               type=issue.fields.issuetype.name,
-                                               history=issue_history,
-                                               state_transitions=state_transitions,
-                                               date_created=date_created,
-                                               cycles=cycles,
-                                               category=category))
-
-                if len(issue_batch) < batch_size:
-                    break
-                n += batch_size
+        epic_link = None
+        if any(['epic link' in category_predicate.fields for category, category_predicate in predicates]):
+            epic_link = self._epic_link_field()
+
+            if epic_link is None:
+                separate.extend([category for category, category_predicate in predicates
+                                 if 'epic link' in category_predicate.fields])
+                predicates = [(category, category_predicate) for category, category_predicate in predicates
+                              if 'epic link' not in category_predicate.fields]
+
+        if len(predicates) == 0:
+            return separate
+
+        # In parentheses, so that a filter added on applies to them all
+
+        jql = '({0})'.format(' OR '.join(['({0})'.format(without_order_by(self.categories[category]))
+                                          for category, category_predicate in predicates]))
+
+        fields = CATEGORY_FIELDS
+        if epic_link is not None:
+            fields = fields + ',' + epic_link
+
+        for issue in self._issues(jql, filter, RAW_FIELDS + ',' + fields):
+
+            issue_fields = _category_fields(issue, epic_link)
+
+            categories = [category for category, category_predicate in predicates
+                          if category_predicate(issue_fields)]
+
+            work_items.extend(self._work_items(issue, categories))
+
+        return separate
+
+    def _epic_link_field(self):
+        """
+        The id of the custom field JIRA keeps the Epic Link in, if it has one
+        """
+
+        try:
+            for field in self.jira.fields():
+                if field.get('name') == 'Epic Link':
+                    return field['id']
+        except (AttributeError, TypeError):
+            pass
+
+        return None
+
+    def _issues(self, jql, filter=None, fields=RAW_FIELDS):
+        """
+        Every issue matching jql, a page at a time
+        """
+
+        # JIRA only compares keys within the project of the key compared
+        # with, so keyset paging through more than one project would skip
+        # the other projects' issues
+
+        keyset = self.paging == 'keyset' and project(jql) is not None
+
+        if filter is not None:
+            jql = jql + filter
+
+        if self.from_date is not None:
+            jql = window_jql(jql, self.from_date)
+
+        if self.hot_since is not None:
+            jql = hot_jql(jql, self.done_states, self.hot_since)
+
+        if self.partition_days is not None:
+            return self._partitioned(jql, fields, keyset)
+
+        return self._pages(jql, fields, self.progress, keyset)
+
+    def _pages(self, jql, fields=RAW_FIELDS, progress=True, keyset=False):
+        """
+        Page through the issues matching jql, either by offset or, if
+        keyset, by asking for the issues after the last key seen.  jql
+        must then be within one project.  Writes a dot for each page
+        unless progress is False.
+        """
+
+        batch_size = 100
+
+        n = 0
+        last_key = None
+        while 1:
+
+            with instrument.span('fetch') as fetch:
+
+                if keyset:
+                    issue_batch = self._search(keyset_jql(jql, last_key), 0, batch_size, fields)
+                else:
+                    issue_batch = self._search(jql, n, batch_size, fields)
+
+                fetch.count('pages')
+                fetch.count('issues', len(issue_batch))
+
+            for issue in issue_batch:
+                yield issue
+
+            if len(issue_batch) < batch_size:
+                break
+            n += batch_size
+            last_key = _key(issue_batch[-1])
+            if progress:
                 sys.stdout.write('.')
                 sys.stdout.flush()
 
-        return work_items
+    def _partitioned(self, jql, fields=RAW_FIELDS, keyset=False):
+        """
+        The issues matching jql, fetched a created date partition at a
+        time on partition_threads threads.  Partitions already fetched by
+        an earlier crawl which didn't finish are read from resume instead.
+        """
 
-    def state_transition(self, history):
+        first = self._search(without_order_by(jql) + ' ORDER BY created ASC', 0, 1, fields)
+        last = self._search(without_order_by(jql) + ' ORDER BY created DESC', 0, 1, fields)
 
-        timestamp = dateutil.parser.parse(history.created)
+        if len(first) == 0 or len(last) == 0:
+            return []
 
-        for item in history.items:
-            if item.field == 'status':
-                from_state = item.fromString
-                to_state = item.toString
+        ranges = partitions(parse_date(_created(first[0])), parse_date(_created(last[0])), self.partition_days)
 
-                return {'from': from_state,
-                        'to': to_state,
-                        'timestamp': timestamp}
+        state = None
+        if self.resume is not None:
+            state = CrawlState(self.resume, jql)
 
-        return None
+        fetched = {}
+        if state is not None:
+            for partition in ranges:
+                issues = state.load(partition)
+                if issues is not None:
+                    fetched[partition] = issues
+
+        todo = Queue.Queue()
+        for partition in ranges:
+            if partition not in fetched:
+                todo.put(partition)
+
+        errors = []
+
+        def fetch_partitions():
+            while len(errors) == 0:
+                try:
+                    partition = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    # Pages fetched are counted by instrument rather
+                    # than having threads write dots over each other
+
+                    issues = list(self._pages(partition_jql(jql, *partition), fields, False, keyset))
+                    if state is not None:
+                        state.save(partition, issues)
+                    fetched[partition] = issues
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=fetch_partitions) for n in range(self.partition_threads)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        if state is not None:
+            state.clear()
+
+        return [issue for partition in ranges for issue in fetched[partition]]
+
+    def _work_items(self, issue, categories):
+        """
+        A work item for issue in each of categories
+        """
+
+        if len(categories) == 0:
+            return []
+
+        with instrument.span('parse') as parse:
+
+            key, summary, status, issue_type, created, changes, other_changes = self._parse(issue, categories[0])
+
+            date_created = datetime.strptime(created[:10], '%Y-%m-%d')
+
+            state_transitions = []
+            if changes is not None:
+                for change_created, items in changes:
+                    state_transitions.append(_state_transition(change_created, items))
+
+            field_transitions = None
+            if other_changes is not None:
+                field_transitions = {}
+                for field in other_changes:
+                    field_transitions[field] = _field_transitions(other_changes[field])
+
+            parse.count('issues')
+            parse.count('changes', len(state_transitions))
+
+        issue_history = None
+        cycles = {}
+
+        if changes is not None:
+
+            with instrument.span('history') as build:
+
+                runs = time_in_states_from_status_changes(changes, from_date=date_created, until_date=self.until_date)
+                issue_history = history_from_time_in_states(runs, date_created, self.from_date)
+
+                # Cycles cover the whole life of the issue, not just the window
+                cycles = self._cycles(runs)
+
+                build.count('issues')
+                build.count('days', len(issue_history))
+
+        return [WorkItem(id=key,
+                         title=summary,
+                         state=status,
+                         type=issue_type,
+                         history=issue_history,
+                         state_transitions=state_transitions,
+                         date_created=date_created,
+                         cycles=cycles,
+                         field_transitions=field_transitions,
+                         category=category) for category in categories]
+
+    def _search(self, jql, start, batch_size, fields=RAW_FIELDS):
+        """
+        A page of issues, taking turns with other threads if we were given
+        the client rather than connecting our own
+        """
+
+        if self._jira is None:
+            return self._search_page(jql, start, batch_size, fields)
+
+        with self._given:
+            return self._search_page(jql, start, batch_size, fields)
+
+    def _search_page(self, jql, start, batch_size, fields=RAW_FIELDS):
+        """
+        A page of issues, as the search endpoint's JSON if we can get it
+        as that saves the client building Resources for every field of
+        every issue and change.  Falls back to Resources for clients and
+        servers which won't give us JSON.
+        """
+
+        if self.ingest == 'json':
+
+            try:
+                page = self.jira.search_issues(jql,
+                                               startAt=start,
+                                               maxResults=batch_size,
+                                               fields=fields,
+                                               expand='changelog',
+                                               json_result=True)
+            except TypeError:
+                page = None
+
+            if isinstance(page, dict) and isinstance(page.get('issues'), list):
+                return page['issues']
+
+            self.ingest = 'resources'
+
+        issue_batch = self.jira.search_issues(jql,
+                                              startAt=start,
+                                              maxResults=batch_size,
+                                              expand='changelog')
+
+        if issue_batch is None:
+            #TODO: Fix mocking so we can get rid of this.
+            # 'expand' seems to have some magic meaning in Mockito...
+            issue_batch = self.jira.search_issues(jql,
+                                                  startAt=start,
+                                                  maxResults=batch_size)
+
+        return issue_batch
+
+    def _parse(self, issue, category):
+        """
+        The fields we use from an issue, whether it is the search
+        endpoint's JSON or a Resource
+        """
+
+        if isinstance(issue, dict):
+
+            fields = issue['fields']
+
+            changes = None
+            other_changes = None
+            changelog = issue.get('changelog')
+            if changelog is not None:
+
+                # One pass over the changelog for status and any other fields
+
+                changes = []
+                other_changes = dict([(field, []) for field in self.changelog_fields])
+
+                for history in changelog['histories']:
+
+                    by_field = {}
+                    for item in history['items']:
+                        by_field.setdefault(item.get('field'), []).append((item.get('fromString'), item.get('toString')))
+
+                    changes.append((history['created'], by_field.get('status', [])))
+
+                    for field in other_changes:
+                        if field in by_field:
+                            other_changes[field].append((history['created'], by_field[field]))
+
+            return (issue['key'],
+                    fields['summary'],
+                    fields['status']['name'],
+                    fields['issuetype']['name'],
+                    fields['created'],
+                    changes,
+                    other_changes)
+
+        issue.category = category
+
+        changes = None
+        other_changes = None
+        if issue.changelog is not None:
+            changes = status_changes(issue.changelog.histories)
+            other_changes = dict([(field, field_changes(issue.changelog.histories, field))
+                                  for field in self.changelog_fields])
+
+        return (issue.key,
+                issue.fields.summary,
+                issue.fields.status.name,
+                issue.fields.issuetype.name,
+                issue.fields.created,
+                changes,
+                other_changes)
+
+    def _cycles(self, issue_history):
+        """
+        Cycle times for each of the configured cycles, from the time the
+        issue spent in each state
+        """
+
+        return cycle_times(self.cycles, issue_history)
+
+    def state_transition(self, history):
+
+        created, items = status_changes([history])[0]
+
+        return _state_transition(created, items)
 
     # This is on its way out
 
@@ -0,0 +1,294 @@
+"""
+Local evaluation of simple JQL.
+
+Lets us fetch the issues for every category in one search and then sort
+them into categories ourselves.  Only the handful of predicates we use
+to define categories are understood:
+
+    project, component, labels, "Epic Link" and issuetype
+
+compared with =, !=, IN, NOT IN, IS EMPTY and IS NOT EMPTY and combined
+with AND, OR, NOT and parentheses.  Anything else raises UnsupportedJql
+so that the category can be searched for on its own instead.
+"""
+
+import re
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|(,)|(!=|=)|"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|([^\s(),=!"\']+))')
+
+_FIELDS = {'project': 'project',
+           'component': 'component',
+           'components': 'component',
+           'labels': 'labels',
+           'label': 'labels',
+           'epic link': 'epic link',
+           'issuetype': 'issuetype',
+           'type': 'issuetype'}
+
+_ORDER_BY = re.compile(r'\s+order\s+by\s+.*$', re.IGNORECASE | re.DOTALL)
+
+
+class UnsupportedJql(ValueError):
+    pass
+
+
+def split_order_by(jql):
+    """
+    jql as the query and its ORDER BY clause, with the space before it,
+    or '' if it hasn't one
+    """
+
+    match = _ORDER_BY.search(jql)
+
+    if match is None:
+        return jql, ''
+
+    return jql[:match.start()], jql[match.start():]
+
+
+def without_order_by(jql):
+    """
+    jql without any ORDER BY clause
+    """
+
+    return split_order_by(jql)[0]
+
+
+def _tokens(jql):
+
+    tokens = []
+    position = 0
+    jql = jql.strip()
+
+    while position < len(jql):
+
+        match = _TOKEN.match(jql, position)
+
+        if match is None or match.end() == position:
+            raise UnsupportedJql("Can't read JQL at:{0}".format(jql[position:]))
+
+        open_paren, close_paren, comma, operator, double_quoted, single_quoted, word = match.groups()
+
+        if double_quoted is not None or single_quoted is not None:
+            text = double_quoted if double_quoted is not None else single_quoted
+            tokens.append(('string', re.sub(r'\\(.)', r'\1', text)))
+        elif word is not None:
+            tokens.append(('word', word))
+        else:
+            tokens.append(('symbol', open_paren or close_paren or comma or operator))
+
+        position = match.end()
+
+    return tokens
+
+
+class Predicate(object):
+    """
+    A compiled JQL query.  Call it with a dict of each field's values
+    for an issue to see if the issue matches.  projects is the set of
+    projects every matching issue must be in, or None if it could be in
+    any project.
+    """
+
+    def __init__(self, jql):
+
+        self.jql = jql
+        self.fields = set()
+
+        self._tokens = _tokens(without_order_by(jql))
+        self._position = 0
+
+        if len(self._tokens) == 0:
+            raise UnsupportedJql("Empty JQL")
+
+        self._match, self.projects = self._or()
+
+        if self._position != len(self._tokens):
+            raise UnsupportedJql("Unexpected:{0}".format(self._tokens[self._position][1]))
+
+        del self._tokens
+
+    def __call__(self, issue_fields):
+
+        return self._match(issue_fields)
+
+    def _peek(self):
+
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+
+        return (None, None)
+
+    def _next(self):
+
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _keyword(self, *keywords):
+        """
+        Consume the next token if it is one of keywords
+        """
+
+        kind, text = self._peek()
+
+        if kind == 'word' and text.upper() in keywords:
+            self._position += 1
+            return text.upper()
+
+        return None
+
+    def _expect(self, symbol):
+
+        kind, text = self._next()
+
+        if kind != 'symbol' or text != symbol:
+            raise UnsupportedJql("Expected {0}".format(symbol))
+
+    # Each of these returns a function matching issue fields and the
+    # projects the issues it matches must be in, or None for any project
+
+    def _or(self):
+
+        terms = [self._and()]
+
+        while self._keyword('OR'):
+            terms.append(self._and())
+
+        if len(terms) == 1:
+            return terms[0]
+
+        projects = None
+        if all([term_projects is not None for term, term_projects in terms]):
+            projects = set().union(*[term_projects for term, term_projects in terms])
+
+        matches = [term for term, term_projects in terms]
+
+        return lambda issue_fields: any([term(issue_fields) for term in matches]), projects
+
+    def _and(self):
+
+        factors = [self._not()]
+
+        while self._keyword('AND'):
+            factors.append(self._not())
+
+        if len(factors) == 1:
+            return factors[0]
+
+        projects = None
+        for factor, factor_projects in factors:
+            if factor_projects is not None:
+                projects = factor_projects if projects is None else projects & factor_projects
+
+        matches = [factor for factor, factor_projects in factors]
+
+        return lambda issue_fields: all([factor(issue_fields) for factor in matches]), projects
+
+    def _not(self):
+
+        if self._keyword('NOT'):
+            factor, factor_projects = self._not()
+            return lambda issue_fields: not factor(issue_fields), None
+
+        if self._peek() == ('symbol', '('):
+            self._next()
+            expression = self._or()
+            self._expect(')')
+            return expression
+
+        return self._clause()
+
+    def _value(self):
+
+        kind, text = self._next()
+
+        if kind not in ['string', 'word']:
+            raise UnsupportedJql("Expected a value")
+
+        return text.lower()
+
+    def _clause(self):
+
+        kind, name = self._next()
+
+        if kind not in ['string', 'word'] or name.lower() not in _FIELDS:
+            raise UnsupportedJql("Unsupported field:{0}".format(name))
+
+        field = _FIELDS[name.lower()]
+        self.fields.add(field)
+
+        def values(issue_fields):
+            return [value.lower() for value in issue_fields.get(field) or [] if value is not None]
+
+        kind, operator = self._peek()
+
+        if kind == 'symbol' and operator in ['=', '!=']:
+
+            self._next()
+            value = self._value()
+
+            if operator == '=':
+                projects = set([value]) if field == 'project' else None
+                return lambda issue_fields: value in values(issue_fields), projects
+
+            # As in JIRA, != doesn't match issues with no value at all
+
+            return lambda issue_fields: len(values(issue_fields)) > 0 and value not in values(issue_fields), None
+
+        negated = self._keyword('NOT') is not None
+
+        if self._keyword('IN'):
+
+            self._expect('(')
+            choices = [self._value()]
+            while self._peek() == ('symbol', ','):
+                self._next()
+                choices.append(self._value())
+            self._expect(')')
+
+            if negated:
+                return lambda issue_fields: (len(values(issue_fields)) > 0 and
+                                             not any([value in choices for value in values(issue_fields)])), None
+
+            projects = set(choices) if field == 'project' else None
+            return lambda issue_fields: any([value in choices for value in values(issue_fields)]), projects
+
+        if not negated and self._keyword('IS'):
+
+            not_empty = self._keyword('NOT') is not None
+
+            if self._keyword('EMPTY', 'NULL') is None:
+                raise UnsupportedJql("Expected EMPTY")
+
+            if not_empty:
+                return lambda issue_fields: len(values(issue_fields)) > 0, None
+
+            return lambda issue_fields: len(values(issue_fields)) == 0, None
+
+        raise UnsupportedJql("Unsupported operator:{0}".format(operator))
+
+
+def predicate(jql):
+    """
+    Compile jql, raising UnsupportedJql if we can't evaluate it ourselves
+    """
+
+    return Predicate(jql)
+
+
+def project(jql):
+    """
+    The one project every issue matching jql is in, or None if they
+    could be in more than one or jql is beyond us
+    """
+
+    try:
+        projects = predicate(jql).projects
+    except UnsupportedJql:
+        return None
+
+    if projects is None or len(projects) != 1:
+        return None
+
+    return list(projects)[0]
@@ -0,0 +1,261 @@
+"""
+The state of every work item on every day, as a matrix of state codes.
+
+Metrics.history is the daily history of every work item as a DataFrame of
+state names, which gets big - days x work items of Python objects.  The
+matrix holds the same thing as int16 state codes, a row for each day and
+a column for each work item, in a file mapped into memory.  It is filled
+in from the cube's runs rather than by walking the histories again, and
+any number of processes can map the same file and read it without a copy
+of their own.
+
+Days a work item has no state, before it was created or after its history
+ends, are -1.  The last row stands for every day after the last one we
+know of, when only the runs which go on for ever are still going.  Row r
+is day first_day + r, so the days need no index of their own.
+
+The matrix is filled in and read a run of rows at a time, as many as fit
+in a memory budget, so it can be bigger than the memory we have.
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cube import _OPEN
+from transitions import day_number, day_date
+
+# Bytes of working memory to keep within, unless given another budget
+
+DEFAULT_BUDGET = 256 << 20
+
+# Bytes of working memory each cell of a row takes - when building, its
+# state code and the positions and codes filled in with it; when reading,
+# its state code and the state name it becomes
+
+_BUILD_BYTES = 2 + 5 * 8
+_CODE_BYTES = 2
+_NAME_BYTES = np.dtype(object).itemsize
+
+
+def _rows_within(budget, row_bytes):
+    """
+    How many rows of row_bytes each fit in budget, at least one
+    """
+
+    return max(1, budget // max(row_bytes, 1))
+
+
+def _expand(starts, lengths):
+    """
+    Every position from each of starts for each of lengths
+    """
+
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return np.repeat(starts, lengths) + offsets
+
+
+class StateMatrix(object):
+    """
+    A days x work items matrix of state codes kept in directory
+    """
+
+    def __init__(self, directory, budget=None):
+
+        with open(os.path.join(directory, 'matrix.json')) as infile:
+            names = json.load(infile)
+
+        self.directory = directory
+        self.states = names['states']
+        self.ids = names['ids']
+        self.cells = [tuple(cell) for cell in names['cells']]
+        self.first_day = names['first_day']
+        self.budget = budget or DEFAULT_BUDGET
+
+        self.codes = np.memmap(os.path.join(directory, 'matrix.dat'),
+                               dtype=np.int16,
+                               mode='r',
+                               shape=tuple(names['shape']))
+
+    @classmethod
+    def build(cls, cube, directory, budget=None):
+        """
+        Fill in the matrix for the work items counted in cube, within
+        budget bytes of working memory
+        """
+
+        columns = np.array([index for index, key in enumerate(cube.keys) if key is not None], dtype=np.int64)
+
+        position = np.empty(len(cube.keys), dtype=np.int64)
+        position.fill(-1)
+        position[columns] = np.arange(len(columns))
+
+        num_rows = len(cube.in_state)
+        num_columns = len(columns)
+
+        column = position[cube.run_item]
+        start = cube.run_start - cube.first_day
+        end = np.where(cube.run_end < _OPEN, cube.run_end - cube.first_day, num_rows)
+
+        names = {'states': cube.states,
+                 'ids': [cube.ids[index] for index in columns],
+                 'cells': [cube.cells[cube.cell[index]] for index in columns],
+                 'first_day': int(cube.first_day),
+                 'shape': [num_rows, max(num_columns, 1)]}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filename = os.path.join(directory, 'matrix.')
+
+        # Write then rename, so that anything still reading the last matrix
+        # keeps the file it mapped.  Each build writes files of its own, so
+        # two building at once can't write over each other.
+
+        handle, codes_filename = tempfile.mkstemp(prefix='matrix.', suffix='.dat.tmp', dir=directory)
+        os.close(handle)
+
+        codes = np.memmap(codes_filename, dtype=np.int16, mode='w+', shape=tuple(names['shape']))
+
+        step = _rows_within(budget or DEFAULT_BUDGET, num_columns * _BUILD_BYTES)
+
+        for first in range(0, num_rows, step):
+
+            last = min(num_rows, first + step)
+
+            block = np.empty((last - first, num_columns), dtype=np.int16)
+            block.fill(-1)
+
+            run_start = np.clip(start, first, last)
+            run_end = np.clip(end, first, last)
+            lengths = np.maximum(run_end - run_start, 0)
+
+            block[_expand(run_start - first, lengths),
+                  np.repeat(column, lengths)] = np.repeat(cube.run_state, lengths)
+
+            codes[first:last, :num_columns] = block
+
+        codes.flush()
+        del codes
+
+        handle, names_filename = tempfile.mkstemp(prefix='matrix.', suffix='.json.tmp', dir=directory)
+
+        with os.fdopen(handle, 'w') as outfile:
+            json.dump(names, outfile)
+
+        os.rename(codes_filename, filename + 'dat')
+        os.rename(names_filename, filename + 'json')
+
+        return cls(directory, budget)
+
+    def columns(self, issue_types=None):
+        """
+        The columns of the work items of issue_types, or all of them
+        """
+
+        if issue_types is None:
+            return np.arange(len(self.ids))
+
+        return np.array([index for index, (category, issue_type) in enumerate(self.cells)
+                         if issue_type in issue_types], dtype=np.int64)
+
+    def days(self, from_date=None, until_date=None):
+        """
+        The day numbers from from_date to until_date inclusive, or from the
+        first day we know of up to the last
+        """
+
+        first = self.first_day if from_date is None else day_number(from_date)
+        last = self.first_day + len(self.codes) - 2 if until_date is None else day_number(until_date)
+
+        return np.arange(first, last + 1, dtype=np.int64)
+
+    def rows(self, days, columns):
+        """
+        The state codes of columns on each of days
+        """
+
+        if len(days) == 0:
+            return np.empty((0, len(columns)), dtype=np.int16)
+
+        rows = days - self.first_day
+
+        # Only the rows between the first and last of days are read in
+
+        clipped = np.clip(rows, 0, len(self.codes) - 1)
+        first = clipped.min()
+
+        codes = self.codes[first:clipped.max() + 1][clipped - first][:, columns]
+        codes[rows < 0] = -1
+
+        return codes
+
+    def chunks(self, days, columns):
+        """
+        The state codes of columns on each of days, as (days, codes) for
+        as many days at a time as fit in the memory budget
+        """
+
+        row_bytes = self.codes.shape[1] * _CODE_BYTES + len(columns) * (_CODE_BYTES + _NAME_BYTES)
+        step = _rows_within(self.budget, row_bytes)
+
+        for first in range(0, len(days), step):
+            chunk = days[first:first + step]
+            yield chunk, self.rows(chunk, columns)
+
+    def _in_id_order(self, columns):
+
+        if columns is None:
+            columns = self.columns()
+
+        # Work items in id order, as a DataFrame made from a dict has them
+
+        return sorted(columns, key=lambda column: self.ids[column])
+
+    def history_chunks(self, from_date=None, until_date=None, columns=None):
+        """
+        The daily history of the work items in columns between from_date
+        and until_date inclusive, as DataFrames of the days they were in
+        a state, as many days at a time as fit in the memory budget
+        """
+
+        columns = self._in_id_order(columns)
+
+        if len(columns) == 0:
+            return
+
+        names = np.array(self.states + [np.nan], dtype=object)
+        labels = [self.ids[column] for column in columns]
+
+        for days, codes in self.chunks(self.days(from_date, until_date), columns):
+
+            present = (codes >= 0).any(axis=1)
+
+            if present.any():
+                yield pd.DataFrame(names[codes[present]],
+                                   index=pd.DatetimeIndex([day_date(day) for day in days[present]]),
+                                   columns=labels)
+
+    def history(self, from_date=None, until_date=None, columns=None):
+        """
+        The daily history of the work items in columns between from_date
+        and until_date inclusive, as Metrics.history gives it
+        """
+
+        columns = self._in_id_order(columns)
+
+        if len(columns) == 0:
+            return pd.DataFrame()
+
+        chunks = list(self.history_chunks(from_date, until_date, columns))
+
+        if len(chunks) == 0:
+            return pd.DataFrame(np.empty((0, len(columns)), dtype=object),
+                                index=pd.DatetimeIndex([]),
+                                columns=[self.ids[column] for column in columns])
+
+        return pd.concat(chunks)
@@ -1,21 +1,29 @@
 """
 Metrics
 """
-from jlf_stats.fogbugz_wrapper import FogbugzWrapper
-from jlf_stats.jira_wrapper import JiraWrapper
-
 import pandas as pd
 import numpy as np
-import math
 
 import exceptions
+import instrument
 from bucket import bucket_labels
-from index import fill_date_index_blanks, week_start_date
-from history import arrivals, history_from_state_transitions
+from index import fill_date_index_blanks
+from history import START_STATE
+from transitions import Transitions, IntervalIndex, weekly_arrivals, weekly_counts, week_ending_monday, week_starting_monday, day_number, day_date, state_intervals
+from cube import Cube
+from matrix import StateMatrix
+from sketch import SketchStore
+from federation import FederatedSource, source_configs
+import forecast
 
 import re
 import os
 import json
+import atexit
+import shutil
+import tempfile
+from datetime import date, timedelta
+
 
 class Metrics(object):
 
@@ -23,18 +31,22 @@ class Metrics(object):
 
         self.source = None
         self.work_items = None
+        self._transitions = None
+        self._field_transitions = {}
+        self._interval_indexes = {}
+        self._sketches = None
+        self._cube = None
+        self._last_cube = None
+        self._matrix = None
+        self._matrix_directory = None
         self.states = []
         self.config = config
 
-        if config['source']['type'] == 'fogbugz':
-            self.source = FogbugzWrapper(self.config)
-        elif config['source']['type'] == 'jira':
-
-            m = re.match("^ENV\(([^\']+)\)", self.config['source']['authentication']['password'])
-            if m is not None:
-                self.config['source']['authentication']['password'] = os.environ.get(m.group(1), 'undefined')
-
-            self.source = JiraWrapper(self.config)
+        if isinstance(config['source'], list):
+            self.source = FederatedSource([(name, _source(source_config))
+                                           for name, source_config in source_configs(self.config)])
+        else:
+            self.source = _source(self.config)
 
         if 'throughput_dow' in config:
             self.throughput_dow = config['throughput_dow']
@@ -55,6 +67,51 @@ class Metrics(object):
         except KeyError:
             pass
 
+    def load(self, work_items):
+        """
+        Use work_items from now on, forgetting anything calculated from
+        the previous ones
+        """
+
+        self.work_items = work_items
+        self._transitions = None
+        self._field_transitions = {}
+        self._interval_indexes = {}
+        self._sketches = None
+
+        # The next cube only has to walk the work items which changed
+
+        if self._cube is not None:
+            self._last_cube = self._cube
+        self._cube = None
+        self._matrix = None
+
+    def refresh(self):
+        """
+        Fetch the work items again from the source
+        """
+
+        self.load(self.source.refresh())
+
+    def warm(self):
+        """
+        Work out now everything which is otherwise worked out from the
+        work items on first use and kept, so that threads sharing this
+        Metrics only ever read it
+        """
+
+        today = date.today()
+
+        self.transitions()
+        self._on(today)
+
+        for field in self.config.get('changelog_fields', []):
+            self.transitions(field)
+            self._on(today, field)
+
+        self.cube()
+        self.cycle_time_sketches()
+
     def work_item(self, id):
         """
         Get an individual work item.
@@ -85,34 +142,32 @@ class Metrics(object):
             return df.filter(fields)
 
     def history(self, from_date=None, until_date=None, types=None):
+        """
+        The state each work item was in on each day, read from the state
+        matrix
+        """
 
-        if self.work_items is None:
-            self.work_items = self.source.work_items()
+        matrix = self.matrix()
 
-        history = {}
+        issue_types = None
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
 
-        for work_item in self.work_items:
+        return matrix.history(from_date, until_date, matrix.columns(issue_types))
 
-            if types is None:
-                # HACK HACK HACK
-                # Also need some consistency around thing_date and date_thing
-                if isinstance(self.source, JiraWrapper):
-                    history[work_item.id] = work_item.history
-                else:
-                    history[work_item.id] = history_from_state_transitions(work_item.date_created.date(), work_item.history, until_date)
-            else:
-                for type_grouping in types:
-                    if work_item.type in self.types[type_grouping]: 
-                        if isinstance(self.source, JiraWrapper):
-                            history[work_item.id] = work_item.history
-                        else:
-                            history[work_item.id] = history_from_state_transitions(work_item.date_created.date(), work_item.history, until_date)
-
-        if history is not None:
-            df = pd.DataFrame(history)
-            return df
+    def history_chunks(self, from_date=None, until_date=None, types=None):
+        """
+        The same history as history gives, a run of days at a time, each
+        as many days as fit in the memory budget
+        """
 
-        return None
+        matrix = self.matrix()
+
+        issue_types = None
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+
+        return matrix.history_chunks(from_date, until_date, matrix.columns(issue_types))
 
     def throughput(self,
                    from_date,
@@ -128,49 +183,53 @@ class Metrics(object):
         allows us the most options as to where to place the 'finishing line'
         """
 
-        work_item_history = self.history(from_date, to_date)
-
-        work_item_rows = []
-
-        for work_item_key in work_item_history:
+        cube = self.cube()
 
-            work_item = self.work_item(work_item_key)
+        swimlanes = []
 
-            if category is not None:
+        for cell_category, cell_type in cube.cells:
 
-                if category != work_item.category:
-                    continue
+            swimlane = cell_category
 
-            swimlane = work_item.category
+            if category is not None and category != cell_category:
+                swimlane = None
 
             # Are we grouping by work type?
 
-            if types is not None:
+            elif types is not None:
                 for type_grouping in types:
-                    if work_item.type in self.types[type_grouping]:
+                    if cell_type in self.types[type_grouping]:
                         swimlane = swimlane + '-' + type_grouping
-                    else:
-                        continue
-                        # print "Not counting " + f.work_itemtype.name
-                if swimlane == work_item.category:
-                    continue
+                if swimlane == cell_category:
+                    swimlane = None
 
-            for day, state in work_item_history[work_item_key].iteritems():
-                if day.weekday() == self.throughput_dow:
+            swimlanes.append(swimlane)
 
-                    if state in self.counts_towards_throughput:
+        # 1970-01-01 was a Thursday
 
-                        work_item_row = {'swimlane': swimlane,
-                                         'id':       work_item_key,
-                                         'week':     day,
-                                         'count':    1}
-                        work_item_rows.append(work_item_row)
+        days = cube.days(from_date, to_date)
+        weeks = days[(days + 3) % 7 == self.throughput_dow]
+
+        done = [code for code, state in enumerate(cube.states) if state in self.counts_towards_throughput]
+        finished = cube.in_states(weeks)[:, :, done].sum(axis=2)
+
+        work_item_rows = []
+
+        for cell, swimlane in enumerate(swimlanes):
+
+            if swimlane is None:
+                continue
+
+            for week in np.flatnonzero(finished[:, cell]):
+                work_item_rows.append({'swimlane': swimlane,
+                                       'week':     pd.Timestamp(day_date(weeks[week])),
+                                       'count':    int(finished[week, cell])})
 
         df = pd.DataFrame(work_item_rows)
 
         if len(df.index) > 0:
 
-            table = pd.pivot_table(df, index=['week'], columns=['swimlane'], values='count', aggfunc=np.count_nonzero)
+            table = pd.pivot_table(df, index=['week'], columns=['swimlane'], values='count', aggfunc=np.sum)
 
             if cumulative:
                 return table
@@ -190,35 +249,97 @@ class Metrics(object):
 
             return None
 
+    def forecast(self,
+                 from_date,
+                 to_date,
+                 items=None,
+                 until_date=None,
+                 types=None,
+                 confidence=None,
+                 trials=forecast.DEFAULT_TRIALS,
+                 random_state=None):
+        """
+        Monte Carlo forecast for each swimlane from its weekly throughput
+        between from_date and to_date.
+
+        Given a number of items, the date by which we are each confidence
+        percent sure of having done them.  Given an until_date, the number
+        of items we are each confidence percent sure of having done by then.
+        """
+
+        if (items is None) == (until_date is None):
+            raise ValueError("Forecast either a number of items or until a date")
+
+        if confidence is None:
+            confidence = forecast.DEFAULT_CONFIDENCE
+
+        table = self.throughput(from_date, to_date, cumulative=True, types=types)
+
+        if table is None:
+            return None
+
+        # Differencing the cumulative throughput doesn't count the work done
+        # before the window as done in its first week
+
+        weekly = table.fillna(0).diff().iloc[1:].clip(lower=0)
+
+        forecasts = {}
+
+        for swimlane in weekly.columns:
+
+            try:
+                if items is not None:
+                    weeks = forecast.weeks_to_complete(weekly[swimlane], items, trials, random_state)
+                    forecasts[swimlane] = [pd.Timestamp(to_date) + pd.Timedelta(weeks=w) if np.isfinite(w) else pd.NaT
+                                           for w in forecast.completion_percentiles(weeks, confidence)]
+                else:
+                    num_weeks = (until_date - to_date).days // 7
+                    done = forecast.items_completed(weekly[swimlane], num_weeks, trials, random_state)
+                    forecasts[swimlane] = forecast.items_percentiles(done, confidence)
+            except ValueError:
+                # Nothing done in this swimlane so nothing to go on
+                continue
+
+        if len(forecasts) == 0:
+            return None
+
+        df = pd.DataFrame(forecasts, index=["{0}%".format(c) for c in confidence])
+        df.index.name = 'confidence'
+        return df
+
     def cfd(self, from_date=None, until_date=None, types=None):
         """
         Cumulative Flow Diagram
         """
 
-        cfd = self.history(from_date, until_date, types)
+        cube = self.cube()
 
-        days = {}
+        selected = np.ones(len(cube.cells), dtype=bool)
 
-        for day in cfd.index:
-            tickets = []
-            for ticket in cfd.ix[day]:
-                tickets.append(ticket)
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+            selected = np.array([cell_type in issue_types for cell_category, cell_type in cube.cells], dtype=bool)
 
-            def state_order(state):
+        days = cube.days(from_date, until_date)
+        in_states = cube.in_states(days)[:, selected, :].sum(axis=1)
+        counted = cube.counted[selected].sum()
 
-                try:
-                    return self.states.index(state)
-                except ValueError:
-                    if type(state) == float:
-                        if math.isnan(state):
-                            return -1
-                    if type(state) == np.float64:
-                        if math.isnan(state):
-                            return -1
+        present = in_states.sum(axis=1)
+        seen = [code for code in range(len(cube.states)) if in_states[:, code].any()]
+
+        for code in seen:
+            if cube.states[code] not in self.states:
+                raise exceptions.MissingState(cube.states[code], "Missing state:{0}".format(cube.states[code]))
+
+        # Each day's work items sorted by state, after those which aren't
+        # in any state that day
 
-                    raise exceptions.MissingState(state, "Missing state:{0}".format(state))
+        seen.sort(key=lambda code: self.states.index(cube.states[code]))
+        names = np.array([np.nan] + [cube.states[code] for code in seen], dtype=object)
 
-            days[day] = sorted(tickets, key=state_order)
+        days = dict((pd.Timestamp(day_date(days[row])),
+                     np.repeat(names, [counted - present[row]] + list(in_states[row, seen])))
+                    for row in np.flatnonzero(present))
 
         return pd.DataFrame(days)
 
@@ -228,71 +349,666 @@ class Metrics(object):
                              buckets=None):
         """
         Time taken for work to complete one or more 'cycles' - i.e. transitions from a start state to an end state
+
+        'cycle' may be a single cycle or a list of them.  All cycles and type groupings are binned together
+        so they share the same bucket edges.
         """
 
         if self.work_items is None:
             self.work_items = self.source.work_items()
 
-        cycle_time_data = {}
+        if isinstance(cycle, basestring):
+            cycles = [cycle]
+        else:
+            cycles = list(cycle)
+
+        if types is None:
+            keys = cycles
+        else:
+            keys = ["{0}-{1}".format(type_grouping, c) for type_grouping in types for c in cycles]
+
+        # One row per work item, one column per cycle
+
+        groups = []
+        rows = []
 
         for work_item in self.work_items:
 
+            group = 0
+
             if types is not None:
 
-                include = False
+                group = None
 
-                for type_grouping in types:
+                for index, type_grouping in enumerate(types):
 
                     if work_item.type in self.types[type_grouping]:
-                        include = True
-                        key = "{0}-{1}".format(type_grouping, cycle)
+                        group = index
                         break
 
-                if not include:
+                if group is None:
                     continue
 
-            else:
-                key = cycle
+            row = []
+            for c in cycles:
+                try:
+                    row.append(work_item.cycles[c])
+                except (KeyError, TypeError):
+                    row.append(None)
 
-            try:
-                if work_item.cycles[cycle] is not None:
-                    if key not in cycle_time_data:
-                        cycle_time_data[key] = [work_item.cycles[cycle]]
-                    else:
-                        cycle_time_data[key].append(work_item.cycles[cycle])
-            except KeyError:
-                continue
+            groups.append(group)
+            rows.append(row)
 
-        histogram = None
+        cycle_times = np.array(rows, dtype=np.float64).reshape(len(rows), len(cycles))
+        key_index = np.array(groups, dtype=np.int64)[:, np.newaxis] * len(cycles) + np.arange(len(cycles))
 
-        for cycle in cycle_time_data:
-            if buckets is not None:
+        found = ~np.isnan(cycle_times)
+        values = cycle_times[found]
+        key_index = key_index[found]
 
-                try:
-                    li = buckets.index('max')
-                    buckets[li] = max(cycle_time_data[cycle])
+        if len(values) == 0:
+            return None
 
-                except ValueError:
-                    pass
+        if buckets is not None:
+            longest = values.max()
+            if longest == int(longest):
+                longest = int(longest)
+            # Resolve 'max' on a copy so we don't change the caller's buckets
+            resolved = [longest if edge == 'max' else edge for edge in buckets]
+            labels = bucket_labels(resolved)
+            edges = np.array(resolved, dtype=np.float64)
+            if np.any(np.diff(edges) < 0):
+                raise ValueError('bins must increase monotonically')
+        else:
+            count, edges = np.histogram(values)
+            labels = bucket_labels(edges)
 
-                labels = bucket_labels(buckets)
-                count, division = np.histogram(cycle_time_data[cycle], bins=buckets)
-            else:
+        num_buckets = len(edges) - 1
 
-                count, division = np.histogram(cycle_time_data[cycle])
-                labels = bucket_labels(division)
+        # Same rule as np.histogram - the last bucket includes its right hand edge
 
-            cycle_histogram = pd.DataFrame(count, index=labels, columns=[cycle])
-            cycle_histogram.index.name = 'bucket'
+        bucket = np.searchsorted(edges, values, side='right') - 1
+        bucket[values == edges[-1]] = num_buckets - 1
+        in_range = (bucket >= 0) & (bucket < num_buckets)
 
-            if histogram is None:
-                histogram = cycle_histogram.copy(deep=True)
-            else:
-                old_histogram = histogram.copy(deep=True)
-                histogram = old_histogram.join(cycle_histogram, how='outer')
+        counts = np.bincount(key_index[in_range] * num_buckets + bucket[in_range],
+                             minlength=len(keys) * num_buckets).reshape(len(keys), num_buckets)
+
+        seen = np.bincount(key_index, minlength=len(keys)) > 0
+        columns = sorted([key for key, key_seen in zip(keys, seen) if key_seen])
+
+        histogram = pd.DataFrame(counts.T, index=labels, columns=keys)[columns]
+        histogram.index.name = 'bucket'
 
         return histogram
 
+    def cycle_time_percentiles(self,
+                               cycle,
+                               types=None,
+                               from_date=None,
+                               to_date=None,
+                               percentiles=None,
+                               category=None):
+        """
+        Percentiles of the time taken to complete one or more cycles by the
+        work items finished between from_date and to_date, read from the
+        cycle time sketches
+        """
+
+        if percentiles is None:
+            percentiles = [50, 85, 95]
+
+        if isinstance(cycle, basestring):
+            cycles = [cycle]
+        else:
+            cycles = list(cycle)
+
+        from_week = None
+        if from_date is not None:
+            from_week = int(week_ending_monday(day_number(from_date)))
+
+        to_week = None
+        if to_date is not None:
+            to_week = int(week_ending_monday(day_number(to_date)))
+
+        categories = None
+        if category is not None:
+            categories = [category]
+
+        if types is None:
+            groupings = [(None, None)]
+        else:
+            groupings = [(type_grouping, self.types[type_grouping]) for type_grouping in types]
+
+        sketches = self.cycle_time_sketches()
+
+        rows = {}
+
+        for type_grouping, issue_types in groupings:
+            for c in cycles:
+
+                sketch = sketches.query(c, categories, issue_types, from_week, to_week)
+
+                if len(sketch) == 0:
+                    continue
+
+                key = c if type_grouping is None else "{0}-{1}".format(type_grouping, c)
+                rows[key] = sketch.quantiles(percentiles) + [len(sketch)]
+
+        if len(rows) == 0:
+            return None
+
+        df = pd.DataFrame.from_dict(rows, orient='index')
+        df.columns = ["{0}%".format(p) for p in percentiles] + ['count']
+        df = df.sort_index()
+        df.index.name = 'cycle'
+
+        return df
+
+    def done(self, from_date=None, to_date=None, types=None, sort='week-done'):
+        """
+        Every work item finished between from_date and to_date, with the
+        week it was done in and its cycle times, for control charts.
+
+        Work items are sorted by when they were done, or by a cycle time
+        if sort names a cycle.
+        """
+
+        finished = self._finished()
+
+        selected = finished >= 0
+
+        if from_date is not None:
+            selected &= finished >= day_number(from_date)
+
+        if to_date is not None:
+            selected &= finished <= day_number(to_date)
+
+        swimlanes = np.array([work_item.category for work_item in self.work_items], dtype=object)
+
+        if types is not None:
+
+            groupings = {}
+            for type_grouping in reversed(types):
+                for issue_type in self.types[type_grouping]:
+                    groupings[issue_type] = type_grouping
+
+            grouping = np.array([groupings.get(work_item.type) for work_item in self.work_items], dtype=object)
+
+            selected &= grouping != np.array(None)
+            swimlanes[selected] = ["{0}-{1}".format(swimlane, type_grouping)
+                                   for swimlane, type_grouping in zip(swimlanes[selected], grouping[selected])]
+
+        indices = np.flatnonzero(selected)
+
+        if len(indices) == 0:
+            return None
+
+        cycles = sorted(self.config.get('cycles') or {})
+
+        cycle_times = np.array([[(self.work_items[index].cycles or {}).get(c) for c in cycles] for index in indices],
+                               dtype=np.float64).reshape(len(indices), len(cycles))
+
+        days = finished[indices]
+
+        if sort in cycles:
+            order = np.lexsort((days, cycle_times[:, cycles.index(sort)]))
+        else:
+            order = np.argsort(days, kind='mergesort')
+
+        indices = indices[order]
+        days = days[order]
+
+        columns = {'swimlane': swimlanes[indices],
+                   'type': [self.work_items[index].type for index in indices],
+                   'title': [self.work_items[index].title for index in indices],
+                   'date-done': days.astype('datetime64[D]'),
+                   'week-done': week_starting_monday(days).astype('datetime64[D]')}
+
+        for c, cycle_time in zip(cycles, cycle_times[order].T):
+            columns[c] = cycle_time
+
+        df = pd.DataFrame(columns,
+                          index=pd.Index([self.work_items[index].id for index in indices], name='id'),
+                          columns=['swimlane', 'type', 'title', 'date-done', 'week-done'] + cycles)
+
+        return df
+
+    def flow_efficiency(self,
+                        active,
+                        wait,
+                        from_date=None,
+                        to_date=None,
+                        types=None,
+                        by='week',
+                        percentiles=None):
+        """
+        How much of the time work is in progress is it actually being
+        worked on?
+
+        For each work item finished between from_date and to_date, the
+        days it spent in the active states and waiting in the wait states
+        and its efficiency - the fraction of those days it was active.  By
+        'week' the work items finished each week are added up, along with
+        percentiles of their efficiencies.
+        """
+
+        if percentiles is None:
+            percentiles = [50, 85, 95]
+
+        finished = self._finished()
+        selected = finished >= 0
+
+        if from_date is not None:
+            selected &= finished >= day_number(from_date)
+
+        if to_date is not None:
+            selected &= finished <= day_number(to_date)
+
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+            selected &= np.array([work_item.type in issue_types for work_item in self.work_items], dtype=bool)
+
+        indices = np.flatnonzero(selected)
+
+        if len(indices) == 0:
+            return None
+
+        item, state, start, end = self._intervals(to_date)
+        days = end - start
+
+        states = self.transitions().states
+        is_active = np.in1d(state, [code for code, name in enumerate(states) if name in active])
+        is_waiting = np.in1d(state, [code for code, name in enumerate(states) if name in wait])
+
+        active_days = np.bincount(item[is_active], weights=days[is_active], minlength=len(self.work_items))[indices]
+        wait_days = np.bincount(item[is_waiting], weights=days[is_waiting], minlength=len(self.work_items))[indices]
+
+        total = active_days + wait_days
+        efficiency = np.where(total > 0, active_days / np.where(total > 0, total, 1), np.nan)
+
+        weeks = week_ending_monday(finished[indices]).astype('datetime64[D]')
+
+        if by == 'item':
+            return pd.DataFrame({'category': [self.work_items[index].category for index in indices],
+                                 'type': [self.work_items[index].type for index in indices],
+                                 'week': weeks,
+                                 'active days': active_days,
+                                 'wait days': wait_days,
+                                 'efficiency': efficiency},
+                                index=pd.Index([self.work_items[index].id for index in indices], name='id'),
+                                columns=['category', 'type', 'week', 'active days', 'wait days', 'efficiency'])
+
+        week_labels, week = np.unique(weeks, return_inverse=True)
+
+        df = pd.DataFrame({'items': np.bincount(week),
+                           'active days': np.bincount(week, weights=active_days),
+                           'wait days': np.bincount(week, weights=wait_days)},
+                          index=pd.DatetimeIndex(week_labels, name='week'),
+                          columns=['items', 'active days', 'wait days'])
+
+        df['efficiency'] = df['active days'] / (df['active days'] + df['wait days'])
+
+        # Nearest rank percentiles of the efficiencies each week, from one
+        # sort of every work item by week then efficiency
+
+        measured = ~np.isnan(efficiency)
+        order = np.lexsort((efficiency, ~measured, week))
+
+        counts = np.bincount(week, weights=measured).astype(np.int64)
+        starts = np.concatenate([[0], np.cumsum(np.bincount(week))[:-1]])
+
+        for p in percentiles:
+            rank = np.maximum(np.ceil(p / 100.0 * counts).astype(np.int64), 1)
+            value = efficiency[order][np.minimum(starts + rank - 1, len(order) - 1)]
+            df['{0}%'.format(p)] = np.where(counts > 0, value, np.nan)
+
+        return df
+
+    def time_in_state(self, from_date=None, to_date=None, types=None, summary=False, percentiles=None, field=None):
+        """
+        The days each work item has spent in each state up to to_date,
+        counting every visit to a state.  Work items finished before
+        from_date are left out.
+
+        With summary, percentiles of the days spent in each state by the
+        work items which spent any time in it, to show up bottlenecks.
+
+        Given a changelog field, e.g. Flagged, the days spent with each of
+        its values instead.
+        """
+
+        if percentiles is None:
+            percentiles = [50, 85, 95]
+
+        item, state, start, end = self._intervals(to_date, field)
+
+        states = self.transitions(field).states
+        num_states = len(states)
+
+        days = np.bincount(item * num_states + state,
+                           weights=end - start,
+                           minlength=len(self.work_items) * num_states).reshape(len(self.work_items), num_states)
+
+        selected = np.ones(len(self.work_items), dtype=bool)
+
+        if from_date is not None:
+            finished = self._finished()
+            selected &= (finished < 0) | (finished >= day_number(from_date))
+
+        if to_date is not None:
+            selected &= np.array([day_number(work_item.date_created) <= day_number(to_date)
+                                  for work_item in self.work_items], dtype=bool)
+
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+            selected &= np.array([work_item.type in issue_types for work_item in self.work_items], dtype=bool)
+
+        indices = np.flatnonzero(selected)
+
+        if len(indices) == 0:
+            return None
+
+        days = days[indices]
+
+        # Configured states in order, then any others we've come across
+
+        order = self.states if field is None else []
+
+        columns = [code for code, name in enumerate(states) if name is not None and days[:, code].any()]
+        columns.sort(key=lambda code: (order.index(states[code]) if states[code] in order else len(order), code))
+
+        days = days[:, columns]
+        names = [states[code] for code in columns]
+
+        if not summary:
+            return pd.DataFrame(days,
+                                index=pd.Index([self.work_items[index].id for index in indices], name='id'),
+                                columns=names)
+
+        # Nearest rank percentiles of each column's non-zero days, which
+        # sorting each column puts at the bottom
+
+        ordered = np.sort(days, axis=0)
+        visited = (days > 0).sum(axis=0)
+        skipped = len(days) - visited
+
+        df = pd.DataFrame({'items': visited, 'total days': days.sum(axis=0)},
+                          index=pd.Index(names, name='state'),
+                          columns=['items', 'total days'])
+
+        for p in percentiles:
+            rank = np.maximum(np.ceil(p / 100.0 * visited).astype(np.int64), 1)
+            df['{0}%'.format(p)] = ordered[np.minimum(skipped + rank - 1, len(days) - 1), np.arange(len(names))]
+
+        return df
+
+    def state_on(self, day, field=None):
+        """
+        The state each work item created by day was in on day, or the
+        value a changelog field had.  None where we don't know it, as for
+        a field which has never changed.
+        """
+
+        item, state = self._on(day, field)
+
+        states = self.transitions(field).states
+        values = np.empty(len(self.work_items), dtype=object)
+        values[item] = [states[code] for code in state]
+
+        created = np.array([day_number(work_item.date_created) <= day_number(day) for work_item in self.work_items],
+                           dtype=bool)
+        indices = np.flatnonzero(created)
+
+        return pd.Series(values[indices],
+                         index=pd.Index([self.work_items[index].id for index in indices], name='id'))
+
+    def snapshot(self, dates, types=None, field=None, detail=False):
+        """
+        What was in each state on each of dates - how many work items, or
+        with detail every work item along with its state.  Given a
+        changelog field, its values instead of states.
+        """
+
+        states = self.transitions(field).states
+
+        selected = np.ones(len(self.work_items), dtype=bool)
+
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+            selected = np.array([work_item.type in issue_types for work_item in self.work_items], dtype=bool)
+
+        found = []
+
+        for day in dates:
+            item, state = self._on(day, field)
+            keep = selected[item]
+            found.append((day, item[keep], state[keep]))
+
+        if detail:
+
+            rows = [(self.work_items[index].id, day, self.work_items[index].category, self.work_items[index].type,
+                     states[code])
+                    for day, items, codes in found
+                    for index, code in zip(items, codes)]
+
+            if len(rows) == 0:
+                return None
+
+            ids, days, categories, issue_types, values = zip(*rows)
+
+            return pd.DataFrame({'date': pd.to_datetime(list(days)),
+                                 'category': categories,
+                                 'type': issue_types,
+                                 'state': values},
+                                index=pd.Index(ids, name='id'),
+                                columns=['date', 'category', 'type', 'state'])
+
+        counts = np.array([np.bincount(codes, minlength=len(states)) for day, items, codes in found],
+                          dtype=np.int64).reshape(len(found), len(states))
+
+        # Configured states in order, then any others we've come across
+
+        order = self.states if field is None else []
+
+        columns = [code for code, name in enumerate(states) if name is not None and counts[:, code].any()]
+        columns.sort(key=lambda code: (order.index(states[code]) if states[code] in order else len(order), code))
+
+        return pd.DataFrame(counts[:, columns],
+                            index=pd.DatetimeIndex(list(dates), name='date'),
+                            columns=[states[code] for code in columns])
+
+    def _on(self, day, field=None):
+        """
+        The work items and state codes of the intervals covering day,
+        from an interval index built once per state or field
+        """
+
+        if field not in self._interval_indexes:
+            item, state, start, end = self._intervals(date.today() + timedelta(days=1), field)
+            self._interval_indexes[field] = (item, state, IntervalIndex(start, end))
+
+        item, state, index = self._interval_indexes[field]
+        found = index.at(day_number(day))
+
+        return item[found], state[found]
+
+    def _intervals(self, as_of=None, field=None):
+        """
+        The runs of days each work item has spent in each state up to
+        as_of, as arrays of work item, state code, first day and the day
+        after the last.  Given a changelog field, the runs of each of its
+        values instead, for work items whose field has changed.
+        """
+
+        if as_of is None:
+            as_of = date.today()
+
+        transitions = self.transitions(field)
+        codes = dict((state, code) for code, state in enumerate(transitions.states))
+
+        created = np.array([day_number(work_item.date_created) for work_item in self.work_items], dtype=np.int64)
+
+        if field is None:
+            current = np.array([codes.get(work_item.state, -1) for work_item in self.work_items], dtype=np.int64)
+        else:
+            # We only know a field's value from its changes
+            current = np.empty(len(self.work_items), dtype=np.int64)
+            current.fill(-1)
+
+        item, state, start, end = state_intervals(transitions, created, current, day_number(as_of))
+
+        known = state >= 0
+
+        return item[known], state[known], start[known], end[known]
+
+    def _finished(self):
+        """
+        The day each work item was last moved into a state which counts
+        towards throughput, or -1 for work items which aren't done
+        """
+
+        transitions = self.transitions()
+
+        done = [code for code, state in enumerate(transitions.states) if state in self.counts_towards_throughput]
+        into_done = np.in1d(transitions.to_state, done)
+
+        finished = np.empty(len(transitions.ids), dtype=np.int64)
+        finished.fill(-1)
+        np.maximum.at(finished, transitions.item[into_done], transitions.day[into_done])
+
+        not_done = np.array([work_item.state not in self.counts_towards_throughput for work_item in self.work_items],
+                            dtype=bool)
+        finished[not_done] = -1
+
+        return finished
+
+    def cycle_time_sketches(self):
+        """
+        A mergeable sketch of cycle times for each category, issue type,
+        cycle and the week in which work items were finished
+        """
+
+        if self._sketches is not None:
+            return self._sketches
+
+        finished = self._finished()
+        weeks = week_ending_monday(finished)
+
+        sketches = SketchStore()
+
+        for index, work_item in enumerate(self.work_items):
+
+            if finished[index] < 0:
+                continue
+
+            for cycle, days in (work_item.cycles or {}).iteritems():
+                if days is not None:
+                    sketches.add(work_item.category, work_item.type, cycle, int(weeks[index]), days)
+
+        self._sketches = sketches
+
+        return sketches
+
+    def aging(self, cycle, types=None, as_of=None):
+        """
+        How old is the work that is still in progress?
+
+        For each work item which isn't done, the days it has spent in its
+        current state and since it started each cycle, counting the day it
+        started as cycle times do, and the percentage of finished work
+        items which took no longer than that to complete the cycle.
+        """
+
+        if as_of is None:
+            as_of = date.today()
+
+        if isinstance(cycle, basestring):
+            cycles = [cycle]
+        else:
+            cycles = list(cycle)
+
+        transitions = self.transitions()
+        codes = dict((state, code) for code, state in enumerate(transitions.states))
+
+        issue_types = None
+        if types is not None:
+            issue_types = [issue_type for type_grouping in types for issue_type in self.types[type_grouping]]
+
+        in_progress = np.array([work_item.state not in self.counts_towards_throughput and
+                                (issue_types is None or work_item.type in issue_types)
+                                for work_item in self.work_items], dtype=bool)
+
+        if not in_progress.any():
+            return None
+
+        today = day_number(as_of)
+        seen = transitions.window(to_date=as_of)
+        item = transitions.item[seen]
+        day = transitions.day[seen]
+        to_state = transitions.to_state[seen]
+
+        # The last time each work item entered the state it is in now
+
+        current = np.array([codes.get(work_item.state, -1) for work_item in self.work_items], dtype=np.int64)
+        entered = np.array([day_number(work_item.date_created) for work_item in self.work_items], dtype=np.int64)
+
+        into_current = to_state == current[item]
+        np.maximum.at(entered, item[into_current], day[into_current])
+
+        columns = {'category': [work_item.category for work_item in self.work_items],
+                   'type': [work_item.type for work_item in self.work_items],
+                   'state': [work_item.state for work_item in self.work_items],
+                   'days in state': today - entered + 1}
+
+        names = ['category', 'type', 'state', 'days in state']
+
+        for c in cycles:
+
+            started = np.empty(len(self.work_items), dtype=np.int64)
+            started.fill(today + 1)
+
+            starts, offset = self._cycle_starts(c, codes)
+            into_start = np.in1d(to_state, starts)
+            np.minimum.at(started, item[into_start], day[into_start] + offset)
+
+            age = (today - started + 1).astype(np.float64)
+            age[age <= 0] = np.nan
+
+            finished = self.cycle_time_sketches().query(c, issue_types=issue_types)
+
+            columns['{0} age'.format(c)] = age
+            columns['{0} percentile'.format(c)] = finished.ranks(age)
+            names.extend(['{0} age'.format(c), '{0} percentile'.format(c)])
+
+        ids = [work_item.id for work_item in self.work_items]
+        df = pd.DataFrame(columns, index=ids, columns=names)[in_progress]
+        df.index.name = 'id'
+
+        return df.sort_values('{0} age'.format(cycles[0]), ascending=False)
+
+    def _cycle_starts(self, cycle, codes):
+        """
+        The codes of the states which start a cycle, and the days after
+        entering one of them that the cycle starts
+        """
+
+        try:
+            config = self.config['cycles'][cycle]
+        except KeyError:
+            raise exceptions.MissingConfigItem(cycle, "Missing Cycle:{0}".format(cycle))
+
+        if 'include' in config:
+            starts, offset = config['include'], 0
+        elif 'exclude' in config:
+            starts, offset = [state for state in codes if state not in config['exclude']], 0
+        elif 'after' in config:
+            starts, offset = [config['after']], 1
+        else:
+            starts, offset = [config.get('start', START_STATE)], 0
+
+        return [codes[state] for state in starts if state in codes], offset
+
     def demand(self,
                from_date,
                to_date,
@@ -301,50 +1017,37 @@ class Metrics(object):
         Return the number of issues created each week - i.e. the demand on the system
         """
 
-        if self.work_items is None:
-            self.work_items = self.source.work_items()
+        cube = self.cube()
 
-        details = []
+        days = cube.days()
+        created = cube.creations(days)
 
-        for work_item in self.work_items:
-            detail = work_item.detail()
-            detail['count'] = 1  # Need to figure out where to put this
+        weeks = [day_date(week).strftime('%Y-%m-%d') for week in week_starting_monday(days)]
 
-            # resolution_date_str = f.resolutiondate
-
-            # if resolution_date_str is not None:
-            #     resolution_date = datetime.strptime(resolution_date_str[:10],
-            #                                         '%Y-%m-%d')
-
-            #     week = week_start_date(resolution_date.isocalendar()[0],
-            #                            resolution_date.isocalendar()[1]).strftime('%Y-%m-%d')
-
-            # else:
-
-            #     week = None
+        details = []
 
-            detail['week_created'] = week_start_date(detail['date_created'].isocalendar()[0],
-                                                     detail['date_created'].isocalendar()[1]).strftime('%Y-%m-%d')
+        for cell, (cell_category, cell_type) in enumerate(cube.cells):
 
             include = True
 
-            swimlane = work_item.category
+            swimlane = cell_category
 
             if types is not None and self.types is not None:
                 include = False
                 for type_grouping in types:
-                    if work_item.type in self.types[type_grouping]:
+                    if cell_type in self.types[type_grouping]:
                         swimlane = swimlane + '-' + type_grouping
                         include = True
 
-            detail['swimlane'] = swimlane
-
             if include:
-                details.append(detail)
+                for row in np.flatnonzero(created[:, cell]):
+                    details.append({'week_created': weeks[row],
+                                    'swimlane':     swimlane,
+                                    'count':        int(created[row, cell])})
 
         df = pd.DataFrame(details)
 
-        table = pd.pivot_table(df, index=['week_created'], columns=['swimlane'], values='count', aggfunc=np.count_nonzero)
+        table = pd.pivot_table(df, index=['week_created'], columns=['swimlane'], values='count', aggfunc=np.sum)
 
         reindexed = table.reindex(index=fill_date_index_blanks(table.index), fill_value=np.int64(0))
         reindexed.index.name = "week"
@@ -352,29 +1055,109 @@ class Metrics(object):
 
     def arrival_rate(self,
                      from_date,
-                     to_date):
+                     to_date,
+                     field=None):
         """
         So that we can get an idea of the flow of work that has not been completed and so does not have a resolution date
         and so does not count towards throughput, what is the rate at which that work arrived at states further up the
-        value chain?
+        value chain?  Given a changelog field, the rate at which work arrived at each of its values.
+        """
+
+        if field is not None:
+            return weekly_arrivals(self.transitions(field), from_date, to_date)
+
+        cube = self.cube()
+
+        days = cube.days(from_date, to_date)
+        arrivals = cube.arrivals(days).sum(axis=1)
+
+        rows, codes = np.nonzero(arrivals)
+
+        return weekly_counts(days[rows], codes, cube.states, arrivals[rows, codes])
+
+    def cube(self):
+        """
+        The counts of work items by day, category, issue type and state
+        that throughput, demand, the CFD and arrival rates are read from,
+        kept in the config's cube directory if it has one
         """
 
         if self.work_items is None:
             self.work_items = self.source.work_items()
 
-        arrivals_count = {}
+        if self._cube is None:
 
-        for work_item in self.work_items:
-            try:
-                arrivals_count = arrivals(work_item.history, arrivals_count)
-            except AttributeError as e:
-                print e
+            directory = self.config.get('cube')
+
+            previous = self._last_cube
+            if previous is None and directory is not None:
+                previous = Cube.load(directory)
+
+            with instrument.span('cube') as build:
+                self._cube = Cube(self.work_items, self.transitions(), previous)
+                build.count('work items', len(self.work_items))
+
+            if directory is not None:
+                self._cube.save(directory)
+
+        return self._cube
+
+    def matrix(self):
+        """
+        The days x work items matrix of state codes, in a file mapped into
+        memory which worker processes can share.  Kept in the config's
+        matrix directory if it has one, otherwise a temporary one.
+        """
+
+        if self._matrix is None:
+
+            directory = self.config.get('matrix')
 
-        df = pd.DataFrame.from_dict(arrivals_count, orient='index')
-        df.index = pd.to_datetime(df.index)
-        wf = df.resample('W-MON', how='sum')
+            if directory is None:
+                if self._matrix_directory is None:
+                    self._matrix_directory = _temporary_directory()
+                directory = self._matrix_directory
 
-        return wf
+            cube = self.cube()
+
+            with instrument.span('matrix') as build:
+                self._matrix = StateMatrix.build(cube, directory, self.memory_budget())
+                build.count('days', len(self._matrix.codes))
+
+        return self._matrix
+
+    def memory_budget(self):
+        """
+        The bytes of working memory the matrix is built and read within,
+        from the config's memory_budget in megabytes, or None for the
+        default
+        """
+
+        megabytes = self.config.get('memory_budget')
+
+        if megabytes is None:
+            return None
+
+        return int(megabytes * (1 << 20))
+
+    def transitions(self, field=None):
+        """
+        The state transitions of all work items as flat integer coded
+        arrays, or the changes to a changelog field such as Flagged
+        """
+
+        if self.work_items is None:
+            self.work_items = self.source.work_items()
+
+        if field is not None:
+            if field not in self._field_transitions:
+                self._field_transitions[field] = Transitions.from_work_items(self.work_items, field=field)
+            return self._field_transitions[field]
+
+        if self._transitions is None:
+            self._transitions = Transitions.from_work_items(self.work_items, self.states)
+
+        return self._transitions
 
     def save_work_items(self, filename=None):
 
@@ -387,11 +1170,50 @@ class Metrics(object):
         if self.work_items is None:
             self.work_items = self.source.work_items()
 
-        output = []
+        with instrument.span('save') as save:
+
+            output = []
+
+            for item in self.work_items:
+                # This is so wrong.  We are decoding then encoding then decoding again...
+                output.append(json.loads(item.to_JSON()))
+
+            with open(filename, 'w') as outfile:
+                json.dump(output, outfile, indent=4, sort_keys=True)
+
+            save.count('work items', len(output))
+            save.add_bytes(os.path.getsize(filename))
+
+
+def _source(config):
+    """
+    The wrapper for config's source
+    """
+
+    # Only import the backend we need - each brings in its own client library
+
+    if config['source']['type'] == 'fogbugz':
+        from jlf_stats.fogbugz_wrapper import FogbugzWrapper
+        return FogbugzWrapper(config)
+
+    elif config['source']['type'] == 'jira':
+        from jlf_stats.jira_wrapper import JiraWrapper
+
+        m = re.match("^ENV\(([^\']+)\)", config['source']['authentication']['password'])
+        if m is not None:
+            config['source']['authentication']['password'] = os.environ.get(m.group(1), 'undefined')
+
+        return JiraWrapper(config)
+
+    return None
+
+
+def _temporary_directory():
+    """
+    A directory which is removed when we exit
+    """
 
-        for item in self.work_items:
-            # This is so wrong.  We are decoding then encoding then decoding again...
-            output.append(json.loads(item.to_JSON()))
+    directory = tempfile.mkdtemp(prefix='jlf-')
+    atexit.register(shutil.rmtree, directory, True)
 
-        with open(filename, 'w') as outfile:
-            json.dump(output, outfile, indent=4, sort_keys=True)
+    return directory
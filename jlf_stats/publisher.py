@@ -5,9 +5,14 @@ Takes a report config detailing which reports to publish and
 a Jira Wrapper which provides the data for the reports
 """
 
+import multiprocessing
 import os
+from datetime import datetime
 import pandas as pd
 
+import instrument
+import forecast
+
 from xlsxwriter.utility import xl_rowcol_to_cell
 
 _state_default_colours = ['#8dd3c7',
@@ -34,151 +39,322 @@ def publish(config, jira, from_date, to_date):
                                       excel_basename + '.xlsx')
         writer = pd.ExcelWriter(excel_filename, engine='xlsxwriter')
 
-    for report in config['reports']:
+    reports = config['reports']
+    streamed = [_streamed(config, report, writer) for report in reports]
+    workers = config.get('workers', 1)
 
-        data = None
+    results = None
 
-        types = None
+    if workers > 1 and len(reports) > 1:
+        indexes = [index for index in range(len(reports)) if not streamed[index]]
+        with instrument.span('workers') as span:
+            results = _in_workers(config, jira, from_date, to_date, workers, indexes)
+            span.count('reports', len(indexes))
 
-        try:
-            types = report['types']
-            if types == 'foreach':
-                types = []
-                for type in config['types']:
-                    types.append(type)
-        except KeyError:
-            # Not all reports require types
-            pass
-
-        if report['metric'] == 'throughput':
-
-            data = jira.throughput(from_date,
-                                   to_date,
-                                   cumulative=False,
-                                   types=types)
-
-        if report['metric'] == 'cumulative-throughput':
-            data = jira.throughput(from_date, to_date, cumulative=True, types=types)
-
-        if report['metric'] == 'cfd':
-            data = jira.cfd(from_date, to_date, types=types)
-
-        if report['metric'] == 'demand':
-            types = None
-            if 'types' in report:
-                types = report['types']
-            data = jira.demand(from_date, to_date, types)
-
-        if report['metric'] == 'detail':
-            # It seems inconsistent that 'detail' does not allow you to specify a date range.
-            # If it did then all the metric functions could have the same interface
-            # so making this code DRYer and more succinct
-            if 'fields' in report:
-                fields = report['fields']
+    for index, report in enumerate(reports):
+
+        with instrument.span('report:{0}'.format(report['metric'])) as span:
+            if streamed[index]:
+                span.count('rows', _stream_history(config, report, jira, writer, from_date, to_date))
+                continue
+            if results is None:
+                data = _publish_report(config, report, jira, writer, from_date, to_date)
             else:
-                fields = None
-            data = jira.details(fields=fields)
-
-        if report['metric'] == 'cycle-time':
-            types = None
-            if 'types' in report:
-                types = report['types']
-
-            buckets = None
-            if 'buckets' in report:
-                buckets = report['buckets']
-            data = jira.cycle_time_histogram(report['cycles'][0], types=types, buckets=buckets)
-
-        if report['metric'] == 'arrival-rate':
-            data = jira.arrival_rate(from_date, to_date)
-
-        if report['metric'] == 'history':
-            data = jira.history(from_date, to_date)
-
-        if data is not None:
-            if isinstance(writer, pd.ExcelWriter):
-
-                sheet_name = []
-                try:
-                    if isinstance(report['types'], list):
-                        sheet_name.extend(report['types'])
-
-                    if isinstance(report['cycles'], list):
-                        sheet_name.extend(report['cycles'])
-
-                except KeyError:
-                    pass
-
-                sheet_name.append(report['metric'])
-
-                worksheet_name = worksheet_title('-'.join(sheet_name))
-
-                data.to_excel(writer, worksheet_name)
-
-                if 'description' in report:
-
-                    workbook = writer.book
-                    sheets = [sheet for sheet in workbook.worksheets() if sheet.name == worksheet_name]
-                    sheets[0].write(0, len(data.columns) + 2, report['description'])
-
-                if 'graph' in report:
-                    graph_type = 'column'
-                    if 'type' in report['graph']:
-                        graph_type = report['graph']['type']
-                    workbook = writer.book
-                    chart = workbook.add_chart({'type': graph_type})
-
-                    chart.set_title({'name': report['metric'].title()})
-                    column_idx = 1
-                    for index, value in data.iteritems():
-                        chart.add_series({'values': '={worksheet_name}!{from_cell}:{to_cell}'.format(worksheet_name=worksheet_name,
-                                                                                                     from_cell=xl_rowcol_to_cell(2, column_idx),
-                                                                                                     to_cell=xl_rowcol_to_cell(len(value) + 1, column_idx)),
-                                          'categories': '={worksheet_name}!{from_cell}:{to_cell}'.format(worksheet_name=worksheet_name,
-                                                                                                         from_cell=xl_rowcol_to_cell(2, 0),
-                                                                                                         to_cell=xl_rowcol_to_cell(len(value) + 1, 0)),
-                                          'name': series_name(index)})
-                        column_idx += 1
-                    sheets = [sheet for sheet in workbook.worksheets() if sheet.name == worksheet_name]
-
-                    chart.set_x_axis({'name': 'Week',
-                                      'text_axis': True,
-                                      'num_format': 'dd/mm/yyyy'})
-
-                    chart.set_size({'width': 720, 'height': 576})
-
-                    sheets[0].insert_chart(xl_rowcol_to_cell(1, column_idx + 1), chart)
-
-                    # Make date column visible
-                    sheets[0].set_column(0, 0, 20)
-
-                if report['metric'] == 'cfd':
-                    if 'format' in report:
-                        formats = report['format']
-                    else:
-                        formats = format_states(config['states'])
-                    workbook = writer.book
-                    sheets = [sheet for sheet in workbook.worksheets() if sheet.name[-3:] == 'cfd']
-                    # Do the colouring in
-
-                    for sheet in sheets:
-                        colour_cfd(workbook, sheet, data, formats)
-
-                ### WARNING CUT AND PASTE ALERT!
-
-                if report['metric'] == 'history':
-                    if 'format' in report:
-                        formats = report['format']
-                    else:
-                        formats = format_states(config['states'])
-                    workbook = writer.book
-                    sheets = [sheet for sheet in workbook.worksheets() if sheet.name[-7:] == 'history']
-                    # Do the colouring in
-                    for sheet in sheets:
-                        colour_cfd(workbook, sheet, data, formats)
+                data = _write_report(config, report, results[index], writer)
+            if data is not None:
+                span.count('rows', len(data.index))
 
     if isinstance(writer, pd.ExcelWriter):
-        writer.save()
+        with instrument.span('write') as span:
+            writer.save()
+            span.add_bytes(os.path.getsize(excel_filename))
+
+
+# What the worker processes work from, set before they are forked so that
+# each inherits it rather than having it pickled and sent over
+
+_shared = {}
+
+
+def _in_workers(config, jira, from_date, to_date, workers, indexes):
+    """
+    The data for each of the reports at indexes, worked out by a pool of
+    worker processes
+    """
+
+    # Built before forking, so the workers share them - the matrix is a
+    # file mapped into memory, which they all read without a copy, and
+    # only the history report needs it
+
+    jira.transitions()
+    jira.cube()
+
+    if any([config['reports'][index]['metric'] == 'history' for index in indexes]):
+        jira.matrix()
+
+    _shared['args'] = (config, jira, from_date, to_date)
+
+    pool = multiprocessing.Pool(processes=workers)
+
+    try:
+        return dict(zip(indexes, pool.map(_report_in_worker, indexes)))
+    finally:
+        pool.close()
+        pool.join()
+        _shared.clear()
+
+
+def _report_in_worker(index):
+
+    config, jira, from_date, to_date = _shared['args']
+
+    return _report_data(config, config['reports'][index], jira, from_date, to_date)
+
+
+def _publish_report(config, report, jira, writer, from_date, to_date):
+    """
+    Get the data for a single report and add it to the writer
+    """
+
+    return _write_report(config, report, _report_data(config, report, jira, from_date, to_date), writer)
+
+
+def _report_data(config, report, jira, from_date, to_date):
+    """
+    Get the data for a single report
+    """
+
+    data = None
+
+    types = None
+
+    # Resolved once here for every metric which takes types
+
+    try:
+        types = report['types']
+        if types == 'foreach':
+            types = []
+            for type in config['types']:
+                types.append(type)
+    except KeyError:
+        # Not all reports require types
+        pass
+
+    if report['metric'] == 'throughput':
+
+        data = jira.throughput(from_date,
+                               to_date,
+                               cumulative=False,
+                               types=types)
+
+    if report['metric'] == 'cumulative-throughput':
+        data = jira.throughput(from_date, to_date, cumulative=True, types=types)
+
+    if report['metric'] == 'cfd':
+        data = jira.cfd(from_date, to_date, types=types)
+
+    if report['metric'] == 'demand':
+        data = jira.demand(from_date, to_date, types)
+
+    if report['metric'] == 'detail':
+        # It seems inconsistent that 'detail' does not allow you to specify a date range.
+        # If it did then all the metric functions could have the same interface
+        # so making this code DRYer and more succinct
+        if 'fields' in report:
+            fields = report['fields']
+        else:
+            fields = None
+        data = jira.details(fields=fields)
+
+    if report['metric'] == 'done':
+        data = jira.done(from_date, to_date, types=types, sort=report.get('sort', 'week-done'))
+
+    if report['metric'] == 'cycle-time':
+        buckets = None
+        if 'buckets' in report:
+            buckets = report['buckets']
+        data = jira.cycle_time_histogram(report['cycles'], types=types, buckets=buckets)
+
+    if report['metric'] == 'cycle-time-percentiles':
+        data = jira.cycle_time_percentiles(report['cycles'],
+                                           types=types,
+                                           from_date=from_date,
+                                           to_date=to_date,
+                                           percentiles=report.get('percentiles'))
+
+    if report['metric'] == 'aging':
+        data = jira.aging(report['cycles'], types=types, as_of=to_date)
+
+    if report['metric'] == 'flow-efficiency':
+        data = jira.flow_efficiency(report['active'],
+                                    report['wait'],
+                                    from_date=from_date,
+                                    to_date=to_date,
+                                    types=types,
+                                    by=report.get('by', 'week'),
+                                    percentiles=report.get('percentiles'))
+
+    if report['metric'] == 'time-in-state':
+        data = jira.time_in_state(from_date=from_date,
+                                  to_date=to_date,
+                                  types=types,
+                                  summary=report.get('summary', False),
+                                  percentiles=report.get('percentiles'),
+                                  field=report.get('field'))
+
+    if report['metric'] == 'snapshot':
+        dates = [to_date]
+        if 'dates' in report:
+            dates = [datetime.strptime(day, '%Y-%m-%d').date() for day in report['dates']]
+        data = jira.snapshot(dates, types=types, field=report.get('field'), detail=report.get('detail', False))
+
+    if report['metric'] == 'arrival-rate':
+        data = jira.arrival_rate(from_date, to_date, field=report.get('field'))
+
+    if report['metric'] == 'forecast':
+        until_date = None
+        if 'until' in report:
+            until_date = datetime.strptime(report['until'], '%Y-%m-%d').date()
+        data = jira.forecast(from_date,
+                             to_date,
+                             items=report.get('items'),
+                             until_date=until_date,
+                             types=types,
+                             confidence=report.get('confidence'),
+                             trials=report.get('trials', forecast.DEFAULT_TRIALS))
+
+    if report['metric'] == 'history':
+        data = jira.history(from_date, to_date)
+
+    return data
+
+
+def _write_report(config, report, data, writer):
+    """
+    Add the data for a single report to the writer
+    """
+
+    if data is not None:
+        if isinstance(writer, pd.ExcelWriter):
+
+            worksheet_name = report_worksheet_name(report)
+
+            data.to_excel(writer, worksheet_name)
+
+            if 'description' in report:
+
+                workbook = writer.book
+                sheets = [sheet for sheet in workbook.worksheets() if sheet.name == worksheet_name]
+                sheets[0].write(0, len(data.columns) + 2, report['description'])
+
+            if 'graph' in report:
+                graph_type = 'column'
+                if 'type' in report['graph']:
+                    graph_type = report['graph']['type']
+                workbook = writer.book
+                chart = workbook.add_chart({'type': graph_type})
+
+                chart.set_title({'name': report['metric'].title()})
+                column_idx = 1
+                for index, value in data.iteritems():
+                    chart.add_series({'values': '={worksheet_name}!{from_cell}:{to_cell}'.format(worksheet_name=worksheet_name,
+                                                                                                 from_cell=xl_rowcol_to_cell(2, column_idx),
+                                                                                                 to_cell=xl_rowcol_to_cell(len(value) + 1, column_idx)),
+                                      'categories': '={worksheet_name}!{from_cell}:{to_cell}'.format(worksheet_name=worksheet_name,
+                                                                                                     from_cell=xl_rowcol_to_cell(2, 0),
+                                                                                                     to_cell=xl_rowcol_to_cell(len(value) + 1, 0)),
+                                      'name': series_name(index)})
+                    column_idx += 1
+                sheets = [sheet for sheet in workbook.worksheets() if sheet.name == worksheet_name]
+
+                chart.set_x_axis({'name': 'Week',
+                                  'text_axis': True,
+                                  'num_format': 'dd/mm/yyyy'})
+
+                chart.set_size({'width': 720, 'height': 576})
+
+                sheets[0].insert_chart(xl_rowcol_to_cell(1, column_idx + 1), chart)
+
+                # Make date column visible
+                sheets[0].set_column(0, 0, 20)
+
+            if report['metric'] == 'cfd':
+                if 'format' in report:
+                    formats = report['format']
+                else:
+                    formats = format_states(config['states'])
+                workbook = writer.book
+                sheets = [sheet for sheet in workbook.worksheets() if sheet.name[-3:] == 'cfd']
+                # Do the colouring in
+
+                for sheet in sheets:
+                    colour_cfd(workbook, sheet, data, formats)
+
+            ### WARNING CUT AND PASTE ALERT!
+
+            if report['metric'] == 'history':
+                if 'format' in report:
+                    formats = report['format']
+                else:
+                    formats = format_states(config['states'])
+                workbook = writer.book
+                sheets = [sheet for sheet in workbook.worksheets() if sheet.name[-7:] == 'history']
+                # Do the colouring in
+                for sheet in sheets:
+                    colour_cfd(workbook, sheet, data, formats)
+
+    return data
+
+
+def _streamed(config, report, writer):
+    """
+    Whether to write a report a chunk at a time, to keep within the memory
+    budget, rather than all at once
+    """
+
+    return (report['metric'] == 'history' and
+            'memory_budget' in config and
+            'graph' not in report and
+            isinstance(writer, pd.ExcelWriter))
+
+
+def _stream_history(config, report, jira, writer, from_date, to_date):
+    """
+    Add the history report to the writer as many days at a time as fit in
+    the memory budget, so it is never all in memory at once.  Returns how
+    many rows were written.
+    """
+
+    worksheet_name = report_worksheet_name(report)
+
+    if 'format' in report:
+        formats = report['format']
+    else:
+        formats = format_states(config['states'])
+
+    workbook = writer.book
+    rows = 0
+
+    for data in jira.history_chunks(from_date, to_date):
+
+        # The header goes above the first chunk, and the rest follow on
+        # below it
+
+        if rows == 0:
+            data.to_excel(writer, worksheet_name)
+            if 'description' in report:
+                writer.sheets[worksheet_name].write(0, len(data.columns) + 2, report['description'])
+        else:
+            data.to_excel(writer, worksheet_name, startrow=rows + 1, header=False)
+
+        colour_cfd(workbook, writer.sheets[worksheet_name], data, formats, first_row=rows)
+
+        rows += len(data.index)
+
+    if rows == 0:
+        _write_report(config, report, jira.history(from_date, to_date), writer)
+
+    return rows
 
 
 def format_states(states):
@@ -197,7 +373,7 @@ def format_states(states):
     return formats
 
 
-def colour_cfd(workbook, worksheet, data, formats):
+def colour_cfd(workbook, worksheet, data, formats, first_row=0):
 
     workbook_formats = {}
 
@@ -212,7 +388,7 @@ def colour_cfd(workbook, worksheet, data, formats):
                     new_format.set_bg_color(color)
                     workbook_formats[color] = new_format
 
-                cell_ref = xl_rowcol_to_cell(i+1, j+1)
+                cell_ref = xl_rowcol_to_cell(first_row+i+1, j+1)
                 worksheet.write(cell_ref, cell, workbook_formats[color])
             except KeyError:
                 pass
@@ -225,6 +401,28 @@ def series_name(swimlane):
     return name
 
 
+def report_worksheet_name(report):
+    """
+    The name of the worksheet for a report, from its types, cycles and
+    metric
+    """
+
+    sheet_name = []
+    try:
+        if isinstance(report['types'], list):
+            sheet_name.extend(report['types'])
+
+        if isinstance(report['cycles'], list):
+            sheet_name.extend(report['cycles'])
+
+    except KeyError:
+        pass
+
+    sheet_name.append(report['metric'])
+
+    return worksheet_title('-'.join(sheet_name))
+
+
 def worksheet_title(full_title):
     """
     Shorten the title if it is not going to fit on the worksheet
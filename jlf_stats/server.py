@@ -0,0 +1,381 @@
+"""
+Serve metrics over HTTP.
+
+Keeps one Metrics instance warm, refreshing its work items in the
+background, and serves each metric as JSON so that ad-hoc views don't
+have to wait for every issue to be fetched again:
+
+    GET /throughput?from_date=2013-01-01&to_date=2013-03-01&types=failure,value
+    GET /cfd?weeks=12
+    GET /demand
+    GET /cycle_time_histogram?cycle=develop,deliver&buckets=0,5,10,max
+    GET /cycle_time_percentiles?cycle=deliver&weeks=12&percentiles=50,85,95
+    GET /aging?cycle=deliver&types=value
+    GET /snapshot?dates=2015-01-05,2015-02-02&detail=true
+    GET /arrival_rate?field=Flagged
+    GET /forecast?items=40&types=value
+    GET /details?fields=id,type,category
+    GET /status
+
+Dates default to the last 'weeks' weeks (6 unless given) up to today.
+Requests are answered side by side and their results are cached until
+the next refresh.
+"""
+
+import copy
+import json
+import sys
+import threading
+import traceback
+from datetime import date, datetime, timedelta
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+DEFAULT_WEEKS = 6
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _date(params, name, default):
+
+    if name not in params:
+        return default
+
+    try:
+        return datetime.strptime(params[name], '%Y-%m-%d').date()
+    except ValueError:
+        raise BadRequest("{0} should be YYYY-MM-DD".format(name))
+
+
+def _list(params, name):
+
+    if name not in params:
+        return None
+
+    return params[name].split(',')
+
+
+def _window(params):
+
+    try:
+        weeks = int(params.get('weeks', DEFAULT_WEEKS))
+    except ValueError:
+        raise BadRequest("weeks should be a number")
+
+    to_date = _date(params, 'to_date', date.today())
+    from_date = _date(params, 'from_date', to_date - timedelta(weeks=weeks))
+
+    return from_date, to_date
+
+
+def _buckets(params):
+
+    buckets = _list(params, 'buckets')
+
+    if buckets is None:
+        return None
+
+    try:
+        return [edge if edge == 'max' else int(edge) for edge in buckets]
+    except ValueError:
+        raise BadRequest("buckets should be numbers or 'max'")
+
+
+def _throughput(metrics, params):
+
+    from_date, to_date = _window(params)
+    return metrics.throughput(from_date,
+                              to_date,
+                              cumulative=params.get('cumulative', 'true') == 'true',
+                              category=params.get('category'),
+                              types=_list(params, 'types'))
+
+
+def _cfd(metrics, params):
+
+    from_date, to_date = _window(params)
+    return metrics.cfd(from_date, to_date, types=_list(params, 'types'))
+
+
+def _demand(metrics, params):
+
+    from_date, to_date = _window(params)
+    return metrics.demand(from_date, to_date, types=_list(params, 'types'))
+
+
+def _cycle_time_histogram(metrics, params):
+
+    if 'cycle' not in params:
+        raise BadRequest("cycle is required")
+
+    return metrics.cycle_time_histogram(_list(params, 'cycle'),
+                                        types=_list(params, 'types'),
+                                        buckets=_buckets(params))
+
+
+def _cycle_time_percentiles(metrics, params):
+
+    if 'cycle' not in params:
+        raise BadRequest("cycle is required")
+
+    from_date, to_date = _window(params)
+
+    try:
+        percentiles = [int(p) for p in _list(params, 'percentiles') or [50, 85, 95]]
+    except ValueError:
+        raise BadRequest("percentiles should be numbers")
+
+    return metrics.cycle_time_percentiles(_list(params, 'cycle'),
+                                          types=_list(params, 'types'),
+                                          from_date=from_date,
+                                          to_date=to_date,
+                                          percentiles=percentiles,
+                                          category=params.get('category'))
+
+
+def _aging(metrics, params):
+
+    if 'cycle' not in params:
+        raise BadRequest("cycle is required")
+
+    return metrics.aging(_list(params, 'cycle'),
+                         types=_list(params, 'types'),
+                         as_of=_date(params, 'as_of', date.today()))
+
+
+def _snapshot(metrics, params):
+
+    dates = [date.today()]
+    if 'dates' in params:
+        try:
+            dates = [datetime.strptime(day, '%Y-%m-%d').date() for day in _list(params, 'dates')]
+        except ValueError:
+            raise BadRequest("dates should be YYYY-MM-DD")
+
+    return metrics.snapshot(dates,
+                            types=_list(params, 'types'),
+                            field=params.get('field'),
+                            detail=params.get('detail', 'false') == 'true')
+
+
+def _arrival_rate(metrics, params):
+
+    from_date, to_date = _window(params)
+    return metrics.arrival_rate(from_date, to_date, field=params.get('field'))
+
+
+def _forecast(metrics, params):
+
+    from_date, to_date = _window(params)
+
+    items = None
+    if 'items' in params:
+        try:
+            items = int(params['items'])
+        except ValueError:
+            raise BadRequest("items should be a number")
+
+    until_date = _date(params, 'until', None)
+
+    if (items is None) == (until_date is None):
+        raise BadRequest("forecast needs either items or until")
+
+    return metrics.forecast(from_date, to_date, items=items, until_date=until_date, types=_list(params, 'types'))
+
+
+def _details(metrics, params):
+
+    return metrics.details(fields=_list(params, 'fields'))
+
+
+ENDPOINTS = {'throughput':           _throughput,
+             'cfd':                  _cfd,
+             'demand':               _demand,
+             'cycle_time_histogram': _cycle_time_histogram,
+             'cycle_time_percentiles': _cycle_time_percentiles,
+             'aging':                _aging,
+             'snapshot':             _snapshot,
+             'arrival_rate':         _arrival_rate,
+             'forecast':             _forecast,
+             'details':              _details}
+
+
+def to_json(data):
+    """
+    A metric's result as JSON - DataFrames are split into their index,
+    columns and data
+    """
+
+    if data is None:
+        return 'null'
+
+    return data.to_json(orient='split', date_format='iso')
+
+
+class MetricsService(object):
+    """
+    A warm Metrics instance and a cache of the results calculated from
+    its current work items
+    """
+
+    def __init__(self, metrics):
+
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.refreshed = None
+        self.refresh_error = None
+
+    def refresh(self):
+        """
+        Fetch the work items again.  Requests are still answered from the
+        old work items while the fetch is in progress.
+        """
+
+        with self.lock:
+            metrics = self.metrics
+
+        work_items = metrics.source.refresh()
+
+        # Loaded into a copy, so that requests in progress keep the work
+        # items they started with, and everything requests share is built
+        # before any of them can see it
+
+        metrics = copy.copy(metrics)
+        metrics.load(work_items)
+        metrics.warm()
+
+        with self.lock:
+            self.metrics = metrics
+            self.cache = {}
+            self.refreshed = datetime.now()
+            self.refresh_error = None
+
+    def get(self, name, params):
+        """
+        The JSON for endpoint name with query params
+        """
+
+        key = (name, tuple(sorted(params.items())))
+
+        with self.lock:
+
+            if key in self.cache:
+                return self.cache[key]
+
+            metrics = self.metrics
+
+        # Worked out without the lock, so that one slow metric doesn't
+        # hold up every other request
+
+        result = to_json(ENDPOINTS[name](metrics, params))
+
+        with self.lock:
+
+            # Unless the work items were refreshed in the meantime
+
+            if self.metrics is metrics:
+                self.cache[key] = result
+
+        return result
+
+    def status(self):
+
+        with self.lock:
+            return json.dumps({'work_items': len(self.metrics.work_items or []),
+                               'refreshed': self.refreshed.isoformat() if self.refreshed else None,
+                               'refresh_error': self.refresh_error,
+                               'cached': len(self.cache)})
+
+    def refresh_every(self, seconds, stop):
+        """
+        Refresh until stop is set, keeping the old work items if a
+        refresh fails
+        """
+
+        while not stop.wait(seconds):
+            try:
+                self.refresh()
+            except Exception:
+                error = traceback.format_exc()
+                with self.lock:
+                    self.refresh_error = error
+                sys.stderr.write(error)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        name = url.path.strip('/')
+        params = dict([(key, values[-1]) for key, values in parse_qs(url.query).items()])
+
+        service = self.server.service
+
+        try:
+            if name == 'status':
+                self._reply(200, service.status())
+            elif name in ENDPOINTS:
+                self._reply(200, service.get(name, params))
+            else:
+                self._reply(404, json.dumps({'error': "Unknown metric:{0}".format(name),
+                                             'metrics': sorted(ENDPOINTS)}))
+        except BadRequest as error:
+            self._reply(400, json.dumps({'error': str(error)}))
+        except Exception as error:
+            self._reply(500, json.dumps({'error': repr(error)}))
+
+    def _reply(self, code, body):
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+
+        HTTPServer.__init__(self, address, MetricsRequestHandler)
+        self.service = service
+        self.quiet = quiet
+
+
+def serve(metrics, host='127.0.0.1', port=8000, refresh_minutes=15):
+    """
+    Load the work items then serve metrics until interrupted
+    """
+
+    service = MetricsService(metrics)
+    service.refresh()
+
+    server = MetricsServer((host, port), service)
+
+    stop = threading.Event()
+    refresher = threading.Thread(target=service.refresh_every, args=(refresh_minutes * 60, stop))
+    refresher.daemon = True
+    refresher.start()
+
+    print "Serving {0} work items on http://{1}:{2}/".format(len(service.metrics.work_items), host, server.server_port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,145 @@
+"""
+Mergeable cycle time sketches.
+
+Cycle times are whole numbers of days, so rather than approximate their
+distribution with a t-digest we keep a count of how many times each
+number of days was seen.  That gives exact percentiles from a few hundred
+numbers at most, and two sketches combine by adding their counts, so we
+can keep one per category, issue type, cycle and week and put together
+whichever of them a report asks for.
+"""
+
+import numpy as np
+
+
+class QuantileSketch(object):
+    """
+    The number of times each value was seen
+    """
+
+    def __init__(self, counts=None):
+
+        self.counts = {}
+
+        if counts is not None:
+            for value, count in counts:
+                self.add(value, count)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, value, count=1):
+
+        self.counts[value] = self.counts.get(value, 0) + count
+
+    def merge(self, other):
+        """
+        Add in the values seen by other
+        """
+
+        for value, count in other.counts.iteritems():
+            self.add(value, count)
+
+        return self
+
+    def quantiles(self, percentiles):
+        """
+        The smallest value with at least each percent of values at or
+        below it
+        """
+
+        if len(self.counts) == 0:
+            return [None] * len(percentiles)
+
+        values = np.array(sorted(self.counts))
+        seen = np.cumsum([self.counts[value] for value in values])
+
+        ranks = np.ceil(np.array(percentiles, dtype=np.float64) / 100 * seen[-1]).clip(1, seen[-1])
+
+        return list(values[np.searchsorted(seen, ranks)])
+
+    def ranks(self, values):
+        """
+        The percentage of values seen which are at or below each of values
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+
+        if len(self.counts) == 0:
+            return np.repeat(np.nan, len(values))
+
+        seen_values = np.array(sorted(self.counts), dtype=np.float64)
+        seen = np.concatenate([[0], np.cumsum([self.counts[value] for value in sorted(self.counts)])])
+
+        ranks = seen[np.searchsorted(seen_values, values, side='right')] * 100.0 / seen[-1]
+        ranks[np.isnan(values)] = np.nan
+
+        return ranks
+
+    def to_list(self):
+
+        return sorted(self.counts.items())
+
+
+class SketchStore(object):
+    """
+    A QuantileSketch for each (category, issue type, cycle, week) where
+    week is the Monday ending the week the work item was finished
+    """
+
+    def __init__(self):
+
+        self.sketches = {}
+
+    def __len__(self):
+        return len(self.sketches)
+
+    def add(self, category, issue_type, cycle, week, value):
+
+        key = (category, issue_type, cycle, week)
+
+        if key not in self.sketches:
+            self.sketches[key] = QuantileSketch()
+
+        self.sketches[key].add(value)
+
+    def merge(self, other):
+        """
+        Add in the sketches of another store, e.g. from another source
+        """
+
+        for key, sketch in other.sketches.iteritems():
+            if key not in self.sketches:
+                self.sketches[key] = QuantileSketch()
+            self.sketches[key].merge(sketch)
+
+        return self
+
+    def query(self, cycle, categories=None, issue_types=None, from_week=None, to_week=None):
+        """
+        One sketch of all the values for cycle in the given categories,
+        issue types and weeks
+        """
+
+        result = QuantileSketch()
+
+        for (category, issue_type, sketch_cycle, week), sketch in self.sketches.iteritems():
+
+            if sketch_cycle != cycle:
+                continue
+
+            if categories is not None and category not in categories:
+                continue
+
+            if issue_types is not None and issue_type not in issue_types:
+                continue
+
+            if from_week is not None and week < from_week:
+                continue
+
+            if to_week is not None and week > to_week:
+                continue
+
+            result.merge(sketch)
+
+        return result
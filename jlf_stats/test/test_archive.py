@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.archive import ColdArchive, hot_jql
+from jlf_stats.benchmark.workload import generate, SyntheticJira, History, Item
+from jlf_stats.metrics import Metrics
+
+import unittest
+import json
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+
+from pandas.util.testing import assert_frame_equal
+
+
+class CountingJira(SyntheticJira):
+    """
+    Counts the issues served, so we can tell how many were fetched
+    """
+
+    def __init__(self, workload):
+
+        SyntheticJira.__init__(self, workload)
+        self.served = 0
+
+    def search_issues(self, jql, startAt=0, maxResults=50, validate_query=True, fields=None, expand=None, json_result=None):
+
+        page = SyntheticJira.search_issues(self, jql, startAt, maxResults, validate_query, fields, expand, json_result)
+        self.served += len(page['issues'] if json_result else page)
+        return page
+
+
+def by_id(work_items):
+
+    return dict((work_item.id, json.loads(work_item.to_JSON())) for work_item in work_items)
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workspace = tempfile.mkdtemp()
+
+        self.workload = generate(60, categories=['alpha', 'beta'], span_days=200, seed=4)
+
+        # Flag every third change so there is another changelog field to keep
+
+        for issue in self.workload.issues[::3]:
+            for history in issue.changelog.histories[::3]:
+                history.items.append(Item('Flagged', '', 'Impediment'))
+
+        self.config = self.workload.config()
+        self.config['changelog_fields'] = ['Flagged']
+        self.config['cycles']['waiting'] = {'exclude': ['In Progress', 'Closed']}
+
+        # Up to tomorrow, so that changes made today are in range
+
+        self.config['until_date'] = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workspace)
+
+    def metrics(self, archive=True, from_date=None):
+
+        config = json.loads(json.dumps(self.config))
+        if archive:
+            config['source']['archive'] = self.workspace
+        if from_date is not None:
+            config['from_date'] = from_date.strftime('%Y-%m-%d')
+
+        metrics = Metrics(config=config)
+        metrics.source.jira = CountingJira(self.workload)
+        metrics.load(metrics.source.work_items())
+
+        return metrics
+
+    def testHotJql(self):
+
+        self.assertEqual(hot_jql('project = ABC ORDER BY key ASC', ['Closed', 'Done'], date(2015, 3, 2)),
+                         '(project = ABC) AND (status NOT IN ("Closed", "Done") OR updated >= "2015-03-02") ORDER BY key ASC')
+
+    def testHotJqlWithoutDoneStates(self):
+
+        self.assertEqual(hot_jql('project = ABC ORDER BY key ASC', [], date(2015, 3, 2)),
+                         'project = ABC ORDER BY key ASC')
+
+    def testWindowedSyncKeepsEverythingArchived(self):
+
+        from_date = date(2013, 5, 1)
+
+        windowed = self.metrics(from_date=from_date)
+
+        self.assertEqual(by_id(windowed.work_items), by_id(self.metrics(archive=False, from_date=from_date).work_items))
+
+        # Done issues resolved before the window are still archived, so a
+        # wider sync, which only fetches the hot ones, finds them all
+
+        everything = self.metrics()
+
+        self.assertTrue(len(windowed.work_items) < len(self.workload.issues))
+        self.assertEqual(by_id(everything.work_items), by_id(self.metrics(archive=False).work_items))
+
+    def testSameAsFetchingEverything(self):
+
+        everything = self.metrics(archive=False)
+
+        first = self.metrics()
+        second = self.metrics()
+
+        done = len([issue for issue in self.workload.issues if issue.fields.status.name == 'Closed'])
+
+        self.assertTrue(done > 0)
+        self.assertEqual(first.source.jira.served, len(self.workload.issues))
+        self.assertEqual(second.source.jira.served, len(self.workload.issues) - done)
+
+        self.assertEqual(by_id(second.work_items), by_id(everything.work_items))
+
+        from_date = date(2013, 1, 1)
+        to_date = date(2013, 7, 1)
+
+        assert_frame_equal(second.throughput(from_date, to_date).sort_index(axis=1),
+                           everything.throughput(from_date, to_date).sort_index(axis=1))
+        assert_frame_equal(second.cfd(from_date, to_date), everything.cfd(from_date, to_date))
+
+        # The synthetic JIRA serves str ids where the archive has unicode,
+        # as JIRA itself would
+
+        assert_frame_equal(second.time_in_state(to_date=to_date).sort_index(),
+                           everything.time_in_state(to_date=to_date).sort_index(),
+                           check_index_type=False)
+        assert_frame_equal(second.time_in_state(to_date=to_date, field='Flagged').sort_index(),
+                           everything.time_in_state(to_date=to_date, field='Flagged').sort_index(),
+                           check_index_type=False)
+
+    def testChangelogFieldsChanged(self):
+
+        self.metrics()
+
+        # Archived without Assignee, so it all has to be fetched again
+
+        self.config['changelog_fields'].append('Assignee')
+
+        metrics = self.metrics()
+
+        self.assertEqual(metrics.source.jira.served, len(self.workload.issues))
+        self.assertEqual(by_id(metrics.work_items), by_id(self.metrics(archive=False).work_items))
+
+    def testReopenedReplacesArchived(self):
+
+        self.metrics()
+
+        issue = [issue for issue in self.workload.issues if issue.fields.status.name == 'Closed'][0]
+
+        issue.changelog.histories.insert(0, History(datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+                                                    [Item('status', 'Closed', 'Reopened')]))
+        issue.fields.status.name = 'Reopened'
+
+        metrics = self.metrics()
+
+        reopened = [work_item for work_item in metrics.work_items if work_item.id == issue.key]
+
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(reopened[0].state, 'Reopened')
+
+        # It is hot again, so it is no longer archived
+
+        archive = ColdArchive(self.workspace, self.config['categories'], ['Closed'], self.config['cycles'],
+                              self.config['changelog_fields'])
+        self.assertFalse(issue.key in [work_item.id for work_item in archive.load()])
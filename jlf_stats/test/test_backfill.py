@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.backfill import Backfill, as_of_dates
+from jlf_stats.benchmark.workload import generate, SyntheticJira, Workload, Issue, Fields, Changelog
+from jlf_stats.metrics import Metrics
+
+import unittest
+import json
+from datetime import date, timedelta
+
+from pandas.util.testing import assert_frame_equal
+
+
+def as_it_was(workload, day):
+    """
+    The workload as JIRA would have had it on day
+    """
+
+    issues = []
+
+    for issue in workload.issues:
+
+        if issue.fields.created[:10] > day.isoformat():
+            continue
+
+        histories = [history for history in issue.changelog.histories if history.created[:10] <= day.isoformat()]
+
+        status = 'Open'
+        if len(histories) > 0:
+            status = histories[0].items[0].toString
+
+        f = issue.fields
+        fields = Fields(created=f.created,
+                        summary=f.summary,
+                        status=status,
+                        issuetype=f.issuetype.name,
+                        resolutiondate=f.resolutiondate,
+                        project=f.project.name)
+
+        was = Issue(issue.key, fields, Changelog(histories))
+        was.category = issue.category
+        issues.append(was)
+
+    return Workload(issues=issues,
+                    categories=workload.categories,
+                    types=workload.types,
+                    states=workload.states,
+                    done_states=workload.done_states,
+                    until_date=day)
+
+
+def as_json(work_item):
+    """
+    Everything but the daily history, which views share with the work
+    items they were made from
+    """
+
+    as_json = json.loads(work_item.to_JSON())
+    del as_json['history']
+    return as_json
+
+
+class TestBackfill(unittest.TestCase):
+
+    def testAsOfDates(self):
+
+        self.assertEqual(as_of_dates(date(2015, 1, 5), date(2015, 1, 26)),
+                         [date(2015, 1, 5), date(2015, 1, 12), date(2015, 1, 19), date(2015, 1, 26)])
+
+        self.assertEqual(as_of_dates(date(2015, 1, 5), date(2015, 1, 7), every=1),
+                         [date(2015, 1, 5), date(2015, 1, 6), date(2015, 1, 7)])
+
+    def testSameAsFetchingOnEachDate(self):
+        """
+        Each date's view is what we'd get from JIRA as it was on that date
+        """
+
+        workload = generate(80, categories=['alpha', 'beta'], span_days=300, seed=6)
+
+        config = workload.config()
+        config['cycles']['active'] = {'include': ['In Progress', 'PR Review']}
+        config['cycles']['waiting'] = {'exclude': ['In Progress', 'Closed']}
+        config['cycles']['reviewed'] = {'after': 'PR Review', 'exit': 'QA'}
+
+        metrics = Metrics(config=config)
+        metrics.source.jira = SyntheticJira(workload)
+
+        backfill = Backfill(metrics)
+
+        for day, view in backfill.each(as_of_dates(date(2013, 2, 4), date(2013, 10, 28), every=45)):
+
+            fresh_config = as_it_was(workload, day).config()
+            fresh_config['cycles'] = config['cycles']
+
+            fresh = Metrics(config=fresh_config)
+            fresh.source.jira = SyntheticJira(as_it_was(workload, day))
+            fresh.load(fresh.source.work_items())
+
+            self.assertEqual([as_json(work_item) for work_item in view.work_items],
+                             [as_json(work_item) for work_item in fresh.work_items])
+
+            # A fresh fetch's daily histories stop the day before until_date
+
+            from_date = date(2013, 1, 1)
+            day_before = day - timedelta(days=1)
+
+            assert_frame_equal(view.throughput(from_date, day_before), fresh.throughput(from_date, day_before))
+            assert_frame_equal(view.cfd(from_date, day_before), fresh.cfd(from_date, day_before))
+            assert_frame_equal(view.time_in_state(to_date=day), fresh.time_in_state(to_date=day))
+
+            view_aging = view.aging('deliver', as_of=day)
+            fresh_aging = fresh.aging('deliver', as_of=day)
+            if fresh_aging is None:
+                self.assertTrue(view_aging is None)
+            else:
+                assert_frame_equal(view_aging, fresh_aging)
+
+        # Going back starts again
+
+        earlier = backfill.as_of(date(2013, 3, 1))
+        self.assertEqual(len(earlier.work_items), len(as_it_was(workload, date(2013, 3, 1)).issues))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.benchmark.workload import generate, raw_issue, SyntheticJira
+from jlf_stats.benchmark import suite
+from jlf_stats.history import history_from_jira_changelog, extract_date
+
+import unittest
+import sys
+from StringIO import StringIO
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def testGenerateWorkload(self):
+
+        workload = generate(50, categories=['one', 'two'], seed=1)
+
+        self.assertEqual(len(workload.issues), 50)
+        self.assertEqual(sorted(workload.by_category().keys()), ['one', 'two'])
+
+        for issue in workload.issues:
+
+            # Most recent history first, as JIRA gives them to us
+            created = [history.created for history in issue.changelog.histories]
+            self.assertEqual(created, sorted(created, reverse=True))
+
+            history = history_from_jira_changelog(issue.changelog,
+                                                  extract_date(issue.fields.created),
+                                                  workload.until_date.date())
+
+            self.assertEqual(history[-1], issue.fields.status.name)
+
+    def testWorkloadIsRepeatable(self):
+
+        first = generate(20, seed=3)
+        second = generate(20, seed=3)
+
+        self.assertEqual([raw_issue(issue) for issue in first.issues],
+                         [raw_issue(issue) for issue in second.issues])
+
+    def testServeWorkloadByCategory(self):
+
+        workload = generate(30, categories=['one'])
+        jira = SyntheticJira(workload)
+
+        jql = workload.config()['categories']['one']
+
+        self.assertEqual(len(jira.search_issues(jql, startAt=0, maxResults=20)), 20)
+        self.assertEqual(len(jira.search_issues(jql, startAt=20, maxResults=20)), 10)
+
+    def testMeasureCase(self):
+
+        result = suite.measure('arrival_rate', 20)
+
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(result['issues'], 20)
+
+        for key in ['wall_seconds', 'cpu_seconds', 'peak_rss_kb', 'rss_growth_kb']:
+            self.assertTrue(result[key] >= 0, key)
+
+    def testMeasureCaseWritesNothing(self):
+        """
+        Nothing but the results goes to stdout
+        """
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            result = suite.measure('work_items', 600)
+            written = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(written, '')
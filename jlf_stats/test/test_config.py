@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from jlf_stats import config
+
+import unittest
+import copy
+
+
+GOOD_CONFIG = {
+    'source': {'type': 'jira',
+               'server': 'https://example.com',
+               'authentication': {'username': 'user', 'password': 'pass'}},
+    'categories': {'Awesome Product': 'project = Awesome'},
+    'types': {'failure': ['Bug'], 'value': ['Story']},
+    'states': ['Open', 'In Progress', 'QA', 'Closed'],
+    'counts_towards_throughput': ['Closed'],
+    'cycles': {'develop': {'start': 'In Progress', 'end': 'QA'},
+               'deliver': {'include': ['In Progress', 'QA']}},
+    'until_date': '2012-11-30',
+    'name': 'reports',
+    'format': 'xlsx',
+    'location': '.',
+    'reports': [{'metric': 'throughput', 'categories': 'foreach', 'types': 'foreach'},
+                {'metric': 'cfd', 'format': {'QA': {'color': 'green'}}},
+                {'metric': 'cycle-time', 'types': ['failure'], 'cycles': ['develop', 'deliver'],
+                 'buckets': [0, 5, 10, 'max']}]
+}
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.config = copy.deepcopy(GOOD_CONFIG)
+
+    def testGoodConfigHasNoProblems(self):
+
+        self.assertEqual(config.check(self.config), [])
+
+    def testMissingItems(self):
+
+        del self.config['name']
+        del self.config['source']['server']
+
+        problems = config.check(self.config)
+
+        self.assertIn("Missing config item:name", problems)
+        self.assertIn("Missing config item:source.server", problems)
+
+    def testAuthentication(self):
+
+        self.config['source']['authentication'] = {'username': 'user'}
+        self.assertEqual(config.check(self.config), ["Authentication misconfigured"])
+
+        self.config['source']['authentication'] = {'access_token': 'a',
+                                                   'access_token_secret': 'b',
+                                                   'consumer_key': 'c',
+                                                   'key_cert': '/no/such/key.pem'}
+        self.assertEqual(config.check(self.config), ["key_cert not found:/no/such/key.pem"])
+
+    def testUnknownStates(self):
+
+        self.config['cycles']['develop']['end'] = 'Q&A'
+        self.config['counts_towards_throughput'] = ['Done']
+
+        problems = config.check(self.config)
+
+        self.assertIn("counts_towards_throughput state not in states:Done", problems)
+        self.assertIn("Cycle develop end state not in states:Q&A", problems)
+
+    def testReports(self):
+
+        self.config['reports'] = [{'metric': 'velocity'},
+                                  {'metric': 'demand', 'types': ['failure', 'overhead']},
+                                  {'metric': 'cycle-time', 'cycles': ['review'], 'buckets': [10, 5, 'max']},
+                                  {'metric': 'cfd', 'format': {'Done': {}}},
+                                  {'metric': 'done', 'sort': 'week-resolved'},
+                                  {'metric': 'flow-efficiency', 'active': ['In Progress', 'Doing'], 'by': 'day'}]
+
+        problems = config.check(self.config)
+
+        self.assertEqual(problems,
+                         ["Report 0 (velocity): unknown metric",
+                          "Report 1 (demand): unknown type grouping:overhead",
+                          "Report 2 (cycle-time): unknown cycle:review",
+                          "Report 2 (cycle-time): bucket edges should increase",
+                          "Report 3 (cfd): format for state not in states:Done",
+                          "Report 4 (done): sort should be week-done or a cycle:week-resolved",
+                          "Report 5 (flow-efficiency): active state not in states:Doing",
+                          "Report 5 (flow-efficiency): needs a list of wait states",
+                          "Report 5 (flow-efficiency): by should be week or item:day"])
+
+    def testBadUntilDate(self):
+
+        self.config['until_date'] = '30/11/2012'
+
+        self.assertEqual(config.check(self.config), ["until_date should be YYYY-MM-DD:30/11/2012"])
+
+    def testFederatedSources(self):
+
+        jira = self.config['source']
+        jira['name'] = 'core'
+        jira['categories'] = self.config.pop('categories')
+
+        self.config['source'] = [jira,
+                                 {'name': 'support', 'type': 'fogbugz', 'url': 'https://example.fogbugz.com', 'token': 'abc',
+                                  'categories': {'Support': 'project:Support'}}]
+
+        self.assertEqual(config.check(self.config), [])
+
+        del self.config['source'][1]['categories']
+        del self.config['source'][1]['token']
+        self.config['source'][1]['name'] = 'core'
+
+        self.assertEqual(config.check(self.config),
+                         ["source 1: name used more than once:core",
+                          "source core: Missing config item:source.token",
+                          "Missing config item:categories"])
+
+    def testPaging(self):
+
+        self.config['source']['paging'] = 'keyset'
+        self.config['source']['partition_days'] = 90
+        self.config['source']['resume'] = 'crawl'
+        self.config['source']['archive'] = 'archive'
+
+        self.assertEqual(config.check(self.config), [])
+
+        self.config['source']['paging'] = 'cursor'
+        self.config['source']['partition_threads'] = 0
+        self.config['source']['archive'] = True
+        del self.config['source']['partition_days']
+
+        self.assertEqual(config.check(self.config),
+                         ["source.paging should be offset or keyset:cursor",
+                          "source.partition_threads should be a whole number of at least 1:0",
+                          "source.resume needs source.partition_days",
+                          "source.archive should be a directory:True"])
+
+    def testChangelogFields(self):
+
+        self.config['changelog_fields'] = ['Flagged', 'assignee']
+        self.config['reports'] = [{'metric': 'time-in-state', 'field': 'Flagged'},
+                                  {'metric': 'arrival-rate', 'field': 'assignee'}]
+
+        self.assertEqual(config.check(self.config), [])
+
+        self.config['reports'] = [{'metric': 'time-in-state', 'field': 'Sprint'},
+                                  {'metric': 'throughput', 'field': 'Flagged'},
+                                  {'metric': 'snapshot', 'field': 'Flagged', 'dates': ['2012-10-01', '1/11/2012']}]
+
+        self.assertEqual(config.check(self.config),
+                         ["Report 0 (time-in-state): field not in changelog_fields:Sprint",
+                          "Report 1 (throughput): can't report on a field",
+                          "Report 2 (snapshot): dates should be YYYY-MM-DD:1/11/2012"])
+
+    def testCube(self):
+
+        self.config['cube'] = 'cube'
+
+        self.assertEqual(config.check(self.config), [])
+
+        self.config['cube'] = ['cube']
+
+        self.assertEqual(config.check(self.config), ["cube should be a directory:['cube']"])
+
+    def testWorkers(self):
+
+        self.config['workers'] = 4
+        self.config['matrix'] = 'matrix'
+
+        self.assertEqual(config.check(self.config), [])
+
+        self.config['workers'] = 0
+        self.config['matrix'] = 7
+
+        self.assertEqual(config.check(self.config), ["matrix should be a directory:7",
+                                                     "workers should be a whole number of at least 1:0"])
+
+    def testMemoryBudget(self):
+
+        self.config['memory_budget'] = 0.5
+
+        self.assertEqual(config.check(self.config), [])
+
+        self.config['memory_budget'] = '512MB'
+
+        self.assertEqual(config.check(self.config), ["memory_budget should be a number of megabytes:512MB"])
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.benchmark.workload import generate, SyntheticJira, History, Item
+from jlf_stats.cube import Cube
+from jlf_stats.history import history_from_state_transitions
+from jlf_stats.index import week_start_date
+from jlf_stats.metrics import Metrics
+from jlf_stats.transitions import weekly_arrivals
+from jlf_stats.work import WorkItem
+
+import unittest
+import copy
+import shutil
+import tempfile
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+
+# The scans of every work item's history the cube replaced, to check it
+# against
+
+def scanned_throughput(metrics, from_date, to_date, category=None, types=None):
+
+    history = metrics.history(from_date, to_date)
+
+    rows = []
+
+    for key in history:
+
+        work_item = metrics.work_item(key)
+
+        if category is not None and category != work_item.category:
+            continue
+
+        swimlane = work_item.category
+
+        if types is not None:
+            for type_grouping in types:
+                if work_item.type in metrics.types[type_grouping]:
+                    swimlane = swimlane + '-' + type_grouping
+            if swimlane == work_item.category:
+                continue
+
+        for day, state in history[key].iteritems():
+            if day.weekday() == metrics.throughput_dow and state in metrics.counts_towards_throughput:
+                rows.append({'swimlane': swimlane, 'id': key, 'week': day, 'count': 1})
+
+    if len(rows) == 0:
+        return None
+
+    return pd.pivot_table(pd.DataFrame(rows), index=['week'], columns=['swimlane'], values='count',
+                          aggfunc=np.count_nonzero)
+
+
+def scanned_cfd(metrics, from_date, until_date, types=None):
+
+    history = metrics.history(from_date, until_date, types)
+
+    def state_order(state):
+        if isinstance(state, float):
+            return -1
+        return metrics.states.index(state)
+
+    return pd.DataFrame(dict((day, sorted(history.ix[day], key=state_order)) for day in history.index))
+
+
+def scanned_demand(metrics, types=None):
+
+    rows = []
+
+    for work_item in metrics.work_items:
+
+        swimlane = work_item.category
+        include = True
+
+        if types is not None:
+            include = False
+            for type_grouping in types:
+                if work_item.type in metrics.types[type_grouping]:
+                    swimlane = swimlane + '-' + type_grouping
+                    include = True
+
+        if include:
+            created = work_item.date_created
+            rows.append({'swimlane': swimlane,
+                         'count': 1,
+                         'week_created': week_start_date(created.isocalendar()[0],
+                                                         created.isocalendar()[1]).strftime('%Y-%m-%d')})
+
+    return pd.pivot_table(pd.DataFrame(rows), index=['week_created'], columns=['swimlane'], values='count',
+                          aggfunc=np.count_nonzero)
+
+
+class TestCube(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workload = generate(120, categories=['alpha', 'beta'], span_days=200, seed=9)
+
+        self.config = self.workload.config()
+        self.config['states'].append('Open')
+
+        self.metrics = Metrics(config=copy.deepcopy(self.config))
+        self.metrics.source.jira = SyntheticJira(self.workload)
+        self.metrics.load(self.metrics.source.work_items())
+
+        self.groupings = list(self.config['types'])
+
+    def testThroughput(self):
+
+        for from_date, to_date in [(date(2013, 1, 1), date(2013, 7, 20)), (date(2013, 3, 4), date(2013, 5, 1))]:
+            for category in [None, 'beta']:
+                for types in [None, self.groupings, self.groupings[:1]]:
+
+                    expected = scanned_throughput(self.metrics, from_date, to_date, category, types)
+                    actual = self.metrics.throughput(from_date, to_date, cumulative=True, category=category,
+                                                     types=types)
+
+                    if expected is None:
+                        self.assertTrue(actual is None)
+                    else:
+                        assert_frame_equal(actual, expected)
+
+    def testCfd(self):
+
+        for from_date, until_date in [(None, None), (date(2013, 3, 4), date(2013, 5, 1))]:
+            for types in [None, self.groupings[1:]]:
+                assert_frame_equal(self.metrics.cfd(from_date, until_date, types),
+                                   scanned_cfd(self.metrics, from_date, until_date, types))
+
+    def testDemand(self):
+
+        for types in [None, self.groupings, self.groupings[:1]]:
+            expected = scanned_demand(self.metrics, types)
+            actual = self.metrics.demand(None, None, types)
+            assert_frame_equal(actual.loc[expected.index], expected, check_names=False)
+
+    def testArrivalRate(self):
+
+        for from_date, to_date in [(None, None), (date(2013, 3, 4), date(2013, 5, 1))]:
+            assert_frame_equal(self.metrics.arrival_rate(from_date, to_date),
+                               weekly_arrivals(self.metrics.transitions(), from_date, to_date))
+
+    def testStateTransitionHistories(self):
+        """
+        Work items which keep their history as state transitions, as
+        FogBugz's do, are in their last state for ever
+        """
+
+        def transition(day, from_state, to_state):
+            return {'timestamp': datetime(2013, 1, day, 12), 'from': from_state, 'to': to_state}
+
+        work_items = [WorkItem(id='1', title=None, state='Closed', type='Story', category='one',
+                               date_created=datetime(2013, 1, 1),
+                               history=[transition(3, 'Open', 'In Progress'), transition(7, 'In Progress', 'Closed')]),
+                      WorkItem(id='2', title=None, state=None, type='Bug', category='one',
+                               date_created=datetime(2013, 1, 2),
+                               history=[])]
+
+        metrics = Metrics(config=copy.deepcopy(self.config))
+        metrics.load(work_items)
+
+        expected = pd.DataFrame(dict((day, history_from_state_transitions(date(2013, 1, 1), work_items[0].history,
+                                                                          date(2013, 1, 20))[day.date()])
+                                     for day in pd.date_range('2013-01-01', '2013-01-20')), index=[0])
+
+        cfd = metrics.cfd(date(2013, 1, 1), date(2013, 1, 20), types=['value'])
+
+        assert_frame_equal(cfd, expected)
+
+        self.assertEqual(list(metrics.cfd(until_date=date(2013, 1, 3)).iloc[:, -1]), ['In Progress', None])
+
+
+class TestSavedCube(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workspace = tempfile.mkdtemp()
+        self.workload = generate(60, categories=['alpha', 'beta'], span_days=200, seed=2)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workspace)
+
+    def metrics(self, until_date):
+
+        config = self.workload.config()
+        config['states'].append('Open')
+        config['until_date'] = until_date.strftime('%Y-%m-%d')
+        config['cube'] = self.workspace
+
+        metrics = Metrics(config=config)
+        metrics.source.jira = SyntheticJira(self.workload)
+        metrics.load(metrics.source.work_items())
+
+        return metrics
+
+    def assertSameCube(self, cube, expected):
+
+        self.assertEqual(cube.first_day, expected.first_day)
+        self.assertEqual(cube.cells, expected.cells)
+
+        states = [cube.states.index(state) for state in expected.states]
+
+        self.assertTrue((cube.in_state[:, :, states] == expected.in_state).all())
+        self.assertTrue((cube.arrived[:, :, states] == expected.arrived).all())
+        self.assertTrue((cube.created_on == expected.created_on).all())
+
+    def testBringSavedCubeUpToDate(self):
+
+        self.metrics(date(2013, 8, 1)).cube()
+
+        # A day later, with one work item moved on
+
+        issue = [issue for issue in self.workload.issues if issue.fields.status.name == 'In Progress'][0]
+        issue.changelog.histories.insert(0, History('2013-08-01T10:00:00.000+0000',
+                                                    [Item('status', 'In Progress', 'PR Review')]))
+        issue.fields.status.name = 'PR Review'
+
+        metrics = self.metrics(date(2013, 8, 2))
+
+        saved = Cube.load(self.workspace)
+        reused = len([key for key in saved.keys if key is not None and key in
+                      set(Cube(metrics.work_items, metrics.transitions()).keys)])
+
+        self.assertEqual(reused, len(metrics.work_items) - 1)
+
+        self.assertSameCube(metrics.cube(), Cube(metrics.work_items, metrics.transitions()))
+
+    def testNoSavedCube(self):
+
+        self.assertTrue(Cube.load(self.workspace) is None)
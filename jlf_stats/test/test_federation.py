@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.federation import FederatedSource, source_configs
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+from jlf_stats.exceptions import MissingConfigItem
+from jlf_stats.metrics import Metrics
+
+import unittest
+import threading
+from datetime import date
+
+
+class MeetingJira(object):
+    """
+    Waits on its first search until the other source has started
+    searching too, which it only can if they are fetched at once
+    """
+
+    def __init__(self, jira, arrived, other):
+
+        self.jira = jira
+        self.arrived = arrived
+        self.other = other
+        self.met = None
+
+    def search_issues(self, *args, **kwargs):
+
+        if self.met is None:
+            self.arrived.set()
+            self.met = self.other.wait(5)
+
+        return self.jira.search_issues(*args, **kwargs)
+
+
+class BrokenJira(object):
+
+    def search_issues(self, *args, **kwargs):
+        raise IOError("JIRA is down")
+
+
+class TestFederation(unittest.TestCase):
+
+    def setUp(self):
+
+        self.core = generate(40, categories=['alpha', 'beta'], seed=1)
+        self.support = generate(30, categories=['gamma'], seed=2)
+
+        self.config = self.core.config()
+
+        core_source = dict(self.config['source'], name='core', categories=self.config['categories'])
+        support_source = dict(self.config['source'], name='support', categories=self.support.config()['categories'])
+
+        self.config['source'] = [core_source, support_source]
+
+    def testFetchSourcesAtOnce(self):
+
+        metrics = Metrics(config=self.config)
+
+        self.assertTrue(isinstance(metrics.source, FederatedSource))
+
+        core_arrived = threading.Event()
+        support_arrived = threading.Event()
+
+        (core_name, core), (support_name, support) = metrics.source.sources
+        core.jira = MeetingJira(SyntheticJira(self.core), core_arrived, support_arrived)
+        support.jira = MeetingJira(SyntheticJira(self.support), support_arrived, core_arrived)
+
+        throughput = metrics.throughput(date(2013, 1, 1), self.core.until_date)
+
+        self.assertTrue(core.jira.met)
+        self.assertTrue(support.jira.met)
+
+        self.assertEqual(sorted(throughput.columns), ['alpha', 'beta', 'gamma'])
+
+        ids = [work_item.id for work_item in metrics.work_items]
+        self.assertEqual(len(set(ids)), 70)
+        self.assertEqual(len([id for id in ids if id.startswith('core:')]), 40)
+        self.assertEqual(len([id for id in ids if id.startswith('support:')]), 30)
+
+        # Refreshing doesn't prefix the ids again
+
+        metrics.refresh()
+        self.assertEqual(sorted([work_item.id for work_item in metrics.work_items]), sorted(ids))
+
+    def testFailingSource(self):
+
+        metrics = Metrics(config=self.config)
+
+        metrics.source.sources[0][1].jira = SyntheticJira(self.core)
+        metrics.source.sources[1][1].jira = BrokenJira()
+
+        self.assertRaises(IOError, metrics.source.work_items)
+
+    def testSourcesNeedNames(self):
+
+        del self.config['source'][1]['name']
+
+        self.assertRaises(MissingConfigItem, source_configs, self.config)
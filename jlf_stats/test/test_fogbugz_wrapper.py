@@ -93,6 +93,12 @@ class TestGetMetrics(unittest.TestCase):
 
         our_fogbugz = FogbugzWrapper(config)
 
+        # We don't connect until we need to
+
+        self.assertFalse(mock_fogbugz.called)
+
+        our_fogbugz.fb
+
         mock_fogbugz.assert_called_with(config['source']['url'], config['source']['token'])
 
     def testGetCasesFromFogBugz(self):
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from jlf_stats import forecast
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+from jlf_stats.metrics import Metrics
+
+import unittest
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+
+class TestForecast(unittest.TestCase):
+
+    def testSteadyThroughput(self):
+        """
+        With the same throughput every week there is nothing to chance
+        """
+
+        weeks = forecast.weeks_to_complete([5, 5, 5], 23, trials=1000, random_state=0)
+        np.testing.assert_array_equal(weeks, np.repeat(5.0, 1000))
+
+        items = forecast.items_completed([5, 5, 5], 4, trials=1000, random_state=0)
+        np.testing.assert_array_equal(items, np.repeat(20, 1000))
+
+    def testSameAsOneTrialAtATime(self):
+
+        throughput = [3, 0, 5, 2, 4, 1, 6, 2, 3, 0, 4, 5]
+
+        random = np.random.RandomState(1)
+        expected = []
+        for trial in range(5000):
+            done = 0
+            weeks = 0
+            while done < 60:
+                done += throughput[random.randint(len(throughput))]
+                weeks += 1
+            expected.append(weeks)
+
+        weeks = forecast.weeks_to_complete(throughput, 60, trials=50000, random_state=2)
+
+        for confidence in [50, 85, 95]:
+            self.assertAlmostEqual(np.percentile(weeks, confidence), np.percentile(expected, confidence), delta=1)
+
+    def testNeverFinishes(self):
+
+        weeks = forecast.weeks_to_complete([0, 0, 1], 10000, trials=100, random_state=0, max_weeks=52)
+
+        self.assertTrue(np.isinf(weeks).all())
+        self.assertTrue(np.isinf(forecast.completion_percentiles(weeks)).all())
+
+        self.assertRaises(ValueError, forecast.weeks_to_complete, [0, 0, 0], 10)
+
+    def testPercentiles(self):
+
+        self.assertEqual(list(forecast.completion_percentiles(np.arange(101), [50, 85])), [50, 85])
+        self.assertEqual(list(forecast.items_percentiles(np.arange(101), [50, 85])), [50, 15])
+
+    def testForecastFromMetrics(self):
+
+        workload = generate(300, seed=4)
+        metrics = Metrics(config=workload.config())
+        metrics.source.jira = SyntheticJira(workload)
+
+        from_date = date(2014, 1, 1)
+        to_date = date(2014, 7, 1)
+
+        when = metrics.forecast(from_date, to_date, items=20, types=['value'], trials=2000, random_state=0)
+
+        self.assertEqual(list(when.index), ['50%', '85%', '95%'])
+        self.assertEqual(sorted(when.columns), ['alpha-value', 'beta-value', 'gamma-value'])
+
+        for swimlane in when.columns:
+            self.assertTrue(when[swimlane].is_monotonic_increasing)
+            self.assertTrue((when[swimlane] > pd.Timestamp(to_date)).all())
+
+        how_many = metrics.forecast(from_date, to_date, until_date=date(2014, 9, 1), trials=2000, random_state=0)
+
+        for swimlane in how_many.columns:
+            self.assertTrue(how_many[swimlane].is_monotonic_decreasing)
+
+        self.assertRaises(ValueError, metrics.forecast, from_date, to_date)
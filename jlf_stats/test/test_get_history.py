@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from jlf_stats.history import cycle_time, time_in_states, arrivals, history_from_jira_changelog, history_from_state_transitions
+from jlf_stats.history import cycle_time, time_in_states, arrivals, history_from_jira_changelog, history_from_state_transitions, cycle_time_from_time_in_states
 from jlf_stats.test.jira_mocks import mockHistory, mockItem, mockChangelog, CREATED_STATE, START_STATE, END_STATE, REOPENED_STATE
 
 import unittest
@@ -330,6 +330,55 @@ class TestIssueHistory(unittest.TestCase):
         actual = history_from_jira_changelog(source, date(2012, 1, 1))
         assert_series_equal(actual, expected)
 
+    def testGetHistoryFromJiraChangeLogFromDate(self):
+        """
+        When we are only reporting on a window the history starts in the state
+        the issue was in at the start of the window
+        """
+
+        source = mockChangelog([mockHistory(u'2012-01-02T09:54:29.284+0000', [mockItem('status', CREATED_STATE, 'queued')]),
+                                mockHistory(u'2012-01-03T09:54:29.284+0000', [mockItem('status', 'queued', START_STATE)]),
+                                mockHistory(u'2012-01-13T09:54:29.284+0000', [mockItem('status', START_STATE, END_STATE)])])
+
+        whole = history_from_jira_changelog(source, date(2012, 1, 1), until_date=date(2012, 1, 20))
+
+        for from_date in [date(2011, 12, 1), date(2012, 1, 2), date(2012, 1, 10), date(2012, 1, 15)]:
+            actual = history_from_jira_changelog(source, date(2012, 1, 1), until_date=date(2012, 1, 20), from_date=from_date)
+            assert_series_equal(actual, whole[[day >= from_date for day in whole.index]])
+
+        actual = history_from_jira_changelog(source, date(2012, 1, 1), until_date=date(2012, 1, 20), from_date=date(2012, 2, 1))
+        self.assertEqual(len(actual), 0)
+
+    def testCycleTimeFromTimeInStates(self):
+        """
+        Cycle times from the time spent in each state are the same as those
+        from the daily history
+        """
+
+        source = mockChangelog([mockHistory(u'2012-01-02T09:54:29.284+0000', [mockItem('status', CREATED_STATE, START_STATE)]),
+                                mockHistory(u'2012-01-05T09:54:29.284+0000', [mockItem('status', START_STATE, 'QA')]),
+                                mockHistory(u'2012-01-07T09:54:29.284+0000', [mockItem('status', 'QA', START_STATE)]),
+                                mockHistory(u'2012-01-07T19:54:29.284+0000', [mockItem('status', START_STATE, 'QA')]),
+                                mockHistory(u'2012-01-13T09:54:29.284+0000', [mockItem('status', 'QA', END_STATE)]),
+                                mockHistory(u'2012-01-15T09:54:29.284+0000', [mockItem('status', END_STATE, REOPENED_STATE)]),
+                                mockHistory(u'2012-01-16T09:54:29.284+0000', [mockItem('status', REOPENED_STATE, END_STATE)])])
+
+        runs = time_in_states(source.histories, date(2012, 1, 1), date(2012, 1, 20))
+        history = history_from_jira_changelog(source, date(2012, 1, 1), date(2012, 1, 20))
+
+        cycles = [{'start_state': START_STATE, 'end_state': END_STATE},
+                  {'start_state': START_STATE, 'end_state': 'QA'},
+                  {'start_state': 'Never', 'end_state': END_STATE},
+                  {'start_state': START_STATE, 'end_state': 'Never'},
+                  {'after_state': CREATED_STATE, 'exit_state': 'QA'},
+                  {'after_state': START_STATE, 'exit_state': END_STATE},
+                  {'start_state': START_STATE, 'end_state': REOPENED_STATE, 'reopened_state': REOPENED_STATE},
+                  {'include_states': [START_STATE, 'QA']},
+                  {'exclude_states': [CREATED_STATE]}]
+
+        for cycle in cycles:
+            self.assertEqual(cycle_time_from_time_in_states(runs, **cycle), cycle_time(history, **cycle), cycle)
+
     def testGetArrivals(self):
         """
         In order to work out the arrival rate we need to be able to get the days a ticket arrived
@@ -407,3 +456,10 @@ class TestIssueHistory(unittest.TestCase):
                                                 dateutil.parser.parse("2015-03-12T10:02:06+00:00").date())
 
         assert_series_equal(actual, expected)
+
+        actual = history_from_state_transitions(date(2015, 2, 25),
+                                                state_transitions,
+                                                date(2015, 3, 12),
+                                                from_date=date(2015, 3, 5))
+
+        assert_series_equal(actual, expected[8:])
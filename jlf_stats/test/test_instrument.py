@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from jlf_stats import instrument
+
+import unittest
+import tempfile
+import json
+import os
+
+
+class TestInstrument(unittest.TestCase):
+
+    def tearDown(self):
+        instrument.disable()
+
+    def testSpansDoNothingWhenDisabled(self):
+
+        with instrument.span('fetch') as fetch:
+            fetch.count('issues', 10)
+
+        self.assertEqual(instrument.spans(), [])
+
+    def testRepeatedSpansAreAddedTogether(self):
+
+        instrument.enable()
+
+        with instrument.span('work items'):
+            for n in range(3):
+                with instrument.span('fetch') as fetch:
+                    fetch.count('issues', 100)
+                    fetch.add_bytes(1024)
+            with instrument.span('history') as history:
+                history.count('days', 7)
+
+        spans = instrument.spans()
+
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], 'work items')
+        self.assertEqual(spans[0]['calls'], 1)
+
+        fetch, history = spans[0]['children']
+
+        self.assertEqual(fetch['name'], 'fetch')
+        self.assertEqual(fetch['calls'], 3)
+        self.assertEqual(fetch['counts'], {'issues': 300})
+        self.assertEqual(fetch['bytes'], 3072)
+        self.assertEqual(history['counts'], {'days': 7})
+
+        for key in ['wall_seconds', 'cpu_seconds', 'peak_rss_kb']:
+            self.assertTrue(fetch[key] >= 0)
+
+    def testWriteTraceAndProfiles(self):
+
+        workspace = tempfile.mkdtemp()
+        profile_dir = os.path.join(workspace, 'profiles')
+        trace_filename = os.path.join(workspace, 'trace.json')
+
+        instrument.enable(profile_dir=profile_dir)
+
+        with instrument.span('publish'):
+            with instrument.span('report:cfd'):
+                sorted(range(1000))
+
+        instrument.write(trace_filename)
+
+        with open(trace_filename) as trace_file:
+            trace = json.load(trace_file)
+
+        self.assertEqual(trace['spans'][0]['children'][0]['name'], 'report:cfd')
+        self.assertEqual(sorted(os.listdir(profile_dir)), ['publish.prof', 'publish.report_cfd.prof'])
@@ -12,8 +12,9 @@ from jlf_stats.bucket import bucket_labels
 from jlf_stats.exceptions import MissingState, MissingConfigItem
 
 from jlf_stats.metrics import Metrics
+from jlf_stats.benchmark.workload import generate, SyntheticJira, Item
 
-from pandas.util.testing import assert_frame_equal
+from pandas.util.testing import assert_frame_equal, assert_series_equal
 
 import mock
 from jlf_stats.test.jira_mocks import mockHistory, mockItem, mockChangelog, START_STATE, END_STATE, CREATED_STATE
@@ -22,8 +23,10 @@ import copy
 import jira.client
 
 import os
+import json
 
 import tempfile
+import shutil
 from dateutil.tz import tzutc
 
 # Shell Mocks to deal with the indirection needed to get us down to the
@@ -660,6 +663,50 @@ class TestGetMetrics(unittest.TestCase):
 
         assert_frame_equal(actual_frame, expected_frame), actual_frame
 
+    def testReportingWindow(self):
+        """
+        Only fetch issues which were still open at the start of the window
+        and only keep their history from then on.  Cycle times still cover
+        the whole life of the issue.
+        """
+
+        jira_config = copy.copy(self.jira_config)
+        jira_config['from_date'] = '2012-01-04'
+        jira_config['until_date'] = '2012-01-08'
+        jira_config['categories'] = {'Reports': 'component = Report ORDER BY created'}
+        jira_config['cycles'] = {'develop': {'start': START_STATE, 'exit': 'pending'}}
+
+        dummy_issues = {'Reports': [MockIssue(key='REPORTS-1',
+                                              resolution_date='2012-01-07',
+                                              project_name='Portal',
+                                              issuetype_name='Data Request',
+                                              created='2012-01-01')]}
+
+        dummy_issues['Reports'][0].changelog = mockChangelog([mockHistory(u'2012-01-01T09:54:29.284+0000', [mockItem('status', 'queued', START_STATE)]),
+                                                              mockHistory(u'2012-01-03T09:54:29.284+0000', [mockItem('status', START_STATE, 'pending')]),
+                                                              mockHistory(u'2012-01-07T09:54:29.284+0000', [mockItem('status', 'pending', END_STATE)])])
+
+        windowed_query = '(component = Report) AND (resolutiondate is EMPTY OR resolutiondate >= "2012-01-04") ORDER BY created'
+
+        self.set_dummy_issues(issues=dummy_issues, queries={windowed_query: 'Reports'}, config={'categories': {}})
+
+        our_jira = Metrics(config=jira_config)
+
+        expected = pd.Series(['pending', 'pending', 'pending', 'Customer Approval'],
+                             index=pd.to_datetime(['2012-01-04',
+                                                   '2012-01-05',
+                                                   '2012-01-06',
+                                                   '2012-01-07']))
+
+        work_item = our_jira.work_item('REPORTS-1')
+
+        assert_series_equal(work_item.history, expected)
+        self.assertEqual(work_item.cycles, {'develop': 6})
+
+        actual_frame = our_jira.history(from_date=date(2012, 1, 5), until_date=date(2012, 1, 7))
+
+        assert_frame_equal(actual_frame, pd.DataFrame({'REPORTS-1': expected[1:4]}))
+
     def testFilterHistoryByType(self):
         """
         To date History, and so CFD are for _all_ issues.  Want to be
@@ -800,7 +847,6 @@ class TestGetMetrics(unittest.TestCase):
 
         assert_frame_equal(actual_frame, expected_frame), actual_frame
 
-    @unittest.skip("WIP - Come back to this after I've refactored the tests.  Not sure this metric is actually useful.")
     def testGetArrivalRate(self):
         """
         What rate does work transition into a specific state?
@@ -838,6 +884,17 @@ class TestGetMetrics(unittest.TestCase):
 
         assert_frame_equal(actual_frame.astype(np.float64), expected_frame), actual_frame
 
+        # Arrivals before from_date are not counted
+
+        expected = {
+            pd.to_datetime('2012-01-02'): {'Customer Approval': np.float64(1)}
+        }
+
+        expected_frame = pd.DataFrame.from_dict(expected, orient='index')
+        actual_frame = our_jira.arrival_rate(date(2012, 1, 2), date(2012, 1, 3))
+
+        assert_frame_equal(actual_frame.astype(np.float64), expected_frame), actual_frame
+
     @unittest.skip("This is hard coded now as only needed on one project")
     def testGetCustomFields(self):
         # To get custom fields you need to know what they are called
@@ -1088,6 +1145,67 @@ class TestGetMetrics(unittest.TestCase):
 
         assert_frame_equal(actual_frame, expected_frame, check_dtype=False), actual_frame
 
+    def testGetMultipleCyclesCycleTime(self):
+        """
+        Get histogram for multiple cycles and types in one go, sharing bucket edges
+        """
+
+        jira_config = copy.copy(self.jira_config)
+        jira_config['categories'] = {'Reports': 'Reports', 'Ops Tools': 'Ops Tools'}
+        jira_config['counts_towards_throughput'] = ''
+        jira_config['cycles'] = {'develop': {'start': START_STATE,
+                                             'end': 'pending'},
+                                 'deliver': {'start': START_STATE,
+                                             'end': 'Customer Approval'}}
+
+        dummy_issues = {
+            'Ops Tools': [MockIssue(key='OPSTOOLS-1',
+                                    resolution_date='2012-11-10',
+                                    project_name='Portal',
+                                    issuetype_name='Defect',
+                                    created='2012-01-01')],
+            'Reports':   [MockIssue(key='REPORTS-1',
+                                    resolution_date='2012-11-10',
+                                    project_name='Portal',
+                                    issuetype_name='Data Request',
+                                    created='2012-01-01'),
+                          MockIssue(key='REPORTS-2',
+                                    resolution_date='2012-11-12',
+                                    project_name='Portal',
+                                    issuetype_name='Improve Feature',
+                                    created='2012-01-01')]
+        }
+
+        dummy_issues['Ops Tools'][0].changelog = mockChangelog([mockHistory(u'2012-01-01T09:54:29.284+0000', [mockItem('status', 'queued', START_STATE)]),
+                                                                mockHistory(u'2012-01-02T09:54:29.284+0000', [mockItem('status', START_STATE, 'pending')]),
+                                                                mockHistory(u'2012-01-03T09:54:29.284+0000', [mockItem('status', 'pending', 'Customer Approval')])])
+
+        dummy_issues['Reports'][0].changelog = mockChangelog([mockHistory(u'2012-01-01T09:54:29.284+0000', [mockItem('status', 'queued', START_STATE)]),
+                                                              mockHistory(u'2012-01-04T09:54:29.284+0000', [mockItem('status', START_STATE, 'pending')]),
+                                                              mockHistory(u'2012-01-07T09:54:29.284+0000', [mockItem('status', 'pending', 'Customer Approval')])])
+
+        dummy_issues['Reports'][1].changelog = mockChangelog([mockHistory(u'2012-01-01T09:54:29.284+0000', [mockItem('status', 'queued', START_STATE)]),
+                                                              mockHistory(u'2012-01-02T09:54:29.284+0000', [mockItem('status', START_STATE, 'pending')])])
+
+        self.set_dummy_issues(issues=dummy_issues, queries=jira_config['categories'], config=jira_config)
+
+        our_jira = Metrics(config=jira_config)
+
+        buckets = [0, 3, 'max']
+
+        actual_frame = our_jira.cycle_time_histogram(cycle=['develop', 'deliver'], types=['value', 'failure'], buckets=buckets)
+
+        expected = [
+            {'bucket': '0-2', 'failure-deliver': 0, 'failure-develop': 1, 'value-deliver': 0, 'value-develop': 1},
+            {'bucket': '3-7', 'failure-deliver': 1, 'failure-develop': 0, 'value-deliver': 1, 'value-develop': 1}
+        ]
+
+        expected_frame = pd.DataFrame(expected).set_index('bucket')
+
+        assert_frame_equal(actual_frame, expected_frame, check_dtype=False), actual_frame
+
+        self.assertEqual(buckets, [0, 3, 'max'])
+
     def testMakeHistogramBucketLabels(self):
         """
         Make histogram bucket labels based on the bin edges used
@@ -1172,6 +1290,12 @@ class TestGetMetrics(unittest.TestCase):
 
         our_jira = JiraWrapper(config=basic_jira_config)
 
+        # We don't connect until we need to
+
+        self.assertFalse(self.mock_jira.JIRA.called)
+
+        our_jira.jira
+
         self.mock_jira.JIRA.assert_called_with({'server': basic_jira_config['source']['server']},
                                                basic_auth=(basic_jira_config['source']['authentication']['username'],
                                                            basic_jira_config['source']['authentication']['password']))
@@ -1207,6 +1331,7 @@ class TestGetMetrics(unittest.TestCase):
             key_cert_data = key_cert_file.read()
 
         our_jira = JiraWrapper(config=oauth_jira_config)
+        our_jira.jira
 
         self.mock_jira.JIRA.assert_called_with({'server': oauth_jira_config['source']['server']},
                                                oauth={'access_token': oauth_jira_config['source']['authentication']['access_token'],
@@ -1285,3 +1410,304 @@ class TestGetMetrics(unittest.TestCase):
         actual = our_metrics.source.state_transition(dummy_history)
 
         self.assertEqual(actual, expected)
+
+    def testBuildWorkItemsFromSearchJSON(self):
+        """
+        Work items built from the search endpoint's JSON are the same as
+        those built from the JIRA client's Resources
+        """
+
+        workload = generate(40, seed=5)
+
+        from_json = Metrics(config=workload.config())
+        from_json.source.jira = SyntheticJira(workload)
+
+        from_resources = Metrics(config=workload.config())
+        from_resources.source.jira = SyntheticJira(workload, resources=True)
+        from_resources.source.ingest = 'resources'
+
+        expected = [json.loads(work_item.to_JSON()) for work_item in from_resources.source.work_items()]
+        actual = [json.loads(work_item.to_JSON()) for work_item in from_json.source.work_items()]
+
+        self.assertEqual(from_json.source.ingest, 'json')
+        self.assertEqual(actual, expected)
+
+    def testChangelogFieldHistory(self):
+        """
+        Changes to other changelog fields, here Flagged, are kept in the
+        same pass as status changes and can be reported on as states are
+        """
+
+        workload = generate(30, seed=3)
+
+        flagged = {}
+
+        for issue in workload.issues:
+
+            histories = issue.changelog.histories
+
+            if len(histories) >= 3:
+                # Flagged at its first status change, cleared at its third
+                histories[-1].items.append(Item('Flagged', None, 'Impediment'))
+                histories[-3].items.append(Item('Flagged', 'Impediment', None))
+                flagged[issue.key] = (datetime.strptime(histories[-1].created[:10], '%Y-%m-%d').date(),
+                                      datetime.strptime(histories[-3].created[:10], '%Y-%m-%d').date())
+
+        config = workload.config()
+        config['changelog_fields'] = ['Flagged']
+
+        from_json = Metrics(config=config)
+        from_json.source.jira = SyntheticJira(workload)
+
+        from_resources = Metrics(config=config)
+        from_resources.source.jira = SyntheticJira(workload, resources=True)
+        from_resources.source.ingest = 'resources'
+
+        expected = [json.loads(work_item.to_JSON()) for work_item in from_resources.source.work_items()]
+        actual = [json.loads(work_item.to_JSON()) for work_item in from_json.source.work_items()]
+
+        self.assertEqual(actual, expected)
+
+        from_json.load(from_json.source.work_items())
+
+        # Status is untouched by the extra items
+
+        plain = Metrics(config=workload.config())
+        plain.source.jira = SyntheticJira(generate(30, seed=3))
+
+        assert_frame_equal(from_json.time_in_state(to_date=workload.until_date),
+                           plain.time_in_state(to_date=workload.until_date))
+
+        blocked = from_json.time_in_state(to_date=workload.until_date, field='Flagged')
+
+        self.assertEqual(list(blocked.columns), ['Impediment'])
+        self.assertEqual(len(blocked), 30)
+
+        for key, (flag, clear) in flagged.items():
+
+            self.assertEqual(blocked.loc[key, 'Impediment'], (clear - flag).days)
+
+            on_day = from_json.state_on(flag, field='Flagged')
+
+            if clear > flag:
+                self.assertEqual(on_day[key], 'Impediment')
+
+            self.assertEqual(from_json.state_on(clear, field='Flagged')[key], None)
+
+        unflagged = [work_item.id for work_item in from_json.work_items if work_item.id not in flagged]
+        self.assertTrue(len(unflagged) > 0)
+        self.assertEqual(blocked.loc[unflagged, 'Impediment'].sum(), 0)
+        self.assertTrue(all([value is None for value in from_json.state_on(workload.until_date, field='Flagged')[unflagged]]))
+
+    def testFallBackToResources(self):
+        """
+        Clients which can't give us JSON get us Resources instead
+        """
+
+        our_jira = Metrics(config=self.jira_config)
+        work_item = our_jira.work_item('OPSTOOLS-1')
+
+        self.assertEqual(our_jira.source.ingest, 'resources')
+        self.assertEqual(work_item.category, "Ops Tools")
+
+    def testCombineCategoriesIntoOneSearch(self):
+        """
+        Searching for every category at once gets the same work items in
+        fewer round trips, with categories we can't evaluate ourselves
+        still searched for on their own
+        """
+
+        categories = ['c{0}'.format(n) for n in range(10)]
+        workload = generate(150, categories=categories, seed=6)
+
+        config = workload.config()
+        config['categories']['bugs'] = "issuetype in (Bug) AND project != c0"
+        config['categories']['recent'] = "project = c1 AND created > -1w"
+
+        separate = Metrics(config=copy.deepcopy(config))
+        separate.source.jira = SyntheticJira(workload)
+
+        config['source']['search'] = 'combined'
+        combined = Metrics(config=config)
+        combined.source.jira = SyntheticJira(workload)
+
+        def by_id_and_category(work_items):
+            return sorted([(work_item.id, work_item.category, work_item.to_JSON()) for work_item in work_items])
+
+        expected = by_id_and_category(separate.source.work_items())
+        actual = by_id_and_category(combined.source.work_items())
+
+        self.assertTrue(len([category for id, category, work_item in actual if category == 'bugs']) > 0)
+        self.assertEqual(actual, expected)
+
+        # 'recent' gets a search of its own either way.  The other eleven
+        # categories take a search each, or two pages of 150 issues combined
+
+        self.assertEqual(separate.source.jira.searches, 12)
+        self.assertEqual(combined.source.jira.searches, 3)
+
+    def testFilterCombinedSearch(self):
+        """
+        A filter applies to every category in a combined search, not just
+        the last
+        """
+
+        workload = generate(90, categories=['alpha', 'beta', 'gamma'], seed=6)
+
+        config = workload.config()
+        config['source']['search'] = 'combined'
+
+        combined = Metrics(config=config)
+        combined.source.jira = SyntheticJira(workload)
+
+        work_items = []
+        combined.source._categories_one_search(' AND issuetype = Bug', work_items)
+
+        bugs = [issue for issue in workload.issues if issue.fields.issuetype.name == 'Bug']
+
+        self.assertTrue(0 < len(bugs) < len(workload.issues))
+        self.assertEqual(sorted([work_item.id for work_item in work_items]), sorted([issue.key for issue in bugs]))
+
+    def testKeysetPaging(self):
+        """
+        Paging by key gets the same work items as paging by offset
+        """
+
+        workload = generate(250, categories=['alpha'], seed=7)
+
+        by_offset = Metrics(config=workload.config())
+        by_offset.source.jira = SyntheticJira(workload)
+
+        config = workload.config()
+        config['source']['paging'] = 'keyset'
+        by_key = Metrics(config=config)
+        by_key.source.jira = SyntheticJira(workload)
+
+        expected = sorted([work_item.to_JSON() for work_item in by_offset.source.work_items()])
+        actual = sorted([work_item.to_JSON() for work_item in by_key.source.work_items()])
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(by_key.source.jira.searches, by_offset.source.jira.searches)
+
+    def testKeysetPagingAcrossProjects(self):
+        """
+        Searches through more than one project are paged by offset, as
+        JIRA only compares keys within a project
+        """
+
+        workload = generate(250, categories=['alpha', 'beta'], seed=7)
+
+        config = workload.config()
+        config['categories']['both'] = "project in (alpha, beta)"
+
+        by_offset = Metrics(config=copy.deepcopy(config))
+        by_offset.source.jira = SyntheticJira(workload)
+
+        expected = sorted([work_item.to_JSON() for work_item in by_offset.source.work_items()])
+
+        config['source']['paging'] = 'keyset'
+
+        for search in ['separate', 'combined']:
+
+            config['source']['search'] = search
+            by_key = Metrics(config=copy.deepcopy(config))
+            by_key.source.jira = SyntheticJira(workload)
+
+            actual = sorted([work_item.to_JSON() for work_item in by_key.source.work_items()])
+
+            self.assertEqual(actual, expected, search)
+
+    def testResumePartitionedCrawl(self):
+        """
+        A crawl in created date partitions which fails part way through
+        picks up where it left off
+        """
+
+        class FailingJira(SyntheticJira):
+
+            def __init__(self, workload, fail_after):
+                SyntheticJira.__init__(self, workload)
+                self.fail_after = fail_after
+
+            def search_issues(self, *args, **kwargs):
+                if self.searches >= self.fail_after:
+                    raise IOError("Connection reset")
+                return SyntheticJira.search_issues(self, *args, **kwargs)
+
+        workload = generate(150, categories=['alpha'], seed=8)
+
+        expected_metrics = Metrics(config=workload.config())
+        expected_metrics.source.jira = SyntheticJira(workload)
+        expected = sorted([work_item.to_JSON() for work_item in expected_metrics.source.work_items()])
+
+        resume = tempfile.mkdtemp()
+
+        try:
+            config = workload.config()
+            config['source']['partition_days'] = 60
+            config['source']['partition_threads'] = 1
+            config['source']['resume'] = resume
+
+            full = Metrics(config=copy.deepcopy(config))
+            full.source.jira = SyntheticJira(workload)
+            self.assertEqual(sorted([work_item.to_JSON() for work_item in full.source.work_items()]), expected)
+            self.assertEqual(os.listdir(resume), [])
+
+            failed = Metrics(config=copy.deepcopy(config))
+            failed.source.jira = FailingJira(workload, 8)
+            self.assertRaises(IOError, failed.source.work_items)
+
+            crawls = os.listdir(resume)
+            self.assertEqual(len(crawls), 1)
+            saved = len(os.listdir(os.path.join(resume, crawls[0])))
+            self.assertEqual(saved, 6)
+
+            resumed = Metrics(config=copy.deepcopy(config))
+            resumed.source.jira = SyntheticJira(workload)
+            actual = sorted([work_item.to_JSON() for work_item in resumed.source.work_items()])
+
+            self.assertEqual(actual, expected)
+            self.assertEqual(resumed.source.jira.searches, full.source.jira.searches - saved)
+            self.assertEqual(os.listdir(resume), [])
+
+        finally:
+            shutil.rmtree(resume)
+
+    def testPartitionThreadsConnectTheirOwnClients(self):
+        """
+        Each thread of a partitioned crawl searches with a client of its
+        own, as a client's session isn't safe to share
+        """
+
+        import threading
+
+        workload = generate(150, categories=['alpha'], seed=8)
+
+        expected_metrics = Metrics(config=workload.config())
+        expected_metrics.source.jira = SyntheticJira(workload)
+        expected = sorted([work_item.to_JSON() for work_item in expected_metrics.source.work_items()])
+
+        used = []
+
+        class ThreadJira(SyntheticJira):
+
+            def __init__(self, *args, **kwargs):
+                SyntheticJira.__init__(self, workload)
+                self.thread = threading.current_thread()
+
+            def search_issues(self, *args, **kwargs):
+                used.append((self, threading.current_thread()))
+                return SyntheticJira.search_issues(self, *args, **kwargs)
+
+        self.mock_jira.JIRA.side_effect = ThreadJira
+
+        config = workload.config()
+        config['source']['partition_days'] = 30
+        config['source']['partition_threads'] = 3
+
+        crawled = Metrics(config=config)
+        actual = sorted([work_item.to_JSON() for work_item in crawled.source.work_items()])
+
+        self.assertEqual(actual, expected)
+        self.assertTrue(all([client.thread is thread for client, thread in used]))
+        self.assertTrue(len(set([client for client, thread in used])) > 1)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.jql import predicate, project, split_order_by, without_order_by, UnsupportedJql
+
+import unittest
+
+
+ISSUE = {'project': ['INF', 'Infrastructure'],
+         'component': ['Build', 'Deploy'],
+         'labels': ['ops'],
+         'epic link': ['INF-250'],
+         'issuetype': ['Bug']}
+
+
+class TestJql(unittest.TestCase):
+
+    def testMatch(self):
+
+        for jql, expected in [("project = INF", True),
+                              ("(project = 'Infrastructure')", True),
+                              ("project = inf AND issuetype = Story", False),
+                              ("project = OPS OR component = build", True),
+                              ("'Epic Link' = INF-250", True),
+                              ('"Epic Link" = INF-251', False),
+                              ("component in (Release, Deploy)", True),
+                              ("component not in (Release, Deploy)", False),
+                              ("labels != ops", False),
+                              ("labels is not EMPTY", True),
+                              ("NOT (project = INF AND labels = ops)", False),
+                              ("project = INF AND (labels = dev OR type = Bug) ORDER BY key ASC", True)]:
+
+            self.assertEqual(predicate(jql)(ISSUE), expected, jql)
+
+    def testEmptyFields(self):
+
+        issue = {'project': ['OPS'], 'component': [], 'labels': [], 'issuetype': ['Task']}
+
+        self.assertTrue(predicate("component is EMPTY")(issue))
+        self.assertFalse(predicate("component != Build")(issue))
+        self.assertFalse(predicate("labels not in (ops)")(issue))
+
+    def testFieldsUsed(self):
+
+        self.assertEqual(predicate("project = INF AND 'Epic Link' = INF-250").fields, set(['project', 'epic link']))
+
+    def testUnsupported(self):
+
+        for jql in ["fixVersion = 1.0",
+                    "project = INF AND created > -1w",
+                    "summary ~ deploy",
+                    "project = INF AND",
+                    "(project = INF",
+                    ""]:
+
+            self.assertRaises(UnsupportedJql, predicate, jql)
+
+    def testWithoutOrderBy(self):
+
+        self.assertEqual(without_order_by("project = INF ORDER BY Rank ASC"), "project = INF")
+        self.assertEqual(without_order_by("project = INF"), "project = INF")
+
+    def testSplitOrderBy(self):
+
+        self.assertEqual(split_order_by("project = INF order by Rank ASC"), ("project = INF", " order by Rank ASC"))
+        self.assertEqual(split_order_by("project = INF"), ("project = INF", ""))
+
+    def testProject(self):
+
+        for jql, expected in [("project = INF", 'inf'),
+                              ("project in (INF) AND (labels = ops OR component = Build)", 'inf'),
+                              ("(project = INF AND labels = ops) OR (project = 'inf' AND type = Bug)", 'inf'),
+                              ("project in (INF, OPS) AND project != OPS", None),
+                              ("project in (INF, OPS) AND project = OPS", 'ops'),
+                              ("project = INF OR project = OPS", None),
+                              ("project = INF OR labels = ops", None),
+                              ("NOT project = INF", None),
+                              ("labels = ops", None),
+                              ("project = INF AND fixVersion = 1.0", None)]:
+
+            self.assertEqual(project(jql), expected, jql)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+from jlf_stats.exceptions import MissingState
+from jlf_stats.history import history_from_state_transitions
+from jlf_stats.matrix import StateMatrix
+from jlf_stats.metrics import Metrics
+from jlf_stats.work import WorkItem
+from jlf_stats import publisher
+
+import unittest
+import copy
+import os
+import shutil
+import tempfile
+from datetime import date, datetime
+
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+
+# Every work item's history walked and windowed, as history did before
+# there was a matrix, to check it against
+
+def scanned_history(metrics, from_date=None, until_date=None, types=None):
+
+    history = {}
+
+    for work_item in metrics.work_items:
+
+        if types is not None:
+            if not any([work_item.type in metrics.types[type_grouping] for type_grouping in types]):
+                continue
+
+        if isinstance(work_item.history, list):
+            history[work_item.id] = history_from_state_transitions(work_item.date_created.date(),
+                                                                   work_item.history,
+                                                                   until_date,
+                                                                   from_date=from_date)
+            continue
+
+        series = work_item.history
+
+        if series is not None and len(series) > 0:
+            if from_date is not None:
+                series = series[series.index >= pd.Timestamp(from_date)]
+            if until_date is not None:
+                series = series[series.index <= pd.Timestamp(until_date)]
+
+        history[work_item.id] = series
+
+    return pd.DataFrame(history)
+
+
+class TestMatrix(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workspace = tempfile.mkdtemp()
+        self.workload = generate(80, categories=['alpha', 'beta'], span_days=200, seed=5)
+
+        self.config = self.workload.config()
+        self.config['states'].append('Open')
+        self.config['location'] = self.workspace
+
+        self.metrics = Metrics(config=copy.deepcopy(self.config))
+        self.metrics.source.jira = SyntheticJira(self.workload)
+        self.metrics.load(self.metrics.source.work_items())
+
+        self.groupings = list(self.config['types'])
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workspace)
+
+    def testHistory(self):
+
+        for from_date, until_date in [(None, None), (date(2013, 3, 4), date(2013, 5, 1)), (date(2012, 1, 1), None)]:
+            for types in [None, self.groupings[:1]]:
+                assert_frame_equal(self.metrics.history(from_date, until_date, types),
+                                   scanned_history(self.metrics, from_date, until_date, types))
+
+    def testStateTransitionHistories(self):
+
+        def transition(day, from_state, to_state):
+            return {'timestamp': datetime(2013, 1, day, 12), 'from': from_state, 'to': to_state}
+
+        work_items = [WorkItem(id='1', title=None, state='Closed', type='Story', category='one',
+                               date_created=datetime(2013, 1, 1),
+                               history=[transition(3, 'Open', 'In Progress'), transition(7, 'In Progress', 'Closed')]),
+                      WorkItem(id='2', title=None, state='Open', type='Bug', category='one',
+                               date_created=datetime(2013, 1, 5),
+                               history=[transition(9, 'Open', 'In Progress')])]
+
+        metrics = Metrics(config=copy.deepcopy(self.config))
+        metrics.load(work_items)
+
+        # Histories made from transitions alone are indexed by date, the
+        # matrix's by day as JIRA histories are
+
+        expected = scanned_history(metrics, date(2013, 1, 1), date(2013, 1, 20))
+        expected.index = pd.DatetimeIndex(expected.index)
+
+        assert_frame_equal(metrics.history(date(2013, 1, 1), date(2013, 1, 20)), expected)
+
+    def testReopen(self):
+
+        self.config['matrix'] = os.path.join(self.workspace, 'matrix')
+
+        metrics = Metrics(config=self.config)
+        metrics.load(self.metrics.work_items)
+
+        built = metrics.matrix()
+        reopened = StateMatrix(self.config['matrix'])
+
+        self.assertEqual(reopened.ids, built.ids)
+        self.assertTrue((reopened.codes == built.codes).all())
+
+        assert_frame_equal(reopened.history(date(2013, 2, 1), date(2013, 4, 1)),
+                           metrics.history(date(2013, 2, 1), date(2013, 4, 1)))
+
+    def testWorkers(self):
+
+        self.config['reports'] = [{'metric': 'throughput', 'types': 'foreach'},
+                                  {'metric': 'cfd', 'types': self.groupings[:1]},
+                                  {'metric': 'demand'},
+                                  {'metric': 'history'}]
+        self.config['name'] = 'reports'
+        self.config['format'] = 'xlsx'
+
+        from_date = date(2013, 2, 4)
+        to_date = date(2013, 6, 3)
+
+        expected = [publisher._report_data(self.config, report, self.metrics, from_date, to_date)
+                    for report in self.config['reports']]
+
+        actual = publisher._in_workers(self.config, self.metrics, from_date, to_date, 2, range(len(expected)))
+
+        self.assertEqual(sorted(actual), range(len(expected)))
+
+        for index, expected_data in enumerate(expected):
+            assert_frame_equal(actual[index], expected_data)
+
+        self.config['workers'] = 2
+
+        publisher.publish(self.config, self.metrics, from_date, to_date)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.workspace, 'reports.xlsx')))
+
+
+    def testWorkersMatrixOnlyForHistory(self):
+
+        self.config['reports'] = [{'metric': 'throughput'}, {'metric': 'demand'}]
+
+        publisher._in_workers(self.config, self.metrics, date(2013, 2, 4), date(2013, 6, 3), 2, [0, 1])
+
+        self.assertTrue(self.metrics._matrix is None)
+
+    def testWorkerErrors(self):
+        """
+        An error in a worker is raised in the publisher, as it would be
+        without workers
+        """
+
+        self.config['states'].remove('QA')
+        self.config['reports'] = [{'metric': 'throughput'}, {'metric': 'cfd'}]
+        self.config['name'] = 'reports'
+        self.config['format'] = 'xlsx'
+        self.config['workers'] = 2
+
+        metrics = Metrics(config=copy.deepcopy(self.config))
+        metrics.load(self.metrics.work_items)
+
+        with self.assertRaises(MissingState) as raised:
+            publisher.publish(self.config, metrics, date(2013, 2, 4), date(2013, 6, 3))
+
+        self.assertEqual(str(raised.exception), "Missing state:QA")
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workspace = tempfile.mkdtemp()
+        self.workload = generate(50, categories=['alpha', 'beta'], span_days=150, seed=8)
+
+        self.config = self.workload.config()
+        self.config['states'].append('Open')
+        self.config['location'] = self.workspace
+        self.config['name'] = 'reports'
+        self.config['format'] = 'xlsx'
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workspace)
+
+    def metrics(self, config):
+
+        metrics = Metrics(config=copy.deepcopy(config))
+        metrics.source.jira = SyntheticJira(self.workload)
+        metrics.load(metrics.source.work_items())
+
+        return metrics
+
+    def testSameWithinBudget(self):
+
+        unbounded = self.metrics(self.config)
+
+        # A few days of the matrix at a time
+
+        self.config['memory_budget'] = 0.002
+
+        bounded = self.metrics(self.config)
+
+        self.assertTrue((bounded.matrix().codes == unbounded.matrix().codes).all())
+
+        for from_date, until_date in [(None, None), (date(2013, 3, 4), date(2013, 5, 1))]:
+
+            chunks = list(bounded.history_chunks(from_date, until_date))
+
+            self.assertTrue(len(chunks) > 1)
+            self.assertTrue(all([len(chunk.index) <= 20 for chunk in chunks]))
+
+            assert_frame_equal(bounded.history(from_date, until_date), unbounded.history(from_date, until_date))
+            assert_frame_equal(pd.concat(chunks), unbounded.history(from_date, until_date))
+
+        self.assertEqual(list(bounded.history_chunks(date(2010, 1, 1), date(2010, 2, 1))), [])
+        assert_frame_equal(bounded.history(date(2010, 1, 1), date(2010, 2, 1)),
+                           unbounded.history(date(2010, 1, 1), date(2010, 2, 1)))
+
+    def testStreamedHistoryReport(self):
+
+        self.config['reports'] = [{'metric': 'history', 'description': 'Every day of every work item'}]
+
+        from_date = date(2013, 2, 4)
+        to_date = date(2013, 6, 3)
+
+        publisher.publish(self.config, self.metrics(self.config), from_date, to_date)
+        expected = pd.read_excel(os.path.join(self.workspace, 'reports.xlsx'), sheet_name=None)
+
+        self.config['memory_budget'] = 0.002
+        self.config['name'] = 'streamed'
+
+        publisher.publish(self.config, self.metrics(self.config), from_date, to_date)
+        actual = pd.read_excel(os.path.join(self.workspace, 'streamed.xlsx'), sheet_name=None)
+
+        self.assertEqual(sorted(actual), sorted(expected))
+
+        for name in expected:
+            assert_frame_equal(actual[name], expected[name])
@@ -368,6 +368,216 @@ class TestGetOutput(unittest.TestCase):
 
         # This isn't finished
 
+    def testOutputForecastToExcel(self):
+
+        self.mock_metrics.forecast.return_value = pd.DataFrame({'value': [10, 7, 5]},
+                                                               index=['50%', '85%', '95%'])
+
+        report_config = {'name':     'reports',
+                         'types':    {'value': ['Story'], 'failure': ['Bug']},
+                         'reports':  [{'metric': 'forecast', 'types': ['value'], 'until': '2013-01-07'}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.forecast.assert_called_with(date(2012, 10, 8),
+                                                      date(2012, 11, 12),
+                                                      items=None,
+                                                      until_date=date(2013, 1, 7),
+                                                      types=['value'],
+                                                      confidence=None,
+                                                      trials=100000)
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('value-forecast')
+
+        self.assertEqual(worksheet.col_values(1), ['value', 10, 7, 5])
+
+    def testOutputCycleTimePercentilesToExcel(self):
+
+        self.mock_metrics.cycle_time_percentiles.return_value = pd.DataFrame({'50%': [3], '85%': [8], '95%': [13], 'count': [40]},
+                                                                             index=['develop'],
+                                                                             columns=['50%', '85%', '95%', 'count'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'cycle-time-percentiles', 'cycles': ['develop']}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.cycle_time_percentiles.assert_called_with(['develop'],
+                                                                    types=None,
+                                                                    from_date=date(2012, 10, 8),
+                                                                    to_date=date(2012, 11, 12),
+                                                                    percentiles=None)
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_index(0)
+
+        self.assertEqual(worksheet.row_values(1), ['develop', 3, 8, 13, 40])
+
+    def testOutputAgingToExcel(self):
+
+        self.mock_metrics.aging.return_value = pd.DataFrame({'state': ['QA'], 'deliver age': [5], 'deliver percentile': [50.0]},
+                                                            index=['ONE-3'],
+                                                            columns=['state', 'deliver age', 'deliver percentile'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'aging', 'cycles': ['deliver']}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.aging.assert_called_with(['deliver'], types=None, as_of=date(2012, 11, 12))
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('aging')
+
+        self.assertEqual(worksheet.row_values(1), ['ONE-3', 'QA', 5, 50])
+
+    def testForeachTypes(self):
+
+        self.mock_metrics.aging.return_value = pd.DataFrame({'state': ['QA']}, index=['ONE-3'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'aging', 'cycles': ['deliver'], 'types': 'foreach'}],
+                         'format':   'xlsx',
+                         'location': self.workspace,
+                         'types':    {'failure': ['Bug'], 'value': ['Story']}}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.aging.assert_called_with(['deliver'],
+                                                   types=list(report_config['types']),
+                                                   as_of=date(2012, 11, 12))
+
+    def testOutputDoneToExcel(self):
+
+        self.mock_metrics.done.return_value = pd.DataFrame({'swimlane': ['one-value'], 'deliver': [10]},
+                                                           index=pd.Index(['ONE-1'], name='id'),
+                                                           columns=['swimlane', 'deliver'])
+
+        report_config = {'name':     'reports',
+                         'types':    {'value': ['Story'], 'failure': ['Bug']},
+                         'reports':  [{'metric': 'done', 'categories': 'foreach', 'types': 'foreach', 'sort': 'week-done'}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        args, kwargs = self.mock_metrics.done.call_args
+        self.assertEqual(args, (date(2012, 10, 8), date(2012, 11, 12)))
+        self.assertEqual(sorted(kwargs['types']), ['failure', 'value'])
+        self.assertEqual(kwargs['sort'], 'week-done')
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('done')
+
+        self.assertEqual(worksheet.row_values(1), ['ONE-1', 'one-value', 10])
+
+    def testOutputFlowEfficiencyToExcel(self):
+
+        self.mock_metrics.flow_efficiency.return_value = pd.DataFrame({'items': [2], 'efficiency': [0.5]},
+                                                                      index=pd.DatetimeIndex(['2012-11-12'], name='week'),
+                                                                      columns=['items', 'efficiency'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'flow-efficiency', 'active': ['In Progress'], 'wait': ['Blocked']}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.flow_efficiency.assert_called_with(['In Progress'],
+                                                             ['Blocked'],
+                                                             from_date=date(2012, 10, 8),
+                                                             to_date=date(2012, 11, 12),
+                                                             types=None,
+                                                             by='week',
+                                                             percentiles=None)
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('flow-efficiency')
+
+        self.assertEqual(worksheet.row_values(1)[1:], [2, 0.5])
+
+    def testOutputTimeInStateToExcel(self):
+
+        self.mock_metrics.time_in_state.return_value = pd.DataFrame({'In Progress': [5], 'QA': [2]},
+                                                                    index=pd.Index(['ONE-1'], name='id'),
+                                                                    columns=['In Progress', 'QA'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'time-in-state'}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.time_in_state.assert_called_with(from_date=date(2012, 10, 8),
+                                                           to_date=date(2012, 11, 12),
+                                                           types=None,
+                                                           summary=False,
+                                                           percentiles=None,
+                                                           field=None)
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('time-in-state')
+
+        self.assertEqual(worksheet.row_values(0), ['id', 'In Progress', 'QA'])
+        self.assertEqual(worksheet.row_values(1), ['ONE-1', 5, 2])
+
+    def testOutputSnapshotToExcel(self):
+
+        self.mock_metrics.snapshot.return_value = pd.DataFrame({'Open': [3, 1], 'Closed': [0, 2]},
+                                                               index=pd.DatetimeIndex(['2012-10-01', '2012-11-01'], name='date'),
+                                                               columns=['Open', 'Closed'])
+
+        report_config = {'name':     'reports',
+                         'reports':  [{'metric': 'snapshot', 'dates': ['2012-10-01', '2012-11-01']}],
+                         'format':   'xlsx',
+                         'location': self.workspace}
+
+        publisher.publish(report_config,
+                          self.mock_metrics,
+                          from_date=date(2012, 10, 8),
+                          to_date=date(2012, 11, 12))
+
+        self.mock_metrics.snapshot.assert_called_with([date(2012, 10, 1), date(2012, 11, 1)],
+                                                      types=None,
+                                                      field=None,
+                                                      detail=False)
+
+        workbook = xlrd.open_workbook(os.path.join(self.workspace, 'reports.xlsx'))
+        worksheet = workbook.sheet_by_name('snapshot')
+
+        self.assertEqual(worksheet.row_values(0), ['date', 'Open', 'Closed'])
+        self.assertEqual(worksheet.row_values(2)[1:], [1, 2])
+
     def testGetDefaultColours(self):
         """
         If a cfd report doesn't specify formats for the states then use the defaults
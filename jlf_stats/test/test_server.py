@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+from jlf_stats.metrics import Metrics
+from jlf_stats import server
+
+import unittest
+import threading
+import mock
+import urllib2
+import json
+from datetime import date
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workload = generate(60, seed=1)
+        self.metrics = Metrics(config=self.workload.config())
+        self.metrics.source.jira = SyntheticJira(self.workload)
+
+        self.service = server.MetricsService(self.metrics)
+        self.service.refresh()
+
+        self.server = server.MetricsServer(('127.0.0.1', 0), self.service, quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+
+        url = 'http://127.0.0.1:{0}{1}'.format(self.server.server_port, path)
+
+        try:
+            response = urllib2.urlopen(url)
+            return response.getcode(), json.loads(response.read())
+        except urllib2.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    def testServesMetrics(self):
+
+        code, throughput = self.get('/throughput?from_date=2014-06-01&to_date=2014-09-01&types=failure')
+
+        expected = self.metrics.throughput(date(2014, 6, 1), date(2014, 9, 1), types=['failure'])
+
+        self.assertEqual(code, 200)
+        self.assertEqual(throughput, json.loads(server.to_json(expected)))
+
+        code, histogram = self.get('/cycle_time_histogram?cycle=develop,deliver&buckets=0,5,10,max')
+
+        self.assertEqual(code, 200)
+        self.assertEqual(histogram['columns'], ['deliver', 'develop'])
+        self.assertEqual(histogram['index'][0], '0-4')
+
+        for metric in ['cfd', 'demand', 'arrival_rate', 'details?fields=id,type']:
+            code, data = self.get('/' + metric)
+            self.assertEqual(code, 200, metric)
+
+    def testBadRequests(self):
+
+        self.assertEqual(self.get('/velocity')[0], 404)
+        self.assertEqual(self.get('/cycle_time_histogram')[0], 400)
+        self.assertEqual(self.get('/cfd?from_date=yesterday')[0], 400)
+
+    def testRefreshInvalidatesCache(self):
+
+        self.get('/details')
+        self.get('/details')
+
+        code, status = self.get('/status')
+        self.assertEqual(status['cached'], 1)
+        self.assertEqual(status['work_items'], 60)
+
+        bigger = generate(80, seed=2)
+        self.metrics.source.jira = SyntheticJira(bigger)
+        self.service.refresh()
+
+        code, status = self.get('/status')
+        self.assertEqual(status['cached'], 0)
+        self.assertEqual(status['work_items'], 80)
+
+        code, details = self.get('/details?fields=id')
+        self.assertEqual(len(details['data']), 80)
+
+    def testRequestsRunSideBySide(self):
+
+        started = threading.Event()
+        finished = threading.Event()
+        waited = []
+
+        def slow(metrics, params):
+            started.set()
+            waited.append(finished.wait(5))
+            return None
+
+        def quick(metrics, params):
+            finished.set()
+            return None
+
+        with mock.patch.dict(server.ENDPOINTS, {'slow': slow, 'quick': quick}):
+
+            request = threading.Thread(target=self.get, args=('/slow',))
+            request.start()
+
+            started.wait(5)
+            self.assertEqual(self.get('/quick'), (200, None))
+
+            request.join()
+
+        # The quick request was answered while the slow one was waiting
+
+        self.assertEqual(waited, [True])
+
+    def testRefreshFailureKeepsWorkItems(self):
+
+        stop = threading.Event()
+
+        def fail():
+            stop.set()
+            raise IOError("Connection reset")
+
+        self.metrics.source.refresh = fail
+
+        with mock.patch('sys.stderr'):
+            self.service.refresh_every(0, stop)
+
+        code, status = self.get('/status')
+        self.assertTrue('Connection reset' in status['refresh_error'])
+        self.assertEqual(status['work_items'], 60)
+
+    def testRefreshWarmsWhatRequestsShare(self):
+
+        metrics = self.service.metrics
+
+        self.assertTrue(metrics._transitions is not None)
+        self.assertTrue(metrics._cube is not None)
+        self.assertTrue(metrics._sketches is not None)
+        self.assertTrue(None in metrics._interval_indexes)
+
+
+class TestServe(unittest.TestCase):
+
+    def testServe(self):
+
+        workload = generate(30, seed=3)
+        metrics = Metrics(config=workload.config())
+        metrics.source.jira = SyntheticJira(workload)
+
+        started = []
+        MetricsServer = server.MetricsServer
+
+        class StartedServer(MetricsServer):
+
+            def serve_forever(self):
+                started.append(self)
+                MetricsServer.serve_forever(self)
+
+        with mock.patch.object(server, 'MetricsServer', StartedServer):
+
+            thread = threading.Thread(target=server.serve, args=(metrics,), kwargs={'port': 0})
+            thread.daemon = True
+
+            with mock.patch('sys.stdout'):
+                thread.start()
+
+                while len(started) == 0 and thread.is_alive():
+                    thread.join(0.05)
+
+            self.assertEqual(len(started), 1)
+
+            try:
+                url = 'http://127.0.0.1:{0}/status'.format(started[0].server_port)
+                status = json.loads(urllib2.urlopen(url).read())
+            finally:
+                started[0].shutdown()
+                thread.join(5)
+
+        self.assertEqual(status['work_items'], 30)
+        self.assertFalse(thread.is_alive())
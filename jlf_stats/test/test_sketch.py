@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.sketch import QuantileSketch, SketchStore
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+from jlf_stats.metrics import Metrics
+
+import unittest
+import math
+from datetime import date
+
+import numpy as np
+
+
+def nearest_rank(values, percentile):
+
+    values = sorted(values)
+    rank = max(int(math.ceil(percentile / 100.0 * len(values))), 1)
+
+    return values[rank - 1]
+
+
+class TestSketch(unittest.TestCase):
+
+    def testQuantiles(self):
+
+        values = np.random.RandomState(0).randint(0, 90, size=1001)
+
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+
+        self.assertEqual(len(sketch), 1001)
+        self.assertEqual(sketch.quantiles([0, 50, 85, 95, 100]),
+                         [nearest_rank(values, p) for p in [0, 50, 85, 95, 100]])
+
+        self.assertEqual(QuantileSketch().quantiles([50, 85]), [None, None])
+
+    def testMergeIsUnion(self):
+
+        random = np.random.RandomState(1)
+        left = random.randint(0, 30, size=200)
+        right = random.randint(10, 60, size=50)
+
+        merged = QuantileSketch([(v, 1) for v in left]).merge(QuantileSketch([(v, 1) for v in right]))
+
+        self.assertEqual(merged.to_list(), QuantileSketch([(v, 1) for v in np.concatenate([left, right])]).to_list())
+
+    def testQueryAndMergeStore(self):
+
+        store = SketchStore()
+        store.add('one', 'Story', 'develop', 100, 3)
+        store.add('one', 'Bug', 'develop', 107, 5)
+        store.add('two', 'Story', 'develop', 107, 8)
+        store.add('two', 'Story', 'deliver', 107, 13)
+
+        self.assertEqual(store.query('develop').to_list(), [(3, 1), (5, 1), (8, 1)])
+        self.assertEqual(store.query('develop', categories=['two']).to_list(), [(8, 1)])
+        self.assertEqual(store.query('develop', issue_types=['Story']).to_list(), [(3, 1), (8, 1)])
+        self.assertEqual(store.query('develop', from_week=107).to_list(), [(5, 1), (8, 1)])
+        self.assertEqual(store.query('develop', to_week=100).to_list(), [(3, 1)])
+
+        other = SketchStore()
+        other.add('two', 'Story', 'deliver', 107, 13)
+        other.add('three', 'Story', 'deliver', 114, 21)
+
+        merged = SketchStore().merge(store).merge(other)
+        self.assertEqual(len(merged), 5)
+        self.assertEqual(merged.query('deliver').to_list(), [(13, 2), (21, 1)])
+
+    def testPercentilesFromMetrics(self):
+
+        workload = generate(200, seed=5)
+        metrics = Metrics(config=workload.config())
+        metrics.source.jira = SyntheticJira(workload)
+
+        actual = metrics.cycle_time_percentiles('develop', percentiles=[50, 85, 95])
+
+        finished = [work_item.cycles['develop'] for work_item in metrics.work_items
+                    if work_item.state in metrics.counts_towards_throughput
+                    and work_item.cycles.get('develop') is not None]
+
+        self.assertEqual(list(actual.columns), ['50%', '85%', '95%', 'count'])
+        self.assertEqual(actual.loc['develop', 'count'], len(finished))
+
+        for p in [50, 85, 95]:
+            self.assertEqual(actual.loc['develop', '{0}%'.format(p)], nearest_rank(finished, p))
+
+        windowed = metrics.cycle_time_percentiles('develop', from_date=date(2014, 1, 1), to_date=date(2014, 7, 1))
+        self.assertTrue(0 < windowed.loc['develop', 'count'] < len(finished))
+
+        by_type = metrics.cycle_time_percentiles(['develop'], types=['value', 'failure', 'overhead'])
+        self.assertEqual(list(by_type.index), ['failure-develop', 'overhead-develop', 'value-develop'])
+        self.assertEqual(by_type['count'].sum(), len(finished))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.timestamps import parse_timestamp, parse_date, daily_index
+
+import unittest
+from datetime import date, datetime
+
+import dateutil.parser
+import pandas as pd
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def testSameAsDateutil(self):
+
+        for text in [u'2012-11-12T09:54:29.284+0000',
+                     u'2012-11-12T09:54:29.284-0500',
+                     u'2012-11-12T09:54:29.2841234+0530',
+                     u'2012-11-12T23:54:29.284+01:00',
+                     '2015-02-26T10:02:06Z',
+                     '2015-02-26T10:02:06+00:00',
+                     '2015-02-26T10:02:06',
+                     '2015-02-26 10:02',
+                     '26 Feb 2015 10:02:06 GMT']:
+
+            actual = parse_timestamp(text)
+            expected = dateutil.parser.parse(text)
+
+            self.assertEqual(actual, expected, text)
+            self.assertEqual(actual.utcoffset(), expected.utcoffset(), text)
+
+    def testParseDate(self):
+
+        self.assertEqual(parse_date(u'2012-11-12T23:54:29.284-0500'), date(2012, 11, 12))
+        self.assertEqual(parse_date('2012-02-29'), date(2012, 2, 29))
+        self.assertRaises(ValueError, parse_date, '2013-02-29')
+
+    def testDailyIndex(self):
+
+        self.assertEqual(daily_index(date(2012, 2, 28), 3), [date(2012, 2, 28), date(2012, 2, 29), date(2012, 3, 1)])
+
+        actual = daily_index(datetime(2012, 2, 28, 12), 3)
+        expected = pd.Series(range(3), index=[datetime(2012, 2, 28, 12), datetime(2012, 2, 29, 12), datetime(2012, 3, 1, 12)]).index
+
+        self.assertTrue(actual.equals(expected))
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+from jlf_stats.transitions import Transitions, IntervalIndex, weekly_arrivals, day_number, day_date, week_ending_monday, week_starting_monday, state_intervals
+from jlf_stats.work import WorkItem
+from jlf_stats.metrics import Metrics
+from jlf_stats.benchmark.workload import generate, SyntheticJira
+
+import unittest
+from datetime import date
+import dateutil.parser
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+
+def transition(timestamp, from_state, to_state):
+
+    return {'from': from_state,
+            'to': to_state,
+            'timestamp': dateutil.parser.parse(timestamp)}
+
+
+class TestTransitions(unittest.TestCase):
+
+    def setUp(self):
+
+        self.work_items = [WorkItem(id='ONE-1',
+                                    title=None,
+                                    state='Closed',
+                                    type='Bug',
+                                    history=None,
+                                    date_created=dateutil.parser.parse('2015-02-24T09:48:31Z'),
+                                    state_transitions=[transition('2015-02-24T09:48:31Z', 'Open', 'In Progress'),
+                                                       None,
+                                                       transition('2015-03-03T09:48:31Z', 'In Progress', 'Closed')]),
+                           WorkItem(id='1823',
+                                    title=None,
+                                    state='Active',
+                                    type='Feature',
+                                    date_created=dateutil.parser.parse('2015-02-24T09:48:31Z'),
+                                    history=[transition('2015-02-26T09:48:31Z', 'Open', 'Active')])]
+
+    def metrics_config(self):
+
+        return {'source': {'type': 'jira',
+                           'server': 'https://jira.example.com',
+                           'authentication': {'username': 'user', 'password': 'password'}},
+                'categories': {'one': "project = 'ONE'"},
+                'types': {'failure': ['Bug'], 'value': ['Story']},
+                'counts_towards_throughput': ['Closed'],
+                'cycles': {'deliver': {'start': 'In Progress', 'end': 'Closed'}}}
+
+    def testGetTransitionsFromWorkItems(self):
+        """
+        JIRA and FogBugz work items keep their transitions in different places
+        """
+
+        actual = Transitions.from_work_items(self.work_items, states=['Open', 'Active', 'In Progress', 'Closed', None])
+
+        self.assertEqual(actual.states, ['Open', 'Active', 'In Progress', 'Closed'])
+        self.assertEqual(actual.ids, ['ONE-1', '1823'])
+        self.assertEqual(actual.item.tolist(), [0, 0, 1])
+        self.assertEqual(actual.day.tolist(), [day_number(date(2015, 2, 24)),
+                                               day_number(date(2015, 3, 3)),
+                                               day_number(date(2015, 2, 26))])
+        self.assertEqual(actual.from_state.tolist(), [0, 2, 0])
+        self.assertEqual(actual.to_state.tolist(), [2, 3, 1])
+
+    def testWeekEndingMonday(self):
+
+        days = np.array([day_number(date(2015, 3, 1)),
+                         day_number(date(2015, 3, 2)),
+                         day_number(date(2015, 3, 3))])
+
+        expected = [day_number(date(2015, 3, 2)),
+                    day_number(date(2015, 3, 2)),
+                    day_number(date(2015, 3, 9))]
+
+        self.assertEqual(week_ending_monday(days).tolist(), expected)
+
+    def testGetWeeklyArrivals(self):
+
+        transitions = Transitions.from_work_items(self.work_items)
+
+        expected = pd.DataFrame({'In Progress': [1, 0], 'Active': [1, 0], 'Closed': [0, 1]},
+                                index=pd.to_datetime(['2015-03-02', '2015-03-09']),
+                                columns=['In Progress', 'Closed', 'Active'])
+
+        actual = weekly_arrivals(transitions)
+
+        assert_frame_equal(actual, expected)
+
+    def testGetWeeklyArrivalsInWindow(self):
+
+        transitions = Transitions.from_work_items(self.work_items)
+
+        expected = pd.DataFrame({'Active': [1]},
+                                index=pd.to_datetime(['2015-03-02']))
+
+        actual = weekly_arrivals(transitions, from_date=date(2015, 2, 25), to_date=date(2015, 3, 2))
+
+        assert_frame_equal(actual, expected)
+
+    def testAging(self):
+
+        def work_item(id, state, created, transitions, cycle_time=None):
+            return WorkItem(id=id,
+                            title=None,
+                            state=state,
+                            type='Story',
+                            history=None,
+                            category='one',
+                            date_created=dateutil.parser.parse(created),
+                            state_transitions=transitions,
+                            cycles={'deliver': cycle_time})
+
+        metrics = Metrics(config=self.metrics_config())
+        metrics.load([work_item('ONE-1', 'Closed', '2015-02-02T09:00:00Z',
+                                [transition('2015-02-06T09:00:00Z', 'In Progress', 'Closed'),
+                                 transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')], 5),
+                      work_item('ONE-2', 'Closed', '2015-02-02T09:00:00Z',
+                                [transition('2015-02-11T09:00:00Z', 'In Progress', 'Closed'),
+                                 transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')], 10),
+                      work_item('ONE-3', 'QA', '2015-02-24T09:00:00Z',
+                                [transition('2015-03-05T09:00:00Z', 'In Progress', 'QA'),
+                                 transition('2015-03-02T09:00:00Z', 'Open', 'In Progress')]),
+                      work_item('ONE-4', 'Open', '2015-03-05T09:00:00Z', [])])
+
+        actual = metrics.aging('deliver', as_of=date(2015, 3, 6))
+
+        self.assertEqual(list(actual.index), ['ONE-3', 'ONE-4'])
+        self.assertEqual(list(actual['state']), ['QA', 'Open'])
+        self.assertEqual(list(actual['days in state']), [2, 2])
+        self.assertEqual(actual.loc['ONE-3', 'deliver age'], 5)
+        self.assertEqual(actual.loc['ONE-3', 'deliver percentile'], 50)
+        self.assertTrue(np.isnan(actual.loc['ONE-4', 'deliver age']))
+        self.assertTrue(np.isnan(actual.loc['ONE-4', 'deliver percentile']))
+
+        self.assertEqual(metrics.aging('deliver', types=['failure'], as_of=date(2015, 3, 6)), None)
+
+    def testDone(self):
+
+        metrics = Metrics(config=self.metrics_config())
+        metrics.load([WorkItem(id='ONE-1', title='First', state='Closed', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-02T09:00:00Z'),
+                               state_transitions=[transition('2015-02-11T09:00:00Z', 'In Progress', 'Closed'),
+                                                  transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')],
+                               cycles={'deliver': 10}),
+                      WorkItem(id='ONE-2', title='Second', state='Closed', type='Bug', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-02T09:00:00Z'),
+                               state_transitions=[transition('2015-02-06T09:00:00Z', 'In Progress', 'Closed'),
+                                                  transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')],
+                               cycles={'deliver': 5}),
+                      WorkItem(id='ONE-3', title='Third', state='In Progress', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-02T09:00:00Z'),
+                               state_transitions=[transition('2015-02-10T09:00:00Z', 'Closed', 'In Progress'),
+                                                  transition('2015-02-06T09:00:00Z', 'In Progress', 'Closed')],
+                               cycles={'deliver': 5})])
+
+        actual = metrics.done(types=['value', 'failure'])
+
+        self.assertEqual(list(actual.index), ['ONE-2', 'ONE-1'])
+        self.assertEqual(list(actual['swimlane']), ['one-failure', 'one-value'])
+        self.assertEqual(list(actual['date-done']), [pd.Timestamp('2015-02-06'), pd.Timestamp('2015-02-11')])
+        self.assertEqual(list(actual['week-done']), [pd.Timestamp('2015-02-02'), pd.Timestamp('2015-02-09')])
+        self.assertEqual(list(actual['deliver']), [5, 10])
+
+        self.assertEqual(list(metrics.done(sort='deliver', from_date=date(2015, 2, 7)).index), ['ONE-1'])
+        self.assertEqual(metrics.done(types=['failure'], to_date=date(2015, 2, 5)), None)
+
+    def testWeekStartingMonday(self):
+
+        days = np.array([day_number(date(2015, 3, 1)), day_number(date(2015, 3, 2)), day_number(date(2015, 3, 8))])
+
+        self.assertEqual([day_date(day) for day in week_starting_monday(days)],
+                         [date(2015, 2, 23), date(2015, 3, 2), date(2015, 3, 2)])
+
+    def testStateIntervals(self):
+
+        work_items = self.work_items + [WorkItem(id='2',
+                                                 title=None,
+                                                 state='Open',
+                                                 type='Feature',
+                                                 date_created=dateutil.parser.parse('2015-02-27T09:48:31Z'),
+                                                 history=[])]
+
+        transitions = Transitions.from_work_items(work_items, states=['Open', 'Active', 'In Progress', 'Closed'])
+
+        created = np.array([day_number(date(2015, 2, 24)), day_number(date(2015, 2, 24)), day_number(date(2015, 2, 27))])
+        current = np.array([3, 1, 0])
+
+        item, state, start, end = state_intervals(transitions, created, current, day_number(date(2015, 3, 1)))
+
+        actual = sorted(zip(item, [transitions.states[code] for code in state],
+                            [day_date(day) for day in start], [day_date(day) for day in end]))
+
+        self.assertEqual(actual, sorted([(0, 'Open', date(2015, 2, 24), date(2015, 2, 24)),
+                                         (0, 'In Progress', date(2015, 2, 24), date(2015, 3, 1)),
+                                         (0, 'Closed', date(2015, 3, 3), date(2015, 3, 3)),
+                                         (1, 'Open', date(2015, 2, 24), date(2015, 2, 26)),
+                                         (1, 'Active', date(2015, 2, 26), date(2015, 3, 1)),
+                                         (2, 'Open', date(2015, 2, 27), date(2015, 3, 1))]))
+
+    def testFlowEfficiency(self):
+
+        def work_item(id, transitions):
+            return WorkItem(id=id, title=None, state='Closed', type='Story', history=None, category='one',
+                            date_created=dateutil.parser.parse('2015-02-02T08:00:00Z'),
+                            state_transitions=transitions[::-1])
+
+        metrics = Metrics(config=self.metrics_config())
+        metrics.load([work_item('ONE-1', [transition('2015-02-02T09:00:00Z', 'Open', 'In Progress'),
+                                          transition('2015-02-05T09:00:00Z', 'In Progress', 'QA'),
+                                          transition('2015-02-07T09:00:00Z', 'QA', 'In Progress'),
+                                          transition('2015-02-09T09:00:00Z', 'In Progress', 'Closed')]),
+                      work_item('ONE-2', [transition('2015-02-03T09:00:00Z', 'Open', 'In Progress'),
+                                          transition('2015-02-04T09:00:00Z', 'In Progress', 'QA'),
+                                          transition('2015-02-04T10:00:00Z', 'QA', 'Blocked'),
+                                          transition('2015-02-04T11:00:00Z', 'Blocked', 'QA'),
+                                          transition('2015-02-09T09:00:00Z', 'QA', 'Closed')])])
+
+        by_item = metrics.flow_efficiency(['In Progress'], ['QA', 'Blocked'], to_date=date(2015, 2, 28), by='item')
+
+        self.assertEqual(list(by_item['active days']), [5, 1])
+        self.assertEqual(list(by_item['wait days']), [2, 5])
+        self.assertEqual(list(by_item['efficiency']), [5 / 7.0, 1 / 6.0])
+
+        by_week = metrics.flow_efficiency(['In Progress'], ['QA', 'Blocked'], to_date=date(2015, 2, 28), percentiles=[50, 95])
+
+        self.assertEqual(list(by_week.index), [pd.Timestamp('2015-02-09')])
+        self.assertEqual(list(by_week.loc['2015-02-09']), [2, 6, 7, 6 / 13.0, 1 / 6.0, 5 / 7.0])
+
+    def testTimeInState(self):
+
+        config = self.metrics_config()
+        config['states'] = ['Open', 'In Progress', 'QA', 'Closed']
+
+        metrics = Metrics(config=config)
+        metrics.load([WorkItem(id='ONE-1', title=None, state='Closed', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-01T08:00:00Z'),
+                               state_transitions=[transition('2015-02-09T09:00:00Z', 'In Progress', 'Closed'),
+                                                  transition('2015-02-07T09:00:00Z', 'QA', 'In Progress'),
+                                                  transition('2015-02-05T09:00:00Z', 'In Progress', 'QA'),
+                                                  transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')]),
+                      WorkItem(id='ONE-2', title=None, state='QA', type='Bug', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-02T08:00:00Z'),
+                               state_transitions=[transition('2015-02-10T09:00:00Z', 'In Progress', 'QA'),
+                                                  transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')]),
+                      WorkItem(id='ONE-3', title=None, state='Open', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-10T08:00:00Z'),
+                               state_transitions=[])])
+
+        actual = metrics.time_in_state(to_date=date(2015, 2, 12))
+
+        self.assertEqual(list(actual.columns), ['Open', 'In Progress', 'QA', 'Closed'])
+        self.assertEqual(actual.loc['ONE-1'].tolist(), [1, 5, 2, 3])
+        self.assertEqual(actual.loc['ONE-2'].tolist(), [0, 8, 2, 0])
+        self.assertEqual(actual.loc['ONE-3'].tolist(), [2, 0, 0, 0])
+
+        summary = metrics.time_in_state(to_date=date(2015, 2, 12), summary=True, percentiles=[50, 100])
+
+        self.assertEqual(summary['items'].tolist(), [2, 2, 2, 1])
+        self.assertEqual(summary['50%'].tolist(), [1, 5, 2, 3])
+        self.assertEqual(summary['100%'].tolist(), [2, 8, 2, 3])
+
+        self.assertEqual(list(metrics.time_in_state(from_date=date(2015, 2, 10), types=['value'], to_date=date(2015, 2, 12)).index),
+                         ['ONE-3'])
+
+    def testIntervalIndex(self):
+        """
+        The intervals covering a day are the ones a scan would find
+        """
+
+        random = np.random.RandomState(4)
+
+        start = random.randint(0, 500, size=400)
+        end = start + random.randint(0, 40, size=400)
+
+        index = IntervalIndex(start, end)
+
+        for day in range(-2, 545, 7):
+            self.assertEqual(sorted(index.at(day)), list(np.flatnonzero((start <= day) & (end > day))))
+
+        self.assertEqual(len(IntervalIndex([], []).at(3)), 0)
+
+    def testSnapshot(self):
+
+        config = self.metrics_config()
+        config['states'] = ['Open', 'In Progress', 'QA', 'Closed']
+
+        metrics = Metrics(config=config)
+        metrics.load([WorkItem(id='ONE-1', title=None, state='Closed', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-01T08:00:00Z'),
+                               state_transitions=[transition('2015-02-09T09:00:00Z', 'QA', 'Closed'),
+                                                  transition('2015-02-05T09:00:00Z', 'In Progress', 'QA'),
+                                                  transition('2015-02-02T09:00:00Z', 'Open', 'In Progress')]),
+                      WorkItem(id='ONE-2', title=None, state='In Progress', type='Bug', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-02T08:00:00Z'),
+                               state_transitions=[transition('2015-02-03T09:00:00Z', 'Open', 'In Progress')]),
+                      WorkItem(id='ONE-3', title=None, state='Open', type='Story', history=None, category='one',
+                               date_created=dateutil.parser.parse('2015-02-10T08:00:00Z'),
+                               state_transitions=[])])
+
+        dates = [date(2015, 2, 1), date(2015, 2, 5), date(2015, 2, 10)]
+
+        actual = metrics.snapshot(dates)
+
+        self.assertEqual(list(actual.columns), ['Open', 'In Progress', 'QA', 'Closed'])
+        self.assertEqual(actual.values.tolist(), [[1, 0, 0, 0],
+                                                  [0, 1, 1, 0],
+                                                  [1, 1, 0, 1]])
+
+        detail = metrics.snapshot(dates, types=['value'], detail=True)
+
+        self.assertEqual(list(detail.index), ['ONE-1', 'ONE-1', 'ONE-1', 'ONE-3'])
+        self.assertEqual(list(detail['state']), ['Open', 'QA', 'Closed', 'Open'])
+
+        self.assertEqual(metrics.state_on(date(2015, 2, 4)).to_dict(), {'ONE-1': 'In Progress', 'ONE-2': 'In Progress'})
+
+    def testSnapshotMatchesHistory(self):
+        """
+        Each date's snapshot is the same as that day's row of the daily
+        history
+        """
+
+        workload = generate(60, seed=8)
+
+        metrics = Metrics(config=workload.config())
+        metrics.source.jira = SyntheticJira(workload)
+
+        dates = [date(2013, 3, 1), date(2013, 9, 14), date(2014, 6, 30)]
+
+        snapshot = metrics.snapshot(dates)
+        history = metrics.history(date(2013, 1, 1), workload.until_date.date())
+
+        for day in dates:
+            expected = history.loc[day].value_counts()
+            self.assertEqual(snapshot.loc[day][snapshot.loc[day] > 0].to_dict(), expected.to_dict())
@@ -0,0 +1,112 @@
+"""
+Timestamp parsing.
+
+JIRA and FogBugz only ever give us ISO-8601 timestamps in a handful of
+fixed layouts, e.g.
+
+    2012-11-12T09:54:29.284+0000    (JIRA)
+    2015-02-26T10:02:06Z            (FogBugz)
+
+so rather than have dateutil work out the format of every changelog entry
+we match those layouts directly and only hand anything else to dateutil.
+The results are equal to dateutil's, with offsets given as tzutc or
+tzoffset whatever the local timezone is.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+
+import dateutil.parser
+import numpy as np
+import pandas as pd
+from dateutil.tz import tzutc, tzoffset
+
+_ISO_8601 = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d)(?::(\d\d)(?:[.,](\d{1,6})\d*)?)?(Z|[+-]\d\d(?::?\d\d)?)?$')
+
+_UTC = tzutc()
+
+_timezones = {}
+_dates = {}
+
+
+def _timezone(designator):
+    """
+    The tzinfo dateutil would give for a UTC offset such as '+0100'
+    """
+
+    if designator is None:
+        return None
+
+    try:
+        return _timezones[designator]
+    except KeyError:
+        pass
+
+    if designator == 'Z':
+        timezone = _UTC
+    else:
+        digits = designator[1:].replace(':', '')
+        offset = int(digits[:2]) * 3600 + int(digits[2:4] or 0) * 60
+        if designator[0] == '-':
+            offset = -offset
+        timezone = _UTC if offset == 0 else tzoffset(None, offset)
+
+    _timezones[designator] = timezone
+    return timezone
+
+
+def parse_timestamp(text):
+    """
+    A datetime for a JIRA or FogBugz timestamp, falling back to dateutil
+    for anything that isn't ISO-8601
+    """
+
+    match = _ISO_8601.match(text)
+
+    if match is None:
+        return dateutil.parser.parse(text)
+
+    year, month, day, hour, minute, second, fraction, designator = match.groups()
+
+    microsecond = 0
+    if fraction is not None:
+        microsecond = int(fraction.ljust(6, '0'))
+
+    return datetime(int(year), int(month), int(day),
+                    int(hour), int(minute), int(second or 0), microsecond,
+                    _timezone(designator))
+
+
+def parse_date(text):
+    """
+    The date at the start of a timestamp, in the timestamp's own timezone
+    """
+
+    key = text[:10]
+
+    try:
+        return _dates[key]
+    except KeyError:
+        pass
+
+    try:
+        day = date(int(key[0:4]), int(key[5:7]), int(key[8:10]))
+    except ValueError:
+        return datetime.strptime(key, '%Y-%m-%d').date()
+
+    _dates[key] = day
+    return day
+
+
+def daily_index(start, days):
+    """
+    An index of days consecutive days from start.  Dates give the same
+    index of dates pd.Series would make of them and datetimes give a
+    DatetimeIndex, built without looking at each day.
+    """
+
+    if isinstance(start, datetime) and start.tzinfo is None and days > 0:
+        first = np.datetime64(start, 'us')
+        return pd.DatetimeIndex(first + np.arange(days) * np.timedelta64(1, 'D'))
+
+    return [start + timedelta(days=x) for x in range(0, days)]
@@ -0,0 +1,349 @@
+"""
+Flat, integer coded state transitions.
+
+Rather than walking the changelog of every work item each time we want
+to count something we gather every state transition once into parallel
+numpy arrays.  Days are held as the number of days since 1970-01-01 and
+states as indexes into a list of state names so that metrics can be
+calculated with a single bincount or groupby over the whole set.
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_number(day):
+    """
+    Days since 1970-01-01 for a date or datetime
+    """
+
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def day_date(number):
+    """
+    The date for a number of days since 1970-01-01
+    """
+
+    return date.fromordinal(int(number) + _EPOCH_ORDINAL)
+
+
+def week_ending_monday(days):
+    """
+    Label each day with the Monday that ends its week, as resampling
+    with 'W-MON' does.  1970-01-01 was a Thursday.
+    """
+
+    return days + np.mod(-(days + 3), 7)
+
+
+def week_starting_monday(days):
+    """
+    Label each day with the Monday that starts its ISO week, as
+    index.week_start_date does
+    """
+
+    return days - np.mod(days + 3, 7)
+
+
+def work_item_transitions(work_item):
+    """
+    JIRA work items keep their transitions in state_transitions and
+    the history as a daily series whereas FogBugz work items keep their
+    transitions in history.
+    """
+
+    if work_item.state_transitions is not None:
+        return work_item.state_transitions
+
+    if isinstance(work_item.history, list):
+        return work_item.history
+
+    return []
+
+
+def work_item_field_transitions(work_item, field):
+    """
+    The changes to another changelog field, e.g. Flagged or assignee,
+    if we kept them
+    """
+
+    field_transitions = getattr(work_item, 'field_transitions', None)
+
+    if field_transitions is None:
+        return []
+
+    return field_transitions.get(field, [])
+
+
+class Transitions(object):
+    """
+    Every state transition of a set of work items
+    """
+
+    def __init__(self, item, day, from_state, to_state, states, ids, seconds=None):
+
+        self.item = item
+        self.day = day
+        self.seconds = seconds
+        self.from_state = from_state
+        self.to_state = to_state
+        self.states = states
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.day)
+
+    @classmethod
+    def from_work_items(cls, work_items, states=None, field=None):
+        """
+        Collect the transitions of all work_items.  States given in
+        'states' keep their order, any others are numbered as found.
+
+        Given a field, collect the changes to that changelog field
+        instead, with its values coded as states.
+        """
+
+        codes = {}
+        state_names = []
+
+        def state_code(state):
+            try:
+                return codes[state]
+            except KeyError:
+                codes[state] = len(state_names)
+                state_names.append(state)
+                return codes[state]
+
+        if states is not None:
+            for state in states:
+                if state is not None:
+                    state_code(state)
+
+        item = []
+        day = []
+        seconds = []
+        from_state = []
+        to_state = []
+        ids = []
+
+        for index, work_item in enumerate(work_items):
+
+            ids.append(work_item.id)
+
+            if field is None:
+                changes = work_item_transitions(work_item)
+            else:
+                changes = work_item_field_transitions(work_item, field)
+
+            for transition in changes:
+
+                if transition is None:
+                    continue
+
+                timestamp = transition['timestamp']
+
+                item.append(index)
+                day.append(day_number(timestamp))
+                seconds.append(day[-1] * 86400 + timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second)
+                from_state.append(state_code(transition['from']))
+                to_state.append(state_code(transition['to']))
+
+        return cls(item=np.array(item, dtype=np.int64),
+                   day=np.array(day, dtype=np.int64),
+                   from_state=np.array(from_state, dtype=np.int64),
+                   to_state=np.array(to_state, dtype=np.int64),
+                   states=state_names,
+                   ids=ids,
+                   seconds=np.array(seconds, dtype=np.int64))
+
+    def window(self, from_date=None, to_date=None):
+        """
+        Boolean mask of the transitions which happened between from_date
+        and to_date inclusive
+        """
+
+        mask = np.ones(len(self.day), dtype=bool)
+
+        if from_date is not None:
+            mask &= self.day >= day_number(from_date)
+
+        if to_date is not None:
+            mask &= self.day <= day_number(to_date)
+
+        return mask
+
+
+def state_intervals(transitions, created, current, end_day):
+    """
+    The runs of days each work item spent in each state, up to end_day,
+    as arrays of work item, state, first day and the day after the last.
+
+    Each work item is in the state it was created in from the day in
+    created until its first transition.  Work items with no transitions
+    are in their current state code throughout.
+    """
+
+    order = np.lexsort((transitions.seconds, transitions.item))
+
+    item = transitions.item[order]
+    day = transitions.day[order]
+    from_state = transitions.from_state[order]
+    to_state = transitions.to_state[order]
+
+    first = np.ones(len(item), dtype=bool)
+    first[1:] = item[1:] != item[:-1]
+
+    last = np.ones(len(item), dtype=bool)
+    last[:-1] = item[1:] != item[:-1]
+
+    next_day = np.empty(len(item), dtype=np.int64)
+    next_day[:-1] = day[1:]
+    next_day[last] = end_day
+
+    unmoved = np.ones(len(created), dtype=bool)
+    unmoved[item] = False
+    unmoved = np.flatnonzero(unmoved)
+
+    run_item = np.concatenate([item[first], item, unmoved])
+    run_state = np.concatenate([from_state[first], to_state, current[unmoved]])
+    run_start = np.concatenate([created[item[first]], day, created[unmoved]])
+    run_end = np.concatenate([day[first], next_day, np.repeat(end_day, len(unmoved))])
+
+    run_end = np.maximum(np.minimum(run_end, end_day), run_start)
+
+    return run_item, run_state, run_start, run_end
+
+
+class IntervalIndex(object):
+    """
+    A centred interval tree over [start, end) day intervals, such as
+    those from state_intervals, for finding the intervals which cover a
+    day in O(log n + k).
+
+    Each node holds the intervals covering its centre day, sorted by
+    start and by end.  Intervals entirely before the centre go to the
+    left and entirely after it to the right.  Querying a day before the
+    centre takes the node's intervals starting on or before it and goes
+    left, otherwise those ending after it and goes right.
+    """
+
+    def __init__(self, start, end):
+
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+
+        self.centre = []
+        self.left = []
+        self.right = []
+        self.by_start = []
+        self.by_end = []
+
+        nonempty = np.flatnonzero(self.end > self.start)
+
+        if len(nonempty) > 0:
+            self._build(nonempty)
+
+    def __len__(self):
+        return len(self.start)
+
+    def _node(self, intervals):
+
+        centre = (self.start[intervals].min() + self.end[intervals].max()) // 2
+
+        covers = (self.start[intervals] <= centre) & (self.end[intervals] > centre)
+        here = intervals[covers]
+
+        self.centre.append(centre)
+        self.by_start.append(here[np.argsort(self.start[here], kind='mergesort')])
+        self.by_end.append(here[np.argsort(self.end[here], kind='mergesort')])
+        self.left.append(-1)
+        self.right.append(-1)
+
+        return centre, intervals[~covers]
+
+    def _build(self, intervals):
+
+        centre, rest = self._node(intervals)
+        pending = [(0, centre, rest)]
+
+        while pending:
+
+            node, centre, rest = pending.pop()
+
+            before = rest[self.end[rest] <= centre]
+            after = rest[self.start[rest] > centre]
+
+            for side, children in [(self.left, before), (self.right, after)]:
+                if len(children) > 0:
+                    side[node] = len(self.centre)
+                    child_centre, child_rest = self._node(children)
+                    pending.append((side[node], child_centre, child_rest))
+
+    def at(self, day):
+        """
+        The positions of the intervals covering day
+        """
+
+        found = []
+        node = 0 if len(self.centre) > 0 else -1
+
+        while node >= 0:
+
+            centre = self.centre[node]
+
+            if day < centre:
+                by_start = self.by_start[node]
+                found.append(by_start[:np.searchsorted(self.start[by_start], day, side='right')])
+                node = self.left[node]
+            else:
+                by_end = self.by_end[node]
+                found.append(by_end[np.searchsorted(self.end[by_end], day, side='right'):])
+                node = self.right[node] if day > centre else -1
+
+        if len(found) == 0:
+            return np.array([], dtype=np.int64)
+
+        return np.concatenate(found)
+
+
+def weekly_arrivals(transitions, from_date=None, to_date=None):
+    """
+    Number of transitions into each state each week, as a weeks x states
+    table.  Weeks run Tuesday to Monday and are labelled with the Monday.
+    """
+
+    mask = transitions.window(from_date, to_date)
+
+    return weekly_counts(transitions.day[mask], transitions.to_state[mask], transitions.states)
+
+
+def weekly_counts(days, codes, states, counts=None):
+    """
+    How many of each of states there were on days, or given counts how
+    many of those, as a weeks x states table labelled as weekly_arrivals
+    """
+
+    weeks = week_ending_monday(days)
+
+    if len(weeks) == 0:
+        return pd.DataFrame()
+
+    num_states = len(states)
+    first_week = weeks.min()
+    num_weeks = (weeks.max() - first_week) // 7 + 1
+
+    cells = ((weeks - first_week) // 7) * num_states + codes
+    counts = np.bincount(cells, weights=counts, minlength=num_weeks * num_states).astype(np.int64)
+    counts = counts.reshape(num_weeks, num_states)
+
+    arrived = counts.sum(axis=0) > 0
+
+    index = pd.to_datetime([day_date(first_week + 7 * week) for week in range(num_weeks)])
+    columns = [state for state, seen in zip(states, arrived) if seen]
+
+    return pd.DataFrame(counts[:, arrived], index=index, columns=columns)
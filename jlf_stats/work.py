@@ -14,7 +14,8 @@ class WorkItem(object):
                  date_created,
                  state_transitions=None,
                  category=None,
-                 cycles=None):
+                 cycles=None,
+                 field_transitions=None):
         self.id = id
         self.title = title
         self.state = state
@@ -24,6 +25,7 @@ class WorkItem(object):
         self.category = category
         self.cycles = cycles
         self.state_transitions = state_transitions
+        self.field_transitions = field_transitions
 
     def __str__(self):
         return unicode(self).encode('utf-8')
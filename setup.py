@@ -19,7 +19,7 @@ setup(
     license="LICENSE.md",
     author_email="chris@chrisyoung.org",
     platforms=["Any"],
-    packages=['jlf_stats'],
+    packages=['jlf_stats', 'jlf_stats.benchmark'],
     include_package_data=True,
     scripts=['bin/jlf'],
     setup_requires=['numpy'],